@@ -12,7 +12,7 @@ args = p.parse_args()
 
 #TODO option to create indexes, do this at the very end (after inserts)
 
-dbi = DBInterface(args.path)
+dbi = DBInterface(args.path, priority="bulk")
 c_out = connect(f"file:{args.fname_out}?mode=rwc")
 tables = dbi.query("select name from sqlite_master where type='table' and name not like 'sqlite_%';")
 tables = [t[0] for t in tables]
@@ -22,8 +22,9 @@ for table in tables:
     try:
         table_create_stmt = dbi.query(f"select sql from sqlite_master where name == '{table}'")[0][0] #depending on version, may need "sqlite_schema" instead of "sqlite_master"
         c_out.execute(table_create_stmt)
-        rows = dbi.query(f"select * from {table} where gcutime >= {args.t1} and gcutime <= {args.t2}")
-        if rows:
+        # streamed in batches, a single query call is refused by the server above its row limit
+        sql = f"select * from {table} where gcutime >= ? and gcutime <= ?"
+        for rows in dbi.query_stream(sql, int(args.batch_size), arrays=False, params=(float(args.t1), float(args.t2))):
             ncols = len(rows[0])
             qm = ','.join(['?'] * ncols)
             c_out.executemany(f"insert into {table} values({qm})", rows)
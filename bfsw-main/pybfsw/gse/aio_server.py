@@ -0,0 +1,200 @@
+import asyncio
+import socket
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+from threading import Lock
+from quickle import dumps, loads
+
+# asyncio alternative to the rpyc ThreadedServer of gsequery.rpc_server.
+#
+# the wire protocol is a stream of length prefixed frames: a 4 byte big endian
+# length followed by a quickle payload.
+# requests are (method, args, kwargs) tuples, where method is the name of a
+# DBInterfaceRemote exposed_ method without the prefix.
+# replies are ("ok", result) or ("error", exception type, message) tuples, sent
+# in the order the requests were received.
+#
+# every client gets its own DBInterfaceRemote session, exactly as with rpyc, but
+# the sockets are all served by one event loop and the sqlite work runs in a
+# bounded thread pool, so clients do not cost one OS thread each.
+
+HEADER = struct.Struct(">I")
+
+# cheap methods answered on the event loop, so that a cancel is not queued behind
+# the statements it is meant to interrupt when all the workers are busy
+INLINE = {"get_session_id", "cancel", "set_priority"}
+
+
+async def read_frame(reader):
+    (n,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return await reader.readexactly(n)
+
+
+def frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+class AioServer:
+    def __init__(self, service, max_workers=8, bulk_workers=2, live_workers=2):
+        """
+        service is a callable returning a new session object (a DBInterfaceRemote classpartial)
+        max_workers bounds the number of threads running sqlite work for all clients together.
+        the calls of bulk priority sessions run in their own pool of bulk_workers threads, so
+        that bulk calls waiting for the scheduler do not hold all the workers, and the calls of
+        live priority sessions in their own pool of live_workers threads, so that they reach the
+        scheduler (which keeps a slot for them) without queueing behind analysis calls
+        """
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.executors = {
+            "bulk": ThreadPoolExecutor(max_workers=bulk_workers),
+            "live": ThreadPoolExecutor(max_workers=live_workers),
+        }
+        self.nclients = 0
+
+    async def run_in_executor(self, func, *args, executor=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor or self.executor, partial(func, *args, **kwargs))
+
+    async def handle_client(self, reader, writer):
+        session = self.service()
+        await self.run_in_executor(session.on_connect, None)
+        peer = writer.get_extra_info("peername")
+        if peer:
+            session.host = session.client = peer[0]
+        self.nclients += 1
+        try:
+            while True:
+                try:
+                    request = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                method, args, kwargs = loads(request)
+                session.last_record = None
+                func = getattr(session, "exposed_" + method, None)
+                if func is None:
+                    reply = ("error", "AttributeError", f"no such method: {method}")
+                else:
+                    try:
+                        if method in INLINE:
+                            reply = ("ok", func(*args, **kwargs))
+                        else:
+                            executor = self.executors.get(session.control.priority)
+                            reply = ("ok", await self.run_in_executor(func, *args, executor=executor, **kwargs))
+                    except Exception as e:
+                        reply = ("error", type(e).__name__, str(e))
+                t0 = perf_counter()
+                writer.write(frame(dumps(reply)))
+                await writer.drain()
+                if session.last_record is not None:
+                    # time until the reply was handed to the kernel, not until it was received
+                    session.metrics.add_transfer(session.last_record, perf_counter() - t0)
+        finally:
+            self.nclients -= 1
+            await self.run_in_executor(session.on_disconnect, None)
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_client, host, int(port))
+        print(f"asyncio rpc server listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+class RemoteError(RuntimeError):
+    pass
+
+
+class PendingReply:
+    """
+    a request that has been sent but whose reply may not have been read yet.
+    value waits for (and returns) the result, like rpyc's AsyncResult
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.ready = False
+        self.reply = None
+
+    @property
+    def value(self):
+        self.connection.wait(self)
+        status, *rest = self.reply
+        if status == "ok":
+            return rest[0]
+        etype, message = rest
+        if etype == "AttributeError":
+            raise AttributeError(message)
+        raise RemoteError(f"{etype}: {message}")
+
+
+class FramedMethod:
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        return self.async_(*args, **kwargs).value
+
+    def async_(self, *args, **kwargs):
+        """
+        send the request without waiting for the reply, several requests can be in flight
+        """
+        return self.connection.send(self.name, args, kwargs)
+
+
+class FramedConnection:
+    """
+    client side of AioServer. connection.root.method(*args) calls DBInterfaceRemote.exposed_method
+    on the server, so DBInterface can use it in place of an rpyc connection
+    """
+
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, int(port)))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile("rb")
+        self.lock = Lock()
+        self.pending = deque()
+        self.root = self
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return FramedMethod(self, name)
+
+    def send(self, name, args, kwargs):
+        pending = PendingReply(self)
+        with self.lock:
+            self.sock.sendall(frame(dumps((name, args, kwargs))))
+            self.pending.append(pending)
+        return pending
+
+    def wait(self, pending):
+        with self.lock:
+            while not pending.ready:
+                header = self.file.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    raise ConnectionError("connection closed by the server")
+                (n,) = HEADER.unpack(header)
+                first = self.pending.popleft()
+                first.reply = loads(self.file.read(n))
+                first.ready = True
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def aio_server(host, port, max_workers=8, bulk_workers=2, live_workers=2, **kwargs):
+    """
+    serve a sqlite db file with AioServer. kwargs are the options of gsequery.make_service
+    """
+    from pybfsw.gse.gsequery import make_service
+
+    server = AioServer(
+        make_service(**kwargs), max_workers=max_workers, bulk_workers=bulk_workers, live_workers=live_workers
+    )
+    asyncio.run(server.serve(host, port))
@@ -0,0 +1,357 @@
+from pybfsw.gse.rpc_tools import open_readonly, gcutime_bounds, inline_params
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import chain, islice
+from operator import itemgetter
+from os.path import getmtime, getsize, join
+from threading import Lock
+from bisect import bisect_right
+from glob import glob
+from time import monotonic
+import heapq
+import re
+import numpy as np
+
+# query a directory of gse db files (the live db and its rotated or archived copies, e.g. made
+# with pybfsw/common/sqlite_time_subset.py) as if it was one db.
+#
+# the Catalog knows the gcutime range of every file. a time bounded statement is only run on the
+# files overlapping its bounds, in parallel, and the rows are merged in gcutime order.
+# where files overlap (an archive cut out of the live db) every time segment is owned by the widest
+# file covering it, and rows of the other files in that segment are dropped, so nothing is returned twice.
+
+# a rowid compared to a value (a lastptr), or ordered descending (the last rowid), means nothing
+# across files: these statements of the live tools read the primary file, where their pointers come
+# from. a rowid after an or is the tie-break of a gcutime comparison (keyset pages, live windows):
+# rows with equal gcutime all live in the file owning that instant, so it is federated as usual
+ROWID_POINTER = re.compile(
+    r"(\bor\s+)?\b(?:\w+\.)?rowid\s*(?:[<>!]?=|[<>]|==)\s*(?:\?|:\w+|[-+]?[0-9]|\(\s*select\b)",
+    flags=re.IGNORECASE,
+)
+ROWID_LATEST = re.compile(r"order\s+by\s+(?:\w+\.)?rowid\s+desc\b", flags=re.IGNORECASE)
+# statements asking for the latest rows
+LATEST = re.compile(r"\bdesc\b|\bmax\s*\(", flags=re.IGNORECASE)
+DESCENDING = re.compile(r"order\s+by\s+(?:\w+\.)?gcutime\s+desc\b", flags=re.IGNORECASE)
+AGGREGATE = re.compile(
+    r"\b(?:count|sum|total|avg|min|max|group_concat)\s*\(|\bgroup\s+by\b", flags=re.IGNORECASE
+)
+LIMIT = re.compile(r"\blimit\s+([0-9]+)(?:\.0)?\s*;?\s*$", flags=re.IGNORECASE)
+
+
+def rowid_pointer(sql):
+    """
+    whether sql uses a rowid as a pointer, see ROWID_POINTER
+    """
+    if ROWID_LATEST.search(sql):
+        return True
+    return any(m.group(1) is None for m in ROWID_POINTER.finditer(sql))
+
+
+def statement_limit(sql, params=()):
+    """
+    the row limit of the statement (a limit clause ending it, possibly a parameter), None if there is none
+    """
+    m = LIMIT.search(inline_params(sql, params))
+    return int(m.group(1)) if m else None
+
+
+class Catalog:
+    """
+    gcutime ranges of the sqlite files matching pattern in directory. the range of a file is
+    the union over its tables with a gcutime column. ranges are recomputed for files whose size
+    or mtime changed, at most every refresh_interval seconds.
+    the primary file is the one reaching furthest in time (normally the live db)
+    """
+
+    def __init__(self, directory, pattern="*.sqlite", refresh_interval=5.0):
+        self.directory = directory
+        self.pattern = pattern
+        self.refresh_interval = refresh_interval
+        self.lock = Lock()
+        self.entries = {}
+        self.layout = ({}, [], [])
+        self.last_refresh = None
+        self.refresh()
+        if not self.entries:
+            raise ValueError(f"no db files with data matching {pattern} in {directory}")
+
+    def time_range(self, path):
+        connection = open_readonly(path)
+        try:
+            tmin = tmax = None
+            tables = connection.execute(
+                "select name from sqlite_master where type='table' and name not like 'sqlite_%'"
+            ).fetchall()
+            for (table,) in tables:
+                columns = [row[1] for row in connection.execute(f"pragma table_info({table})")]
+                if "gcutime" not in columns:
+                    continue
+                # separate statements so that both can use a gcutime index
+                lo = connection.execute(f"select min(gcutime) from {table}").fetchall()[0][0]
+                hi = connection.execute(f"select max(gcutime) from {table}").fetchall()[0][0]
+                if lo is None:
+                    continue
+                tmin = lo if tmin is None else min(tmin, lo)
+                tmax = hi if tmax is None else max(tmax, hi)
+            return tmin, tmax
+        finally:
+            connection.close()
+
+    def refresh(self, force=False):
+        with self.lock:
+            now = monotonic()
+            if not force and self.last_refresh is not None and now - self.last_refresh < self.refresh_interval:
+                return
+            self.last_refresh = now
+            entries = {}
+            for path in sorted(glob(join(self.directory, self.pattern))):
+                try:
+                    stamp = (getmtime(path), getsize(path))
+                    entry = self.entries.get(path)
+                    if entry is None or entry["stamp"] != stamp:
+                        tmin, tmax = self.time_range(path)
+                        entry = {"path": path, "stamp": stamp, "tmin": tmin, "tmax": tmax}
+                except Exception as e:
+                    print(f"catalog: skipping {path}: {e}")
+                    continue
+                if entry["tmin"] is not None:
+                    entries[path] = entry
+            segments = self.owned_segments(entries)
+            self.entries = entries
+            self.layout = (entries, segments, [seg[0] for seg in segments])
+
+    @staticmethod
+    def owned_segments(entries):
+        """
+        split time at every file boundary and give each piece to the widest file covering it.
+        returns a list of (start, end, path, closed): pieces are [start, end), or [start, end]
+        when closed (the last piece before a gap or the end)
+        """
+        if not entries:
+            return []
+        points = sorted({e["tmin"] for e in entries.values()} | {e["tmax"] for e in entries.values()})
+        pieces = list(zip(points, points[1:])) or [(points[0], points[0])]
+        segments = []
+        for a, b in pieces:
+            covering = [e for e in entries.values() if e["tmin"] <= a and e["tmax"] >= b]
+            if not covering:
+                continue
+            owner = max(covering, key=lambda e: (e["tmax"] - e["tmin"], e["stamp"][0]))["path"]
+            if segments and segments[-1][2] == owner and segments[-1][1] == a:
+                segments[-1] = (segments[-1][0], b, owner)
+            else:
+                segments.append((a, b, owner))
+        return [
+            (a, b, owner, i + 1 == len(segments) or segments[i + 1][0] > b)
+            for i, (a, b, owner) in enumerate(segments)
+        ]
+
+    @property
+    def primary(self):
+        entries = self.layout[0]
+        return max(entries.values(), key=lambda e: e["tmax"])["path"]
+
+    def owner(self, t):
+        """
+        the path of the file owning time t
+        """
+        _, segments, starts = self.layout
+        i = bisect_right(starts, t) - 1
+        if i < 0:
+            return None
+        _, end, path, closed = segments[i]
+        if t < end or (t == end and closed):
+            return path
+        return None
+
+    def plan(self, t1=None, t2=None):
+        """
+        the files to read for gcutime in [t1, t2] (None is unbounded), in time order, as a list of
+        (path, intervals, exclusive): the (start, end, closed) pieces of [t1, t2] the file owns, and
+        whether it owns everything it holds in [t1, t2] (so its rows need no filtering)
+        """
+        self.refresh()
+        entries, segments, _ = self.layout
+        lo = -np.inf if t1 is None else t1
+        hi = np.inf if t2 is None else t2
+        owned = {}
+        for a, b, path, closed in segments:
+            if b < lo or a > hi:
+                continue
+            owned.setdefault(path, []).append((max(a, lo), min(b, hi), closed or b > hi))
+        plan = []
+        for path, intervals in owned.items():
+            entry = entries[path]
+            held = (max(entry["tmin"], lo), min(entry["tmax"], hi))
+            # an open interval ending at the file's last row leaves that instant to the next file
+            exclusive = len(intervals) == 1 and intervals[0] == held + (True,)
+            plan.append((path, intervals, exclusive))
+        plan.sort(key=lambda p: p[1][0][0])
+        return plan
+
+    def describe(self):
+        entries = self.layout[0]
+        return [
+            {"path": e["path"], "tmin": e["tmin"], "tmax": e["tmax"]}
+            for e in sorted(entries.values(), key=lambda e: e["tmin"])
+        ]
+
+
+class FederatedCursor:
+    """
+    the rows of one statement run on several files, merged on the gcutime column (the last
+    column named gcutime) when there is one and concatenated in file time order otherwise.
+    rows of files that do not own their time segment are dropped.
+    the merge is in gcutime order when the statement is ordered by gcutime, in descending order
+    when descending. every file applies the limit of the statement, so it is applied again to the
+    merged rows
+    """
+
+    def __init__(self, federation, cursors, filters, descending=False, limit=None):
+        self.federation = federation
+        self.cursors = cursors
+        self.filters = filters
+        self.descending = descending
+        self.limit = limit
+        self.description = cursors[0].description
+        names = [d[0] for d in self.description]
+        self.key = len(names) - 1 - names[::-1].index("gcutime") if "gcutime" in names else None
+        self.merged = None
+
+    def select(self, rows, owner):
+        if owner is None or self.key is None:
+            return rows
+        catalog_owner = self.federation.catalog.owner
+        return [r for r in rows if catalog_owner(r[self.key]) == owner]
+
+    def stream(self, cursor, owner):
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                return
+            yield from self.select(rows, owner)
+
+    def merge(self, parts):
+        if self.key is None:
+            merged = chain(*parts)
+        else:
+            if self.descending:
+                # the files were planned in time order
+                parts = parts[::-1]
+            merged = heapq.merge(*parts, key=itemgetter(self.key), reverse=self.descending)
+        return islice(merged, self.limit)
+
+    def fetchmany(self, n=1):
+        if self.merged is None:
+            self.merged = self.merge(
+                [self.stream(c, f) for c, f in zip(self.cursors, self.filters)]
+            )
+        return list(islice(self.merged, n))
+
+    def fetchall(self):
+        if self.merged is not None:
+            return list(self.merged)
+        # read the files in parallel
+        parts = self.federation.map(
+            lambda part: self.select(part[0].fetchall(), part[1]), zip(self.cursors, self.filters)
+        )
+        self.merged = iter(())
+        return list(self.merge(parts))
+
+    def close(self):
+        for cursor in self.cursors:
+            cursor.close()
+
+
+class Federation:
+    """
+    stands in for the sqlite connection of a single db file: execute(sql, params) routes a
+    select to the files overlapping its gcutime bounds (all of them when it has no explicit
+    bounds) and returns a cursor over the merged rows. pragma, explain and sqlite_master
+    statements go to the primary file, and so do statements without bounds asking for the latest
+    rows (ordered desc, or using max(), e.g. get_latest_time and get_latest_value). rowids are per
+    file, statements using a rowid pointer (the lastptr of tracker_query2 or get_latest_rows,
+    get_latest_n_rows) go to the primary (live) file as well.
+    aggregates cannot be merged, an aggregate over more than one file raises ValueError: use
+    binned() for time binned ones
+
+    connect(path) opens the connection to one file, limit() is entered around the sqlite work
+    done in the worker threads (e.g. a StatementControl.limit)
+    """
+
+    def __init__(self, catalog, connect=open_readonly, limit=None, max_workers=4):
+        self.catalog = catalog
+        self.connect = connect
+        self.limit = limit or nullcontext
+        self.connections = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def connection(self, path):
+        connection = self.connections.get(path)
+        if connection is None:
+            connection = self.connections[path] = self.connect(path)
+        return connection
+
+    def map(self, func, items):
+        def run(item):
+            with self.limit():
+                return func(item)
+
+        return list(self.executor.map(run, list(items)))
+
+    def execute(self, sql, params=()):
+        primary = re.match(r"\s*(pragma|explain)\b", sql, flags=re.IGNORECASE) or re.search(
+            r"\bsqlite_(?:master|schema)\b", sql, flags=re.IGNORECASE
+        )
+        bounds = gcutime_bounds(sql, params)
+        if primary or rowid_pointer(sql) or (bounds == (None, None) and LATEST.search(sql)):
+            return self.connection(self.catalog.primary).execute(sql, params)
+        plan = self.catalog.plan(*bounds)
+        if not plan:
+            # no file in range, the primary file gives the empty result
+            return self.connection(self.catalog.primary).execute(sql, params)
+        if len(plan) == 1 and plan[0][2]:
+            return self.connection(plan[0][0]).execute(sql, params)
+        if AGGREGATE.search(sql):
+            raise ValueError(
+                "aggregates over several files of a federated db cannot be merged, use binned() "
+                "(DBInterface.time_binned) for time binned ones"
+            )
+        connections = [self.connection(path) for path, _, _ in plan]
+        cursors = self.map(lambda c: c.execute(sql, params), connections)
+        filters = [None if exclusive else path for path, _, exclusive in plan]
+        return FederatedCursor(
+            self, cursors, filters, DESCENDING.search(sql) is not None, statement_limit(sql, params)
+        )
+
+    def binned(self, table, column, where, t1, t2, nbins):
+        """
+        binned_query over the files, each file reducing the time segments it owns
+        """
+        from pybfsw.gse.gsequery import binned_query, merge_bins
+
+        jobs = []
+        for path, intervals, exclusive in self.catalog.plan(t1, t2):
+            if exclusive:
+                jobs.append((path, where))
+                continue
+            for a, b, closed in intervals:
+                cut = f"gcutime >= {a!r} and gcutime {'<=' if closed else '<'} {b!r}"
+                jobs.append((path, f"({where}) and {cut}" if where else cut))
+        arrays = self.map(
+            lambda job: binned_query(self.connection(job[0]), table, column, job[1], t1, t2, nbins),
+            jobs,
+        )
+        if not arrays:
+            return binned_query(self.connection(self.catalog.primary), table, column, where, t1, t2, nbins)
+        return merge_bins(arrays)
+
+    def interrupt(self):
+        for connection in self.connections.values():
+            connection.interrupt()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for connection in self.connections.values():
+            connection.close()
+        self.connections = {}
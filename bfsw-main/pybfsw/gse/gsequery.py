@@ -1,13 +1,49 @@
 import numpy as np
 from pybfsw.gse.parameter import parameter_from_string, ParameterBank, Parameter
-from os.path import expandvars, expanduser
+from pybfsw.gse.federation import Catalog, Federation
+from pybfsw.gse.rpc_tools import (
+    ConnectionPool,
+    ResultCache,
+    QueryGuard,
+    QueryRejected,
+    StatementControl,
+    SessionRegistry,
+    QueryMetrics,
+    RowTailer,
+    SingleFlight,
+    QueryScheduler,
+    PRIORITIES,
+    CountingConnection,
+    CACHED_STATEMENTS,
+    statement_stats,
+    plain_params,
+    params_key,
+    open_readonly,
+    normalize_sql,
+    sql_tables,
+)
+from os.path import expandvars, expanduser, basename, isdir
 from quickle import dumps, loads
-from sqlite3 import connect
+from sqlite3 import connect, Error as SqliteError
 import rpyc
+import zlib
+import lzma
+import bz2
+import sys
+import re
+from time import perf_counter, monotonic, time
+from collections import deque
+from operator import itemgetter
+from threading import Thread, Event, Lock
+from queue import Queue, Empty, Full
 
-# TODO: implement some limiting behavior, to prevent issuing some massive query that hangs the system
 # TODO: make sure current where clause handling can handle more than one predicate
 
+# in-memory db in which declared_types resolves the result columns of a statement
+TYPES_DB = None
+TYPES_CACHE = {}
+TYPES_LOCK = Lock()
+
 
 def get_db_path():
     env = "$GSE_DB_PATH"
@@ -27,83 +63,1526 @@ def get_project_name():
         return None
 
 
+def sqlite_dtype(decltype):
+    """
+    map a declared sqlite column type to a numpy dtype, following the sqlite type affinity rules.
+    returns None if the declared type does not determine a fixed size numpy type (text, blob, or no type)
+    """
+    if not decltype:
+        return None
+    t = decltype.upper()
+    if "INT" in t:
+        return np.dtype(np.int64)
+    if "CHAR" in t or "CLOB" in t or "TEXT" in t or "BLOB" in t:
+        return None
+    return np.dtype(np.float64)
+
+
+def statement_without_params(sql):
+    """
+    sql with its ? and :name placeholders replaced by NULL (outside string literals), as a view
+    cannot have parameters
+    """
+    return re.sub(
+        r"('(?:[^']|'')*')|\?[0-9]*|[:@$][A-Za-z_][A-Za-z0-9_]*",
+        lambda m: m.group(1) or "NULL",
+        sql,
+    )
+
+
+def declared_types(connection, sql):
+    """
+    the declared types of the result columns of sql, in order: for a result column that is a
+    plain column reference (resolved by sqlite through aliases, joins and subqueries) the declared
+    type of that table column, None for expressions and aggregates, which are typed from their
+    values. sqlite resolves them in a view of sql over an empty copy of the tables of sql, made
+    in an in-memory db, and cached per statement and table schemas. returns an empty list when
+    sql is not a select it can resolve
+    """
+    global TYPES_DB
+    tables = {}
+    for table in dict.fromkeys(sql_tables(sql)):
+        if table.lower().startswith("sqlite_"):
+            continue
+        columns = connection.execute(f"pragma table_info({table})").fetchall()
+        if columns:
+            tables[table] = ", ".join('"{}" {}'.format(row[1].replace('"', '""'), row[2]) for row in columns)
+    key = (sql, tuple(tables.items()))
+    with TYPES_LOCK:
+        types = TYPES_CACHE.get(key)
+        if types is not None:
+            return types
+        if TYPES_DB is None:
+            TYPES_DB = connect(":memory:", check_same_thread=False, isolation_level=None)
+        TYPES_DB.execute("begin")
+        try:
+            for table, columns in tables.items():
+                TYPES_DB.execute(f"create table {table} ({columns})")
+            TYPES_DB.execute(f"create temp view result_columns as {statement_without_params(sql)}")
+            types = [row[2] or None for row in TYPES_DB.execute("pragma temp.table_info(result_columns)")]
+        except SqliteError:
+            types = []
+        finally:
+            TYPES_DB.execute("rollback")
+        if len(TYPES_CACHE) >= 1024:
+            TYPES_CACHE.clear()
+        TYPES_CACHE[key] = types
+        return types
+
+
+def value_dtype(values):
+    """
+    infer a numpy dtype for a column from its values. NULLs make an integer column float64 (they
+    become nan), text and blob columns keep their type (NULLs become empty strings)
+    """
+    kinds = set(map(type, values))
+    if kinds <= {int}:
+        return np.dtype(np.int64)
+    if kinds <= {int, float, type(None)}:
+        return np.dtype(np.float64)
+    if kinds <= {str, type(None)}:
+        return np.dtype(f"U{max(1, max(len(v or '') for v in values))}")
+    if kinds <= {bytes, type(None)}:
+        return np.dtype(f"S{max(1, max(len(v or b'') for v in values))}")
+    raise TypeError(f"cannot convert a column with value types {kinds} to a numpy array")
+
+
+def rows_to_array(rows, description, types):
+    """
+    build a numpy structured array from a list of result tuples.
+    description is the cursor description, types is the result of declared_types.
+    declared real columns are float64, the other columns are typed from their values: a declared
+    integer column is int64 only when all its values are integers, it is float64 with NULLs as nan
+    when it holds NULLs or reals (values never get truncated).
+    NULLs in text and blob columns are returned as empty strings
+    """
+    names = []
+    for d in description:
+        name = d[0]
+        while name in names:
+            name += "_"
+        names.append(name)
+    declared = [sqlite_dtype(types[i]) if i < len(types) else None for i in range(len(description))]
+    dtypes = []
+    nulls = False
+    for i, dt in enumerate(declared):
+        if rows and (dt is None or dt.kind == "i"):
+            if dt is None or not set(map(type, map(itemgetter(i), rows))) <= {int}:
+                values = [row[i] for row in rows]
+                dt = value_dtype(values)
+                nulls = nulls or (dt.kind in "US" and None in values)
+        dtypes.append(dt if dt is not None else np.dtype(np.float64))
+    if not nulls:
+        try:
+            return np.array(rows, dtype=list(zip(names, dtypes)))
+        except (TypeError, ValueError):
+            pass  # declared types do not match the stored values (e.g. text in a real column)
+    # column by column, typing the mismatched columns from their values
+    columns = list(zip(*rows))
+    dtypes = [
+        value_dtype(values) if dt.kind == "f" and d is not None else dt
+        for dt, d, values in zip(dtypes, declared, columns)
+    ]
+    array = np.empty(len(rows), dtype=list(zip(names, dtypes)))
+    for name, values, dt in zip(names, columns, dtypes):
+        if dt.kind in "US" and None in values:
+            empty = "" if dt.kind == "U" else b""
+            values = [empty if v is None else v for v in values]
+        array[name] = values
+    return array
+
+
+def cursor_to_columns(cursor, types, limit=None, batch_size=65536):
+    """
+    read the rows of cursor into a dict of 1-D numpy arrays, one per result column, named and
+    typed as by rows_to_array. the rows are converted batch by batch, so the full result never
+    exists as a list of tuples. at most limit rows are read
+    """
+    parts = []
+    nrows = 0
+    while limit is None or nrows < limit:
+        rows = cursor.fetchmany(batch_size if limit is None else min(batch_size, limit - nrows))
+        if not rows:
+            break
+        nrows += len(rows)
+        parts.append(rows_to_array(rows, cursor.description, types))
+    if not parts:
+        parts.append(rows_to_array([], cursor.description, types))
+    # concatenate promotes the batches of columns typed from their values (e.g. longer strings)
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0].dtype.names}
+
+
+def binned_query(connection, table, column, where, t1, t2, nbins):
+    """
+    reduce column of table over [t1,t2) to nbins equal time bins, in sqlite.
+    returns a structured array with one entry per non-empty bin:
+    bin (bin index), min, max, mean, count
+    """
+    t1 = float(t1)
+    t2 = float(t2)
+    nbins = int(nbins)
+    if nbins < 1 or t2 <= t1:
+        raise ValueError("need nbins >= 1 and t2 > t1")
+    width = (t2 - t1) / nbins
+    sql = (
+        f"select cast((gcutime - ?) / ? as integer) as bin, min({column}), max({column}), avg({column}), count({column}) "
+        f"from {table} where gcutime >= ? and gcutime < ?"
+    )
+    if where:
+        sql += f" and ({where})"
+    sql += " group by bin order by bin"
+    rows = connection.execute(sql, (t1, width, t1, t2)).fetchall()
+    dtype = [
+        ("bin", np.int64),
+        ("min", np.float64),
+        ("max", np.float64),
+        ("mean", np.float64),
+        ("count", np.int64),
+    ]
+    return np.array(rows, dtype=dtype)
+
+
+def merge_bins(arrays):
+    """
+    combine binned_query results over disjoint sets of rows (e.g. from several db files)
+    """
+    a = np.sort(np.concatenate(arrays), order="bin")
+    if len(a) == 0:
+        return a
+    bins, first = np.unique(a["bin"], return_index=True)
+    merged = np.empty(len(bins), dtype=a.dtype)
+    merged["bin"] = bins
+    merged["min"] = np.minimum.reduceat(a["min"], first)
+    merged["max"] = np.maximum.reduceat(a["max"], first)
+    merged["count"] = np.add.reduceat(a["count"], first)
+    merged["mean"] = np.add.reduceat(a["mean"] * a["count"], first) / merged["count"]
+    return merged
+
+
+def keyset_sql(select, key_table, where=None):
+    """
+    statements of a keyset paginated query over the time ordered key_table, ordered by (gcutime, rowid).
+    returns (keys_sql, page_sql): keys_sql finds the keys of the next page (after the key
+    (:ag, :ar), before :t2, at most :n rows), page_sql is select with {page} replaced by the
+    key_table rows of the page, (:ag, :ar) excluded to (:lg, :lr) included.
+    both seek on the gcutime index, so a page costs the same anywhere in the table
+    """
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", key_table):
+        raise ValueError(f"bad table name: {key_table}")
+    cut = f" and ({where})" if where else ""
+    keys_sql = (
+        f"select gcutime, rowid from {key_table} "
+        f"where gcutime >= :ag and gcutime < :t2 and (gcutime > :ag or rowid > :ar){cut} "
+        "order by gcutime, rowid limit :n"
+    )
+    page = (
+        f"(select *, rowid from {key_table} "
+        "where gcutime >= :ag and gcutime <= :lg and (gcutime > :ag or rowid > :ar) "
+        f"and (gcutime < :lg or rowid <= :lr){cut})"
+    )
+    if select is None:
+        select = "select * from {page} order by gcutime, rowid"
+    return keys_sql, select.replace("{page}", page)
+
+
+def keyset_page(connection, select, key_table, where, t1, t2, after, n):
+    """
+    one page of n key_table rows in [t1, t2) after the (gcutime, rowid) key after (None for the first page),
+    read in one short transaction. returns (rows, description, page_sql, next) where next is the key
+    to pass as after for the following page, None once the range is exhausted
+    """
+    keys_sql, sql = keyset_sql(select, key_table, where)
+    if after is None:
+        after = (t1, -(2**63))
+    params = {"ag": float(after[0]), "ar": int(after[1]), "t2": float(t2), "n": int(n)}
+    # a federation has no transaction of its own
+    own = not getattr(connection, "in_transaction", True)
+    if own:
+        connection.execute("begin")
+    try:
+        keys = connection.execute(keys_sql, params).fetchall()
+        params["lg"], params["lr"] = keys[-1] if keys else (params["ag"], params["ar"])
+        cursor = connection.execute(sql, params)
+        rows = cursor.fetchall()
+        description = cursor.description
+    finally:
+        if own:
+            connection.commit()
+    return rows, description, sql, (tuple(keys[-1]) if len(keys) == params["n"] else None)
+
+
+TRACKER_HIT_COLUMNS = (
+    "gfptrackerpacket.sysid, gfptrackerhit.row, gfptrackerhit.module, gfptrackerhit.channel, "
+    "gfptrackerhit.adcdata, gfptrackerhit.asiceventcode, gfptrackerpacket.rowid, gfptrackerpacket.gcutime"
+)
+TRACKER_HIT_JOIN = (
+    "gfptrackerhit "
+    "join gfptrackerevent on gfptrackerhit.parent = gfptrackerevent.rowid "
+    "join gfptrackerpacket on gfptrackerevent.parent = gfptrackerpacket.rowid"
+)
+
+# narrow types of the tracker_hits columns, those of the fields in the tracker hit packets
+TRACKER_HIT_DTYPES = {
+    "layer": np.uint8,
+    "row": np.uint8,
+    "module": np.uint8,
+    "channel": np.uint8,
+    "adcdata": np.uint16,
+    "asiceventcode": np.uint8,
+    "eventid": np.uint32,
+    "rowid": np.int64,
+    "gcutime": np.float64,
+}
+
+# strides of the packed global channel index, see tracker_channel_index
+TRACKER_ROWS = 6
+TRACKER_MODULES = 6
+TRACKER_CHANNELS = 32
+
+
+def tracker_channel_index(layer, row, module, channel):
+    """
+    pack (layer, row, module, channel) into one global channel number, for scalars or numpy arrays:
+    ((layer * TRACKER_ROWS + row) * TRACKER_MODULES + module) * TRACKER_CHANNELS + channel.
+    channels of the same module are consecutive, so e.g. np.bincount(index) histograms all the
+    channels at once. layer is the sysid byte minus 128, as in tracker_hits
+    """
+    row, module, channel = np.asarray(row), np.asarray(module), np.asarray(channel)
+    if np.any(row >= TRACKER_ROWS) or np.any(module >= TRACKER_MODULES) or np.any(channel >= TRACKER_CHANNELS):
+        raise ValueError("row, module or channel out of range of the packed channel index")
+    index = ((np.asarray(layer, dtype=np.int32) * TRACKER_ROWS + row) * TRACKER_MODULES + module) * TRACKER_CHANNELS
+    return index + channel
+
+
+def tracker_channel_unpack(index):
+    """
+    inverse of tracker_channel_index, returns (layer, row, module, channel)
+    """
+    index, channel = np.divmod(index, TRACKER_CHANNELS)
+    index, module = np.divmod(index, TRACKER_MODULES)
+    layer, row = np.divmod(index, TRACKER_ROWS)
+    return layer, row, module, channel
+
+
+def tail_sql(table, where=None):
+    """
+    the RowTailer statement following the new rows of table, returns (sql, key table).
+    rows are those of get_latest_rows (*, rowid, gcutime), for gfptrackerhit they are
+    those of tracker_query2, keyed by the packet rowid
+    """
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", table):
+        raise ValueError(f"bad table name: {table}")
+    if table == "gfptrackerhit":
+        select, source, key_table = TRACKER_HIT_COLUMNS, TRACKER_HIT_JOIN, "gfptrackerpacket"
+    else:
+        select, source, key_table = "*, rowid, gcutime", table, table
+    sql = f"select {select} from {source} where {key_table}.rowid > ? and {key_table}.rowid <= ?"
+    if where:
+        sql += f" and ({where})"
+    return sql + f" order by {key_table}.rowid asc", key_table
+
+
+def array_to_wire(array):
+    return dumps((np.lib.format.dtype_to_descr(array.dtype), array.tobytes()))
+
+
+def array_from_wire(data):
+    descr, buffer = loads(data)
+    return np.frombuffer(buffer, dtype=np.lib.format.descr_to_dtype(descr))
+
+
+def columns_to_wire(columns):
+    return dumps(
+        [(name, np.lib.format.dtype_to_descr(a.dtype), a.tobytes()) for name, a in columns.items()]
+    )
+
+
+def columns_from_wire(data):
+    return {
+        name: np.frombuffer(buffer, dtype=np.lib.format.descr_to_dtype(descr))
+        for name, descr, buffer in loads(data)
+    }
+
+
+def _codecs():
+    """
+    returns a dict of the available wire compression codecs.
+    each value is a (compress(data, level), decompress(data), default level) tuple.
+    zstd and lz4 are used if the zstandard / lz4 packages are installed.
+    """
+    codecs = {
+        "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress, 1),
+        "lzma": (
+            lambda data, level: lzma.compress(data, preset=level),
+            lzma.decompress,
+            0,
+        ),
+        "bz2": (lambda data, level: bz2.compress(data, level), bz2.decompress, 1),
+    }
+    try:
+        import zstandard
+
+        codecs["zstd"] = (
+            lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data),
+            3,
+        )
+    except ImportError:
+        pass
+    try:
+        import lz4.frame
+
+        codecs["lz4"] = (
+            lambda data, level: lz4.frame.compress(data, compression_level=level),
+            lz4.frame.decompress,
+            0,
+        )
+    except ImportError:
+        pass
+    return codecs
+
+
+CODECS = _codecs()
+
+
+class BatchPrefetcher:
+    """
+    produces result batches from a cursor in a background thread, so that sqlite stepping
+    and serialization of batch k+1 overlap with the transfer and processing of batch k.
+
+    fetchmany(n) reads the next rows of the cursor, produce(rows) turns a list of rows into
+    the batch to return.
+    the batch size follows the n of the most recent fetch call, a batch that
+    was already prepared keeps the size it was prepared with.
+    """
+
+    def __init__(self, fetchmany, produce, depth=1):
+        self.fetchmany = fetchmany
+        self.produce = produce
+        self.requests = Queue()
+        self.results = Queue(maxsize=depth)
+        self.stopped = Event()
+        self.done = False
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        n = self.requests.get()
+        while n is not None and not self.stopped.is_set():
+            try:
+                rows = self.fetchmany(n)
+                item = (self.produce(rows), len(rows))
+            except Exception as e:
+                item = (e, 0)
+            while not self.stopped.is_set():
+                try:
+                    self.results.put(item, timeout=0.1)
+                    break
+                except Full:
+                    pass
+            if item[1] == 0:
+                return
+            try:
+                while True:
+                    n = self.requests.get_nowait()
+            except Empty:
+                pass
+
+    def fetch(self, n):
+        if self.done:
+            return self.produce([])
+        self.requests.put(n)
+        batch, nrows = self.results.get()
+        if nrows == 0:
+            self.done = True
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def close(self):
+        self.stopped.set()
+        self.requests.put(None)
+        self.thread.join()
+
+
+class CursorState:
+    """
+    a streaming query: the sqlite cursor, the declared types of its columns,
+    and (server side) the prefetch thread serving it
+    """
+
+    def __init__(self, cursor, types, prefetch=False, sql=None):
+        self.cursor = cursor
+        self.types = types
+        self.prefetch = prefetch
+        self.sql = sql
+        self.sqlite_time = 0.0
+        self.prefetcher = None
+        self.prefetch_kind = None
+        self.last_used = monotonic()
+
+    def close(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+        self.cursor.close()
+
+
+class CursorTable:
+    """
+    the cursors of one connection. query_start returns the id of a new cursor, and
+    fetch/close calls take that id. calls without an id use the most recently started cursor,
+    so single stream clients do not need to care about ids.
+    a cursor that is not named replaces the previous unnamed one, like the single stream of a
+    connection used to, only named cursors stay open side by side until they are closed.
+    at most max_cursors can be open at once, and cursors that have not been used for
+    idle_timeout seconds are closed (None disables either limit)
+    """
+
+    def __init__(self, max_cursors=None, idle_timeout=None):
+        self.max_cursors = max_cursors
+        self.idle_timeout = idle_timeout
+        self.cursors = {}
+        self.next_id = 1
+        self.default_id = None
+        self.unnamed_id = None
+
+    def add(self, state, named=False):
+        self.reap()
+        if not named and self.unnamed_id is not None:
+            self.close(self.unnamed_id)
+        if self.max_cursors is not None and len(self.cursors) >= self.max_cursors:
+            raise RuntimeError(
+                f"too many open cursors (limit is {self.max_cursors}), close some with query_close"
+            )
+        cursor_id = self.next_id
+        self.next_id += 1
+        self.cursors[cursor_id] = state
+        self.default_id = cursor_id
+        if not named:
+            self.unnamed_id = cursor_id
+        return cursor_id
+
+    def get(self, cursor_id=None):
+        self.reap()
+        if cursor_id is None:
+            cursor_id = self.default_id
+        if cursor_id not in self.cursors:
+            if cursor_id is None:
+                raise RuntimeError("you must call query_start before fetching")
+            raise RuntimeError(f"unknown or expired cursor {cursor_id}")
+        state = self.cursors[cursor_id]
+        state.last_used = monotonic()
+        return state
+
+    def close(self, cursor_id=None):
+        if cursor_id is None:
+            cursor_id = self.default_id
+        state = self.cursors.pop(cursor_id, None)
+        if state is not None:
+            state.close()
+        if cursor_id == self.unnamed_id:
+            self.unnamed_id = None
+        if cursor_id == self.default_id:
+            # back to the unnamed stream, when a named one started after it is closed
+            self.default_id = self.unnamed_id
+
+    def reap(self):
+        if self.idle_timeout is None:
+            return
+        now = monotonic()
+        for cursor_id in [
+            i for i, c in self.cursors.items() if now - c.last_used > self.idle_timeout
+        ]:
+            print(f"closing cursor {cursor_id} after {self.idle_timeout} s idle")
+            self.close(cursor_id)
+
+    def close_all(self):
+        for cursor_id in list(self.cursors):
+            self.close(cursor_id)
+
+
+class AdaptiveBatchSize:
+    """
+    chooses the fetch size for a stream of batches. after every batch, n is moved towards
+    the size that would take target_time seconds and stay below max_bytes, based on the
+    measured time and size per row. n changes by at most a factor 2 per batch and stays
+    within [n_min, n_max] (the server rejects fetches above 1,000,000 rows).
+    """
+
+    def __init__(
+        self, n=10000, target_time=0.5, max_bytes=32 * 2**20, n_min=1000, n_max=1000000
+    ):
+        self.n = n
+        self.target_time = target_time
+        self.max_bytes = max_bytes
+        self.n_min = n_min
+        self.n_max = n_max
+        self.history = []
+
+    def update(self, n, nrows, nbytes, seconds):
+        self.history.append(n)
+        if nrows < n or seconds <= 0:
+            return  # last (partial) batch of the stream, not representative
+        target = self.target_time * nrows / seconds
+        if nbytes:
+            target = min(target, self.max_bytes * nrows / nbytes)
+        target = min(max(target, self.n / 2), self.n * 2)
+        self.n = int(min(max(target, self.n_min), self.n_max))
+
+
+class PendingFetch:
+    """
+    a request sent with fetch(*args) (an rpyc or aio async method) whose reply is awaited by a
+    background thread, so that the next batch is transferred while the caller processes the
+    current one. seconds is the round trip time of the request, without the time the caller
+    spent elsewhere before asking for value
+    """
+
+    def __init__(self, fetch, *args):
+        self.t0 = perf_counter()
+        self.seconds = None
+        self.result = None
+        self.error = None
+        self.pending = fetch(*args)
+        self.thread = Thread(target=self.wait, daemon=True)
+        self.thread.start()
+
+    def wait(self):
+        try:
+            self.result = self.pending.value
+        except BaseException as e:
+            self.error = e
+        self.seconds = perf_counter() - self.t0
+
+    @property
+    def value(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
 class DBInterface:
-    def __init__(self, path=None):
+    def __init__(
+        self, path=None, compression=None, compression_level=None, client_name=None, priority=None
+    ):
+        """
+        path is either a path to a sqlite file or a host:port string for a remote (rpc) db.
+        a directory of sqlite files is queried as one db (see federation.py).
+        the remote transport can be selected with a url scheme: rpyc://host:port (the default)
+        for the rpyc server, aio://host:port for the asyncio server (see aio_server.py)
+
+        compression (remote only) is a codec name, or a list of codec names in order of
+        preference, e.g. ["zstd","zlib"]. the server picks the first one it supports, and
+        result batches are then compressed for the whole connection. the codec in use is
+        stored in self.compression, and per batch statistics (sizes, ratio, server compression
+        time and client decompression time) are appended to self.compression_stats
+
+        client_name identifies this client in the server metrics (see stats()), it defaults
+        to the name of the running script
+
+        priority (remote only) is the class the server schedules the calls of this client in:
+        "live" for panels and safety checks, "analysis" (the server default) or "bulk" for
+        downloads, see set_priority
+        """
+
         if path is None:
             path = get_db_path()
         servers = {"local": "127.0.0.1:44555"}
         if path in servers:
             path = servers[path]
-        if len(path.split(":")) == 2:
+        scheme, _, address = path.rpartition("://")
+        if scheme == "aio":
+            from pybfsw.gse.aio_server import FramedConnection
+
+            self.remote = True
+            self.framed = True
+            host, port = address.split(":")
+            self.connection = FramedConnection(host, port)
+        elif len(address.split(":")) == 2:
             self.remote = True
-            host, port = path.split(":")
+            self.framed = False
+            host, port = address.split(":")
             self.connection = rpyc.connect(host, int(port))
+        elif isdir(path):
+            self.framed = False
+            self.remote = False
+            self.connection = Federation(Catalog(path))
         else:
+            self.framed = False
             self.remote = False
             full_path = f"file:{path}?mode=ro"
-            self.connection = connect(full_path, uri=True, timeout=2)
+            self.connection = connect(
+                full_path,
+                uri=True,
+                timeout=2,
+                factory=CountingConnection,
+                cached_statements=CACHED_STATEMENTS,
+            )
         self.path = path
-        self.cursor = None
+        self.cursors = CursorTable()
+        self.compression = None
+        self.compression_stats = deque(maxlen=1000)
+        self.fetch_stats = deque(maxlen=1000)
+        self.session_id = None
+        self.tailer = None
+        self.serving_thread = None
+        if self.remote:
+            try:
+                self.session_id = self.connection.root.get_session_id()
+            except AttributeError:
+                pass  # older server without cancel support
+            if client_name is None:
+                client_name = basename(sys.argv[0]) or "python"
+            try:
+                self.connection.root.set_client_name(client_name)
+            except AttributeError:
+                pass  # older server without metrics
+        if self.remote and compression is not None:
+            self.negotiate_compression(compression, compression_level)
+        if priority is not None:
+            self.set_priority(priority)
+
+    def set_priority(self, priority):
+        """
+        schedule the following calls of this client in the priority class priority ("live",
+        "analysis" or "bulk"), live calls are not queued behind bulk ones. no effect on a local db
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"unknown priority {priority}, choose from {PRIORITIES}")
+        if not self.remote:
+            return
+        try:
+            self.connection.root.set_priority(priority)
+        except AttributeError:
+            pass  # older server without scheduling
+
+    def negotiate_compression(self, compression, level=None):
+        if isinstance(compression, str):
+            compression = [compression]
+        offered = [c for c in compression if c in CODECS]
+        if not offered:
+            raise ValueError(f"none of the codecs {compression} is available, choose from {list(CODECS)}")
+        try:
+            self.compression = self.connection.root.negotiate_compression(offered, level)
+        except AttributeError:
+            self.compression = None  # older server without compression support
+        return self.compression
+
+    def decode(self, data):
+        """
+        undo the wire compression of a result batch, recording the batch statistics
+        """
+        if not isinstance(data, tuple):
+            return data
+        codec, payload, raw_size, compress_time = data
+        t0 = perf_counter()
+        raw = CODECS[codec][1](payload)
+        self.compression_stats.append(
+            {
+                "codec": codec,
+                "raw_bytes": raw_size,
+                "wire_bytes": len(payload),
+                "ratio": raw_size / max(1, len(payload)),
+                "compress_time": compress_time,
+                "decompress_time": perf_counter() - t0,
+            }
+        )
+        return raw
+
+    def remote_call(self, method, sql, params, *args, **kwargs):
+        """
+        call a remote query method, passing params only when there are some (older servers do not take them)
+        """
+        func = getattr(self.connection.root, method)
+        if params:
+            # named parameters travel as (name, value) pairs, see plain_params
+            params = tuple(params.items()) if isinstance(params, dict) else tuple(params)
+            return func(sql, *args, params=params, **kwargs)
+        return func(sql, *args, **kwargs)
+
+    def query(self, sql, params=None):
+        """
+        run sql and return the list of result rows. params are the values bound to the ? (a sequence)
+        or :name (a dict) placeholders of sql: a statement polled with parameters keeps the same text,
+        so sqlite (and the server) reuse its compiled plan, see statement_stats
+        """
+        if self.remote:
+            data = self.remote_call("query", sql, params)
+            return loads(self.decode(data))
+        else:
+            return self.connection.execute(sql, params or ()).fetchall()
+
+    def query_arrays(self, sql, params=None):
+        """
+        run sql and return the result as a dict of 1-D numpy arrays, one per column (see
+        cursor_to_columns), typed as by rows_to_array: integer columns stay integers (float64 with
+        NULLs as nan when they hold NULLs or reals), expressions are typed from their values.
+        the server sends every column as one raw buffer, so no row tuples are
+        built on the client. params as for query
+        """
+        if self.remote:
+            data = self.remote_call("query_arrays", sql, params)
+            return columns_from_wire(self.decode(data))
+        cursor = self.connection.execute(sql, params or ())
+        return cursor_to_columns(cursor, declared_types(self.connection, sql))
+
+    def statement_stats(self):
+        """
+        prepared statement cache counters of this client's db connection (on the server in the remote
+        case): compiles counts the statements sqlite had to compile, reuses those served by a cached
+        plan. a poll loop using bound parameters should only add reuses
+        """
+        if self.remote:
+            return loads(self.connection.root.statement_stats())
+        if isdir(self.path):
+            totals = {"compiles": 0, "reuses": 0}
+            for connection in self.connection.connections.values():
+                counts = statement_stats(connection)
+                for key in totals:
+                    totals[key] += counts.get(key, 0)
+            return totals
+        return statement_stats(self.connection)
+
+    def cancel(self):
+        """
+        abort the statement this connection is running, meant to be called from another thread
+        (e.g. a gui stop button). the remote statement is cancelled through a second, short lived
+        connection since this one is busy waiting for the reply. the interrupted call raises.
+        returns whether a statement was running
+        """
+        if not self.remote:
+            self.connection.interrupt()
+            return True
+        if self.session_id is None:
+            raise RuntimeError("the server does not support cancel")
+        side = DBInterface(self.path)
+        try:
+            return side.connection.root.cancel(self.session_id)
+        finally:
+            side.connection.close()
+
+    def stats(self, top=10, by="sqlite_time"):
+        """
+        query metrics of a remote server: the top (client, sql fingerprint) pairs sorted by one of
+        calls, rows, bytes, sqlite_time, serialize_time or transfer_time, per client totals,
+        latency histograms and the most recent calls
+        """
+        return loads(self.connection.root.stats(top, by))
 
-    def query(self, sql):
+    def subscribe(self, table, callback, where=None, watermark=None):
+        """
+        follow the new rows of table (optionally only those matching the where clause) without
+        polling: callback(rows) is called from a background thread with every batch of new rows,
+        rows as returned by tail_sql. without watermark the rows added from now on are delivered,
+        with a (rowid, gcutime) watermark the rows after it are delivered first.
+        gui code should hand the rows over to its own thread (e.g. with a Qt signal).
+        returns a subscription id for unsubscribe
+        """
+        sql, key_table = tail_sql(table, where)
+        deliver = lambda data: callback(loads(data))
+        if not self.remote:
+            if self.tailer is None:
+                path = self.path
+                if isdir(path):
+                    path = self.connection.catalog.primary
+                self.tailer = RowTailer(open_readonly(path))
+            return self.tailer.subscribe(sql, key_table, watermark, deliver)
+        if self.framed:
+            raise RuntimeError("subscriptions need the rpyc server, not the asyncio server")
+        if self.serving_thread is None:
+            # serves the server's callbacks
+            self.serving_thread = rpyc.BgServingThread(self.connection)
+        return self.connection.root.subscribe(table, where, watermark, deliver)
+
+    def unsubscribe(self, subscription_id):
         if self.remote:
-            data = self.connection.root.query(sql)
-            return loads(data)
+            self.connection.root.unsubscribe(subscription_id)
+        elif self.tailer is not None:
+            self.tailer.unsubscribe(subscription_id)
+
+    def guard_stats(self):
+        if self.remote:
+            return loads(self.connection.root.guard_stats())
+        return {}
+
+    def query_start(self, sql, prefetch=False, params=None, named=False):
+        """
+        start a streaming query, the rows are then read with query_fetch or query_fetch_array.
+        returns a cursor id (without an id, fetch calls use the most recently started stream).
+        a new stream replaces the previous one, unless named is True: named streams stay open
+        side by side on the same connection until query_close, and are selected by passing their
+        id to query_fetch/query_fetch_array/query_close. the server limits the number of open
+        named streams.
+        with prefetch=True (remote only) the server prepares the next batch in a background
+        thread while the current one is being transferred. params as for query
+        """
+        if self.remote:
+            args = (True,) if prefetch else ()
+            if named:
+                return self.remote_call("query_start", sql, params, *args, named=True)
+            return self.remote_call("query_start", sql, params, *args)
         else:
-            return self.connection.execute(sql).fetchall()
+            cursor = self.connection.execute(sql, params or ())
+            return self.cursors.add(
+                CursorState(cursor, declared_types(self.connection, sql)), named
+            )
 
-    def query_start(self, sql):
+    def query_fetch(self, n, cursor_id=None):
         if self.remote:
-            self.connection.root.query_start(sql)
+            if cursor_id is None:
+                data = self.connection.root.query_fetch(n)
+            else:
+                data = self.connection.root.query_fetch(n, cursor_id)
+            return loads(self.decode(data))
         else:
-            self.cursor = self.connection.execute(sql)
+            return self.cursors.get(cursor_id).cursor.fetchmany(n)
+
+    def query_fetch_array(self, n, cursor_id=None):
+        """
+        like query_fetch, but returns the next n rows as a numpy structured array.
+        the array is typed from the declared column types, and in the remote case
+        it is rebuilt from the raw buffer sent by the server without copying (it is read-only)
+        """
+        if self.remote:
+            if cursor_id is None:
+                data = self.connection.root.query_fetch_array(n)
+            else:
+                data = self.connection.root.query_fetch_array(n, cursor_id)
+            return array_from_wire(self.decode(data))
+        else:
+            state = self.cursors.get(cursor_id)
+            return rows_to_array(
+                state.cursor.fetchmany(n), state.cursor.description, state.types
+            )
+
+    def time_binned(self, table, column, where, t1, t2, nbins):
+        """
+        per bin min/max/mean/count of column over nbins time bins in [t1,t2), computed by sqlite
+        (on the server in the remote case). see binned_query
+        """
+        if self.remote:
+            data = self.connection.root.time_binned(table, column, where, t1, t2, nbins)
+            return array_from_wire(self.decode(data))
+        elif isdir(self.path):
+            return self.connection.binned(table, column, where, t1, t2, nbins)
+        else:
+            return binned_query(self.connection, table, column, where, t1, t2, nbins)
+
+    def pool_stats(self):
+        """
+        connection pool statistics of a remote server (connections opened, open/warm-up time,
+        leases served by warm connections)
+        """
+        return loads(self.connection.root.pool_stats())
+
+    def cache_stats(self):
+        """
+        result cache statistics of a remote server (hits, misses, invalidations, evictions, size)
+        """
+        return loads(self.connection.root.cache_stats())
+
+    def catalog(self):
+        """
+        the files of a federated db (a directory, local or served by rpc_server) and their time ranges
+        """
+        if self.remote:
+            return loads(self.connection.root.describe_catalog())
+        if isdir(self.path):
+            return self.connection.catalog.describe()
+        return []
 
-    def query_fetch(self,n):
+    def query_page(self, select, key_table, t1, t2, after=None, n=10000, where=None, arrays=True):
+        """
+        one page of a stateless keyset paginated query over the time ordered key_table (e.g. a
+        packet table), see keyset_sql. select is the statement to run over the n key_table rows of
+        the page, written with {page} in place of the table (None selects the key_table rows), where
+        restricts the key_table rows. the server keeps no cursor: each page is one short read
+        transaction, so pages never hold back the writer and can be fetched in parallel (on shards of
+        [t1, t2)) or resumed after a disconnect.
+        returns (batch, next), next is the (gcutime, rowid) key to pass as after for the following
+        page, None after the last page
+        """
+        if self.remote:
+            data, next_key = self.connection.root.query_page(
+                select, key_table, where, t1, t2, after, n, "array" if arrays else "rows"
+            )
+            data = self.decode(data)
+            return (array_from_wire(data) if arrays else loads(data)), next_key
+        rows, description, sql, next_key = keyset_page(
+            self.connection, select, key_table, where, t1, t2, after, n
+        )
+        if arrays:
+            return rows_to_array(rows, description, declared_types(self.connection, sql)), next_key
+        return rows, next_key
+
+    def query_pages(self, select, key_table, t1, t2, n, after=None, where=None, arrays=True):
+        """
+        generator over the pages of query_page from after (None for the start of [t1, t2)), yielding
+        (batch, key) with key the position after the batch, to resume from after an interruption.
+        n can be "adaptive" (or an AdaptiveBatchSize instance) as for query_stream, it then counts
+        key_table rows per page. in the remote case the next page is requested before the current one
+        is handed to the caller
+        """
+        if n == "adaptive":
+            n = AdaptiveBatchSize()
+        sizer = n if isinstance(n, AdaptiveBatchSize) else None
+        kind = "array" if arrays else "rows"
+
+        def record(k, nrows, nbytes, dt, full):
+            self.fetch_stats.append({"n": k, "rows": nrows, "bytes": nbytes, "seconds": dt})
+            if sizer:
+                # a full page (next_key set) counts as k rows for the sizer
+                sizer.update(k, k if full else 0, nbytes, dt)
+
+        if not self.remote:
+            while True:
+                k = sizer.n if sizer else n
+                t0 = perf_counter()
+                batch, after = self.query_page(select, key_table, t1, t2, after, k, where, arrays)
+                record(k, len(batch), batch.nbytes if arrays else None, perf_counter() - t0, after is not None)
+                yield batch, after
+                if after is None:
+                    return
+
+        fetch = self.connection.root.query_page
+        fetch = fetch.async_ if self.framed else rpyc.async_(fetch)
+        k = sizer.n if sizer else n
+        request = PendingFetch(fetch, select, key_table, where, t1, t2, after, k, kind)
+        while True:
+            data, next_key = request.value
+            nbytes = len(data[1]) if isinstance(data, tuple) else len(data)
+            data = self.decode(data)
+            batch = array_from_wire(data) if arrays else loads(data)
+            record(k, len(batch), nbytes, request.seconds, next_key is not None)
+            if next_key is not None:
+                k = sizer.n if sizer else n
+                request = PendingFetch(fetch, select, key_table, where, t1, t2, next_key, k, kind)
+            yield batch, next_key
+            if next_key is None:
+                return
+
+    def query_close(self, cursor_id=None):
         if self.remote:
-            data = self.connection.root.query_fetch(n)
-            return loads(data)
+            self.connection.root.query_close(cursor_id)
         else:
-            return self.cursor.fetchmany(n)
+            self.cursors.close(cursor_id)
+
+    def query_stream(self, sql, n, arrays=True, params=None):
+        """
+        generator over the result batches of sql, n rows at a time. batches are numpy
+        structured arrays (see query_fetch_array) if arrays is True, lists of tuples otherwise.
+        params as for query
+
+        n can be "adaptive" (or an AdaptiveBatchSize instance), in which case the fetch size
+        is adjusted after every batch from the measured batch time and size.
+        the requested size, rows, bytes and time of every batch are appended to self.fetch_stats
+
+        in the remote case the server prefetches the next batch, and the request for batch k+1
+        is issued asynchronously before batch k is handed to the caller, so that sqlite stepping
+        on the server, the transfer and the processing by the caller all overlap
+        """
+        if n == "adaptive":
+            n = AdaptiveBatchSize()
+        sizer = n if isinstance(n, AdaptiveBatchSize) else None
+
+        def next_n():
+            return sizer.n if sizer else n
+
+        def record(n, nrows, nbytes, dt):
+            self.fetch_stats.append({"n": n, "rows": nrows, "bytes": nbytes, "seconds": dt})
+            if sizer:
+                sizer.update(n, nrows, nbytes, dt)
+
+        if not self.remote:
+            cursor_id = self.query_start(sql, params=params, named=True)
+            fetch = self.query_fetch_array if arrays else self.query_fetch
+            try:
+                while True:
+                    k = next_n()
+                    t0 = perf_counter()
+                    batch = fetch(k, cursor_id)
+                    record(k, len(batch), batch.nbytes if arrays else None, perf_counter() - t0)
+                    if len(batch) == 0:
+                        return
+                    yield batch
+            finally:
+                self.query_close(cursor_id)
+
+        cursor_id = self.query_start(sql, prefetch=True, params=params, named=True)
+        if arrays:
+            fetch, unpack = self.connection.root.query_fetch_array, array_from_wire
+        else:
+            fetch, unpack = self.connection.root.query_fetch, loads
+        fetch = fetch.async_ if self.framed else rpyc.async_(fetch)
+        try:
+            k = next_n()
+            request = PendingFetch(fetch, k, cursor_id)
+            while True:
+                data = request.value
+                batch = unpack(self.decode(data))
+                # the round trip only, the time the caller spends on the previous batch is not counted
+                record(k, len(batch), len(data[1]) if isinstance(data, tuple) else len(data), request.seconds)
+                if len(batch) == 0:
+                    return
+                k = next_n()
+                request = PendingFetch(fetch, k, cursor_id)
+                yield batch
+        finally:
+            self.query_close(cursor_id)
+
 
 class DBInterfaceRemote(rpyc.Service):
     def __init__(self, *args, **kwargs):
         self.db_file_path = kwargs["db_file_path"]
-        self.cursor = None
+        self.pool = kwargs.get("pool")
+        self.result_cache = kwargs.get("result_cache")
+        self.guard = kwargs.get("guard") or QueryGuard()
+        self.sessions = kwargs.get("sessions") or SessionRegistry()
+        self.metrics = kwargs.get("metrics") or QueryMetrics()
+        self.tailer = kwargs.get("tailer")
+        self.subscriptions = set()
+        self.catalog = kwargs.get("catalog")
+        self.federation = None
+        self.flight = kwargs.get("flight") or SingleFlight()
+        self.scheduler = kwargs.get("scheduler")
+        self.host = "local"
+        self.client = self.host
+        self.last_record = None
+        self.control = StatementControl(self.guard, self.scheduler)
+        self.session_id = None
+        self.connection = None
+        self.cursors = CursorTable(
+            max_cursors=kwargs.get("max_cursors", 16),
+            idle_timeout=kwargs.get("cursor_idle_timeout", 600),
+        )
+        self.compression = None
+        self.compression_level = None
 
     def on_connect(self, conn):
-        path = self.db_file_path
-        if path is None:
-            path = get_db_path()
-        full_path = f"file:{path}?mode=ro"
-        from sqlite3 import connect
+        if self.pool is not None:
+            self.connection = self.pool.lease()
+        else:
+            path = self.db_file_path
+            if path is None:
+                path = get_db_path()
+            # the connection is shared with the prefetch thread
+            self.connection = open_readonly(path)
+        self.control.install(self.connection)
+        self.session_id = self.sessions.add(self.control)
+        if self.catalog is not None:
+            self.federation = Federation(
+                self.catalog, connect=self.open_file, limit=self.control.limit
+            )
+        if conn is not None:
+            try:
+                self.host = conn._config["endpoints"][1][0]
+            except (KeyError, IndexError, TypeError):
+                pass
+            self.client = self.host
+
+    def exposed_set_client_name(self, name):
+        self.client = f"{name}@{self.host}"
+
+    def exposed_set_priority(self, priority):
+        """
+        priority class of the calls of this session, one of PRIORITIES (see QueryScheduler)
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"unknown priority {priority}, choose from {PRIORITIES}")
+        self.control.priority = priority
+
+    def record(self, sql, kind, rows, data, sqlite_time, serialize_time, cached=False):
+        """
+        add a call to the server metrics, data is the encoded result sent to the client
+        """
+        nbytes = len(data[1]) if isinstance(data, tuple) else len(data)
+        self.last_record = self.metrics.record(
+            self.client, sql, kind, rows, nbytes, sqlite_time, serialize_time, cached
+        )
+
+    def exposed_stats(self, top=10, by="sqlite_time"):
+        stats = self.metrics.stats(top, by)
+        if self.tailer is not None:
+            stats["subscriptions"] = self.tailer.stats()
+        stats["coalescing"] = self.flight.stats()
+        if self.scheduler is not None:
+            stats["scheduling"] = self.scheduler.stats()
+        if self.pool is not None:
+            stats["statements"] = self.pool.statement_stats()
+        return dumps(stats)
+
+    def exposed_subscribe(self, table, where, watermark, callback):
+        """
+        push the new rows of table to callback(data), see DBInterface.subscribe
+        """
+        if self.tailer is None:
+            raise RuntimeError("subscriptions are not enabled on this server")
+        sql, key_table = tail_sql(table, where)
+        self.guard.check(self.connection, sql, (0, 0))
+        if watermark is not None:
+            watermark = tuple(watermark)
+        subscription_id = self.tailer.subscribe(sql, key_table, watermark, rpyc.async_(callback))
+        self.subscriptions.add(subscription_id)
+        return subscription_id
+
+    def exposed_unsubscribe(self, subscription_id):
+        if subscription_id in self.subscriptions:
+            self.subscriptions.remove(subscription_id)
+            self.tailer.unsubscribe(subscription_id)
+
+    def open_file(self, path):
+        """
+        connection to one file of the federation, the session's own connection for the primary file
+        """
+        if path == self.db_file_path:
+            return self.connection
+        connection = open_readonly(path)
+        self.control.install(connection)
+        return connection
+
+    def execute(self, sql, params=()):
+        if self.federation is not None:
+            return self.federation.execute(sql, params)
+        return self.connection.execute(sql, params)
+
+    def on_disconnect(self, conn):
+        self.sessions.remove(self.session_id)
+        for subscription_id in self.subscriptions:
+            self.tailer.unsubscribe(subscription_id)
+        self.cursors.close_all()
+        if self.federation is not None:
+            # the primary connection goes back to the pool below
+            self.federation.connections.pop(self.db_file_path, None)
+            self.federation.close()
+        if self.pool is not None:
+            self.pool.release(self.connection)
+        else:
+            self.connection.close()
+
+    def exposed_get_session_id(self):
+        return self.session_id
+
+    def exposed_cancel(self, session_id):
+        """
+        interrupt the running statements of the session session_id, returns whether there were any
+        """
+        return self.sessions.cancel(session_id)
+
+    def exposed_guard_stats(self):
+        return dumps(self.guard.stats())
 
-        self.connection = connect(full_path, uri=True, timeout=2)
+    def exposed_statement_stats(self):
+        return dumps(statement_stats(self.connection))
 
-    def exposed_query(self, sql):
-        results = self.connection.execute(sql).fetchall()
+    def exposed_pool_stats(self):
+        if self.pool is None:
+            return dumps({})
+        return dumps(self.pool.stats())
+
+    def exposed_negotiate_compression(self, offered, level=None):
+        """
+        pick the first codec in offered that this server supports, and use it for
+        all result batches of this connection. returns the codec name, or None
+        """
+        for codec in offered:
+            if codec in CODECS:
+                self.compression = codec
+                self.compression_level = CODECS[codec][2] if level is None else level
+                return codec
+        self.compression = None
+        return None
+
+    def encode(self, data):
+        """
+        compress a serialized result batch with the negotiated codec.
+        uncompressed batches are sent as plain bytes, compressed ones as
+        a (codec, payload, raw size, compression time) tuple
+        """
+        if self.compression is None:
+            return data
+        t0 = perf_counter()
+        payload = CODECS[self.compression][0](data, self.compression_level)
+        dt = perf_counter() - t0
+        self.metrics.add_compression(self.compression, len(data), len(payload), dt)
+        return (self.compression, payload, len(data), dt)
+
+    def exposed_query(self, sql, params=None):
+        return self.cached_query(sql, "query", self.run_serialized, params)
+
+    def exposed_query_arrays(self, sql, params=None):
+        return self.cached_query(sql, "arrays", self.run_columns, params)
+
+    def cached_query(self, sql, kind, run, params=None):
+        """
+        answer a query call of kind from the result cache, or with the serialized result
+        run(sql, key, watermark, params) returns as (data, nrows, sqlite_time, serialize_time)
+        """
+        params = plain_params(params)
+        self.guard.check(self.connection, sql, params)
+        # the result cache reads the sql from key[0]
+        key = (normalize_sql(sql), kind, params_key(params))
+        if self.result_cache is not None:
+            data = self.result_cache.get(self.connection, key)
+            if data is not None:
+                t0 = perf_counter()
+                data = self.encode(data)
+                self.record(sql, kind, 0, data, 0.0, perf_counter() - t0, cached=True)
+                return data
+            watermark = self.result_cache.watermark(self.connection, sql)
+        else:
+            watermark = None
+        # identical statements running at the same time share one execution and serialization
+        (data, nrows, sqlite_time, serialize_time), shared = self.flight.do(
+            key, lambda: run(sql, key, watermark, params)
+        )
+        t0 = perf_counter()
+        encoded = self.encode(data)
+        if shared:
+            self.record(sql, kind, nrows, encoded, 0.0, perf_counter() - t0, cached=True)
+        else:
+            self.record(sql, kind, nrows, encoded, sqlite_time, serialize_time + perf_counter() - t0)
+        return encoded
+
+    def run_serialized(self, sql, key, watermark, params=()):
+        t0 = perf_counter()
+        results = self.run_query(sql, params)
+        t1 = perf_counter()
         data = dumps(results)
-        print("query: ", sql)
-        print("transmitting ", len(data), " bytes")
+        if self.result_cache is not None:
+            self.result_cache.put(key, data, watermark, params)
+        return data, len(results), t1 - t0, perf_counter() - t1
+
+    def run_query(self, sql, params=()):
+        max_rows = self.guard.max_rows
+        with self.control.scheduled():
+            cursor = self.execute(sql, params)
+            if max_rows is None:
+                results = cursor.fetchall()
+            else:
+                results = cursor.fetchmany(max_rows + 1)
+            cursor.close()
+        self.check_row_limit(len(results))
+        return results
+
+    def run_columns(self, sql, key, watermark, params=()):
+        max_rows = self.guard.max_rows
+        t0 = perf_counter()
+        with self.control.scheduled():
+            cursor = self.execute(sql, params)
+            types = declared_types(self.connection, sql)
+            columns = cursor_to_columns(cursor, types, None if max_rows is None else max_rows + 1)
+            cursor.close()
+        t1 = perf_counter()
+        nrows = len(next(iter(columns.values()))) if columns else 0
+        self.check_row_limit(nrows)
+        data = columns_to_wire(columns)
+        if self.result_cache is not None:
+            self.result_cache.put(key, data, watermark, params)
+        return data, nrows, t1 - t0, perf_counter() - t1
+
+    def check_row_limit(self, nrows):
+        max_rows = self.guard.max_rows
+        if max_rows is not None and nrows > max_rows:
+            self.guard.count("row_limit")
+            raise QueryRejected(
+                f"query returns more than {max_rows} rows, use query_start/query_fetch to stream it"
+            )
+
+    def exposed_describe_catalog(self):
+        if self.catalog is None:
+            return dumps([])
+        return dumps(self.catalog.describe())
+
+    def exposed_cache_stats(self):
+        if self.result_cache is None:
+            return dumps({})
+        return dumps(self.result_cache.stats())
+
+    def exposed_time_binned(self, table, column, where, t1, t2, nbins):
+        (wire, nbins_filled, sqlite_time), shared = self.flight.do(
+            ("time_binned", table, column, where, t1, t2, nbins),
+            lambda: self.run_binned(table, column, where, t1, t2, nbins),
+        )
+        start = perf_counter()
+        data = self.encode(wire)
+        sql = f"time_binned {column} from {table} where {where} and gcutime >= {t1} and gcutime < {t2}"
+        if shared:
+            sqlite_time = 0.0
+        self.record(sql, "time_binned", nbins_filled, data, sqlite_time, perf_counter() - start, cached=shared)
         return data
 
-    def exposed_query_start(self, sql):
-        self.cursor = self.connection.execute(sql)
+    def run_binned(self, table, column, where, t1, t2, nbins):
+        start = perf_counter()
+        with self.control.scheduled():
+            if self.federation is not None:
+                array = self.federation.binned(table, column, where, t1, t2, nbins)
+            else:
+                array = binned_query(self.connection, table, column, where, t1, t2, nbins)
+        return array_to_wire(array), len(array), perf_counter() - start
+
+    def exposed_query_start(self, sql, prefetch=False, params=None, named=False):
+        params = plain_params(params)
+        self.guard.check(self.connection, sql, params)
+        t0 = perf_counter()
+        with self.control.scheduled():
+            cursor = self.execute(sql, params)
+        cursor_id = self.cursors.add(
+            CursorState(cursor, declared_types(self.connection, sql), prefetch, sql), named
+        )
+        self.record(sql, "start", 0, b"", perf_counter() - t0, 0.0)
+        return cursor_id
 
-    def exposed_query_fetch(self,n):
+    def fetch_batch(self, kind, n, cursor_id):
+        """
+        produce the next encoded batch of a cursor, kind is "rows" or "array"
+        """
         if n > 1000000:
             raise ValueError("fetch size is too large, use n < 1,000,000")
-        if self.cursor is None:
-            raise RuntimeError("you must call query_start before calling query_fetch")
-        return dumps(self.cursor.fetchmany(n))
+        state = self.cursors.get(cursor_id)
+        if kind == "rows":
+            serialize = dumps
+        else:
+            serialize = lambda rows: array_to_wire(
+                rows_to_array(rows, state.cursor.description, state.types)
+            )
 
+        def produce(rows):
+            t0 = perf_counter()
+            data = self.encode(serialize(rows))
+            return data, len(rows), state.sqlite_time, perf_counter() - t0
 
+        if not state.prefetch:
+            batch = produce(self.fetch_rows(state, n))
+        else:
+            if state.prefetcher is None:
+                state.prefetcher = BatchPrefetcher(lambda n: self.fetch_rows(state, n), produce)
+                state.prefetch_kind = kind
+            elif state.prefetch_kind != kind:
+                raise RuntimeError("cannot mix query_fetch and query_fetch_array on a prefetched query")
+            batch = state.prefetcher.fetch(n)
+        data, nrows, sqlite_time, serialize_time = batch
+        self.record(state.sql or "", "fetch", nrows, data, sqlite_time, serialize_time)
+        return data
 
+    def fetch_rows(self, state, n):
+        t0 = perf_counter()
+        with self.control.scheduled():
+            rows = state.cursor.fetchmany(n)
+        state.sqlite_time = perf_counter() - t0
+        return rows
 
-def rpc_server(host, port, db_file_path=None):
+    def exposed_query_fetch(self, n, cursor_id=None):
+        return self.fetch_batch("rows", n, cursor_id)
 
-    service = rpyc.utils.helpers.classpartial(
-        DBInterfaceRemote, db_file_path=db_file_path
+    def exposed_query_fetch_array(self, n, cursor_id=None):
+        return self.fetch_batch("array", n, cursor_id)
+
+    def exposed_query_close(self, cursor_id=None):
+        self.cursors.close(cursor_id)
+
+    def exposed_query_page(self, select, key_table, where, t1, t2, after, n, kind="array"):
+        """
+        one page of a keyset paginated query, see DBInterface.query_page. returns (encoded batch, next key)
+        """
+        if n > 1000000:
+            raise ValueError("page size is too large, use n < 1,000,000")
+        connection = self.federation or self.connection
+        _, sql = keyset_sql(select, key_table, where)
+        self.guard.check(self.connection, sql, dict.fromkeys(("ag", "ar", "lg", "lr"), 0))
+        if after is not None:
+            after = tuple(after)
+        t0 = perf_counter()
+        with self.control.scheduled():
+            rows, description, sql, next_key = keyset_page(
+                connection, select, key_table, where, t1, t2, after, n
+            )
+        t1 = perf_counter()
+        if kind == "rows":
+            data = self.encode(dumps(rows))
+        else:
+            types = declared_types(self.connection, sql)
+            data = self.encode(array_to_wire(rows_to_array(rows, description, types)))
+        self.record(sql, "page", len(rows), data, t1 - t0, perf_counter() - t1)
+        return data, next_key
+
+
+def make_service(
+    db_file_path=None,
+    db_dir=None,
+    max_cursors=16,
+    cursor_idle_timeout=600,
+    pool_size=4,
+    mmap_size=2**30,
+    cache_size_kib=256 * 1024,
+    result_cache_bytes=256 * 2**20,
+    max_query_seconds=60.0,
+    max_query_rows=1000000,
+    scan_guard_tables=("gfptrackerhit",),
+    tail_interval=0.5,
+    query_slots=4,
+    bulk_slots=1,
+):
+    """
+    build the shared server state and return a factory of DBInterfaceRemote sessions.
+    with db_dir, all the sqlite files of the directory are served as one db through a
+    federation.Catalog, the live one (reaching furthest in time) is the primary file that
+    the pool, the result cache and subscriptions use.
+    sessions lease pre-warmed read-only connections from a shared ConnectionPool of
+    pool_size connections (pool_size=0 opens a fresh connection per session).
+    results of query calls are cached in a shared ResultCache of result_cache_bytes (0 disables it),
+    and every call is recorded in a shared QueryMetrics. identical query and time_binned calls
+    running at the same time share one execution through a SingleFlight. row subscriptions are served by one
+    RowTailer polling every tail_interval seconds.
+    the sqlite work of the sessions is admitted by a shared QueryScheduler by priority class,
+    query_slots calls at a time (one of them reserved for live calls), at most bulk_slots of them bulk.
+    every sqlite call is interrupted after max_query_seconds, query calls returning more than
+    max_query_rows rows and statements that fully scan one of scan_guard_tables are rejected
+    """
+    catalog = None
+    if db_dir is not None:
+        catalog = Catalog(db_dir)
+        db_file_path = catalog.primary
+        for entry in catalog.describe():
+            print(f"catalog: {entry['path']} {entry['tmin']} - {entry['tmax']}")
+    if db_file_path is None:
+        db_file_path = get_db_path()
+    pool = None
+    if pool_size > 0:
+        pool = ConnectionPool(
+            db_file_path, size=pool_size, mmap_size=mmap_size, cache_size_kib=cache_size_kib
+        )
+        print(f"connection pool ready: {pool.stats()}")
+    result_cache = None
+    if result_cache_bytes > 0:
+        result_cache = ResultCache(max_bytes=result_cache_bytes)
+    guard = QueryGuard(
+        scan_tables=scan_guard_tables, max_seconds=max_query_seconds, max_rows=max_query_rows
     )
+
+    return rpyc.utils.helpers.classpartial(
+        DBInterfaceRemote,
+        db_file_path=db_file_path,
+        pool=pool,
+        result_cache=result_cache,
+        guard=guard,
+        sessions=SessionRegistry(),
+        metrics=QueryMetrics(),
+        flight=SingleFlight(),
+        scheduler=QueryScheduler(slots=query_slots, bulk_slots=bulk_slots),
+        tailer=RowTailer(open_readonly(db_file_path), interval=tail_interval),
+        catalog=catalog,
+        max_cursors=max_cursors,
+        cursor_idle_timeout=cursor_idle_timeout,
+    )
+
+
+def rpc_server(host, port, **kwargs):
+    """
+    serve a sqlite db file over rpyc, one thread per client. kwargs are the options of make_service
+    """
+    service = make_service(**kwargs)
     t = rpyc.utils.server.ThreadedServer(
         service, port=port, hostname=host, protocol_config={"allow_public_attrs": True}
     )
@@ -132,8 +1611,122 @@ class ParameterGroups:
                 self.groups[tup] = [parameter]
 
 
+class LiveWindow:
+    """
+    incremental time_query2 over a sliding window of the last dt seconds, for live displays.
+    each (table, where) group of parameters keeps its rows in a time ordered buffer and a
+    (gcutime, rowid) watermark of the last row read: update() only fetches the rows after the
+    watermark and evicts the rows older than the window, so a refresh costs the new rows
+    rather than the whole window.
+    rows are assumed to be written in gcutime order, as the gse writers do
+    """
+
+    def __init__(self, gsequery, parameters, dt):
+        if not isinstance(parameters, ParameterGroups):
+            parameters = gsequery.make_parameter_groups(parameters)
+        self.gsequery = gsequery
+        self.parameters = parameters
+        self.dt = float(dt)
+        self.buffers = {}
+        self.reset()
+
+    def reset(self):
+        self.buffers = {}
+        for key, group in self.parameters.groups.items():
+            columns = list(dict.fromkeys(par.column for par in group))
+            self.buffers[key] = {
+                "columns": columns,
+                "data": None,
+                "start": 0,
+                "stop": 0,
+                "watermark": None,
+            }
+
+    def fetch(self, table, where, buf, t1, t2):
+        """
+        the new rows as a structured array with fields f0 (gcutime), f1, ... (the columns), each
+        with the dtype query_arrays gave it
+        """
+        cols = ",".join(["gcutime"] + buf["columns"])
+        if buf["watermark"] is None:
+            sql = f"select rowid,{cols} from {table} where (gcutime >= ?) and (gcutime <= ?)"
+            params = (t1, t2)
+        else:
+            g, r = buf["watermark"]
+            sql = (
+                f"select rowid,{cols} from {table} where (gcutime >= ?) and (gcutime <= ?) "
+                "and (gcutime > ? or rowid > ?)"
+            )
+            params = (g, t2, g, r)
+        if where:
+            sql += f" and ({where})"
+        sql += " order by gcutime, rowid"
+        rowid, *columns = self.gsequery.dbi.query_arrays(sql, params).values()
+        if len(rowid) == 0:
+            return None
+        buf["watermark"] = (float(columns[0][-1]), int(rowid[-1]))
+        new = np.empty(len(rowid), dtype=[(f"f{i}", c.dtype) for i, c in enumerate(columns)])
+        for i, c in enumerate(columns):
+            new[f"f{i}"] = c
+        return new
+
+    def append(self, buf, new):
+        data, start, stop = buf["data"], buf["start"], buf["stop"]
+        if data is None:
+            data = buf["data"] = np.empty(max(1024, 2 * len(new)), dtype=new.dtype)
+        elif data.dtype != new.dtype:
+            # e.g. an integer column with a NULL in the new rows comes as float
+            dtype = [(name, np.promote_types(data.dtype[name], new.dtype[name])) for name in new.dtype.names]
+            data = buf["data"] = data.astype(dtype)
+        if stop + len(new) > len(data):
+            # move the window to the front, and grow the buffer if that is not enough
+            n = stop - start
+            if n + len(new) > len(data) // 2:
+                grown = np.empty(2 * (n + len(new)), dtype=data.dtype)
+                grown[:n] = data[start:stop]
+                data = buf["data"] = grown
+            else:
+                data[:n] = data[start:stop]
+            start, stop = 0, n
+        data[stop : stop + len(new)] = new
+        buf["start"], buf["stop"] = start, stop + len(new)
+
+    def update(self, t2=None):
+        """
+        read the new rows and return the parameters over [t2 - dt, t2] (t2 defaults to now),
+        in the format of time_query2
+        """
+        if t2 is None:
+            t2 = time()
+        t2 = float(t2)
+        t1 = t2 - self.dt
+        results = {}
+        for (table, where), group in self.parameters.groups.items():
+            buf = self.buffers[(table, where)]
+            new = self.fetch(table, where, buf, t1, t2)
+            if new is not None:
+                self.append(buf, new)
+            data = buf["data"]
+            if data is not None:
+                times = data["f0"][buf["start"] : buf["stop"]]
+                buf["start"] += int(np.searchsorted(times, t1, side="left"))
+            if data is None or buf["start"] == buf["stop"]:
+                for par in group:
+                    results[par.name] = None
+                continue
+            window = data[buf["start"] : buf["stop"]]
+            times = window["f0"].copy()
+            for par in group:
+                y = window[f"f{1 + buf['columns'].index(par.column)}"].copy()
+                results[par.name] = (times, par.convert(y), par)
+        return results
+
+
 class GSEQuery:
-    def __init__(self, path=None, project=None):
+    def __init__(self, path=None, project=None, priority=None):
+        """
+        priority is the scheduling class of the queries on a remote db, see DBInterface
+        """
         if project is None:
             project = get_project_name()
         if project is None:
@@ -149,7 +1742,7 @@ class GSEQuery:
                     f"unknown project {project}, cannot load parameter bank"
                 )
 
-        self.dbi = DBInterface(path=path)
+        self.dbi = DBInterface(path=path, priority=priority)
         self.project = project
 
     def get_project_and_path(self):
@@ -173,19 +1766,51 @@ class GSEQuery:
         ti = float(ti)
         tf = float(tf)
         if par.where:
-            sql = f"select gcutime,{par.column} from {par.table} where (gcutime >= {ti}) and (gcutime <= {tf}) and {par.where} order by gcutime"
+            sql = f"select gcutime,{par.column} from {par.table} where (gcutime >= ?) and (gcutime <= ?) and {par.where} order by gcutime"
         else:
-            sql = f"select gcutime,{par.column} from {par.table} where (gcutime >= {ti}) and (gcutime <= {tf}) order by gcutime"
-        data = self.dbi.query(sql)
-        if data:
-            data = np.array(data)
-            times = data[:, 0]
-            y = data[:, 1]
+            sql = f"select gcutime,{par.column} from {par.table} where (gcutime >= ?) and (gcutime <= ?) order by gcutime"
+        data = list(self.dbi.query_arrays(sql, (ti, tf)).values())
+        if len(data[0]):
+            times = data[0]
+            y = data[1]
             Y = par.convert(y)
             return (times, Y, par)
         else:
             return None
 
+    def time_query_binned(self, name, t1, t2, nbins):
+        """
+        decimated version of time_query3 for plotting long time windows.
+        the window [t1,t2) is split into nbins equal bins and the min, max, mean and number of
+        samples of each bin are computed on the server, so only nbins rows are transferred.
+        if data is found, a dict is returned with keys: time (bin centers), min, max, mean, count
+        (converted values, empty bins are omitted) and parameter.
+        converters are applied on the client after the reduction: min/max are exact for monotonic
+        converters, mean is exact for linear ones.
+        if data is not found, None is returned
+        """
+        if name[0] == "@":
+            par = self.parameter_bank.get(name)
+        else:
+            par = parameter_from_string(name)
+
+        t1 = float(t1)
+        t2 = float(t2)
+        res = self.dbi.time_binned(par.table, par.column, par.where, t1, t2, nbins)
+        if len(res) == 0:
+            return None
+        width = (t2 - t1) / nbins
+        a = par.convert(res["min"])
+        b = par.convert(res["max"])
+        return {
+            "time": t1 + (res["bin"] + 0.5) * width,
+            "min": np.minimum(a, b),  # converters may be decreasing
+            "max": np.maximum(a, b),
+            "mean": par.convert(res["mean"]),
+            "count": res["count"],
+            "parameter": par,
+        }
+
     def tracker_query1(self, t1, t2):
         """
         get tracker data between two times.  not meant to be used in real time mode!
@@ -203,9 +1828,9 @@ class GSEQuery:
             "from gfptrackerhit "
             "join gfptrackerevent on gfptrackerhit.parent = gfptrackerevent.rowid "
             "join gfptrackerpacket on gfptrackerevent.parent = gfptrackerpacket.rowid "
-            f"where gfptrackerpacket.gcutime > {t1} and gfptrackerpacket.gcutime <= {t2}"
+            "where gfptrackerpacket.gcutime > ? and gfptrackerpacket.gcutime <= ?"
         )
-        data = self.dbi.query(sql)
+        data = self.dbi.query(sql, (t1, t2))
         if data:
             return data
         else:
@@ -249,10 +1874,10 @@ class GSEQuery:
                 "from gfptrackerhit "
                 "join gfptrackerevent on gfptrackerhit.parent = gfptrackerevent.rowid "
                 "join gfptrackerpacket on gfptrackerevent.parent = gfptrackerpacket.rowid "
-                f"where gfptrackerpacket.rowid > {lastptr[0]} and gfptrackerpacket.gcutime >= {lastptr[1]} "
+                "where gfptrackerpacket.rowid > ? and gfptrackerpacket.gcutime >= ? "
                 "order by gfptrackerpacket.rowid asc"
             )
-            data = self.dbi.query(sql)
+            data = self.dbi.query(sql, (int(lastptr[0]), float(lastptr[1])))
             if data:
                 return data, (data[-1][-2], data[-1][-1])
             else:
@@ -308,11 +1933,12 @@ class GSEQuery:
                 "from gfptrackerhit "
                 "join gfptrackerevent on gfptrackerhit.parent = gfptrackerevent.rowid "
                 "join gfptrackerpacket on gfptrackerevent.parent = gfptrackerpacket.rowid "
-                f"where gfptrackerpacket.rowid > {lastptr[0]} and gfptrackerpacket.gcutime >= {lastptr[1]} "
-                f"and gfptrackerpacket.sysid = {sysid} and gfptrackerhit.row = {row} and gfptrackerhit.module = {module} and gfptrackerhit.channel = {channel} "
+                "where gfptrackerpacket.rowid > ? and gfptrackerpacket.gcutime >= ? "
+                "and gfptrackerpacket.sysid = ? and gfptrackerhit.row = ? and gfptrackerhit.module = ? and gfptrackerhit.channel = ? "
                 "order by gfptrackerpacket.rowid asc"
             )
-            data = self.dbi.query(sql)
+            params = (int(lastptr[0]), float(lastptr[1]), int(sysid), int(row), int(module), int(channel))
+            data = self.dbi.query(sql, params)
             if data:
                 return data, (data[-1][-2], data[-1][-1])
             else:
@@ -330,6 +1956,116 @@ class GSEQuery:
                 # this will happen if the table is empty
                 return None, None
 
+    def tracker_hits(
+        self, t1=None, t2=None, layers=None, rows=None, modules=None, channels=None,
+        adc_min=None, adc_max=None, lastptr=None, channel_index=False,
+    ):
+        """
+        columnar tracker hit reader: returns the hits with gcutime in (t1, t2] as a dict of 1-D numpy
+        arrays with keys layer, row, module, channel, adcdata, asiceventcode, eventid, rowid (of the
+        packet) and gcutime, typed as in TRACKER_HIT_DTYPES and ordered by gcutime.
+        layer is the sysid byte minus 128, a ValueError is raised for a packet with a sysid below 128.
+
+        layers, rows, modules and channels are optional collections of the values to keep, adc_min and
+        adc_max optional inclusive bounds on adcdata. the selection is done by sqlite, only the
+        matching hits are transferred. with channel_index, the result also has a channel_index array
+        (see tracker_channel_index) for per-channel analysis, e.g. np.bincount(res["channel_index"]).
+
+        for real time use pass a lastptr of tracker_query2 instead of t1: the hits of the packets after
+        it are returned, ordered by packet rowid, and (res["rowid"][-1], res["gcutime"][-1]) is the
+        next lastptr when there are any. t2 is optional in this case.
+
+        example usage:
+
+        res = gsequery.tracker_hits(t1, t2, layers=[0, 1], channels=range(8), adc_min=100, channel_index=True)
+        counts = np.bincount(res["channel_index"])
+        """
+        where = []
+        params = []
+        if lastptr is not None:
+            where.append("gfptrackerpacket.rowid > ? and gfptrackerpacket.gcutime >= ?")
+            params += [int(lastptr[0]), float(lastptr[1])]
+            order = "gfptrackerpacket.rowid"
+        elif t1 is not None and t2 is not None:
+            where.append("gfptrackerpacket.gcutime > ?")
+            params.append(float(t1))
+            order = "gfptrackerpacket.gcutime"
+        else:
+            raise ValueError("tracker_hits needs t1 and t2, or a lastptr")
+        if t2 is not None:
+            where.append("gfptrackerpacket.gcutime <= ?")
+            params.append(float(t2))
+        for column, values, offset in (
+            ("gfptrackerpacket.sysid", layers, 128),
+            ("gfptrackerhit.row", rows, 0),
+            ("gfptrackerhit.module", modules, 0),
+            ("gfptrackerhit.channel", channels, 0),
+        ):
+            if values is None:
+                continue
+            values = sorted({int(v) + offset for v in values})
+            if not values:
+                raise ValueError(f"empty selection for {column}")
+            if offset and not 128 <= values[0] <= values[-1] <= 383:
+                raise ValueError("layers must be in 0..255")
+            # one placeholder per value: the statement text only depends on the number of values
+            where.append(f"{column} in ({','.join('?' * len(values))})")
+            params += values
+        if adc_min is not None:
+            where.append("gfptrackerhit.adcdata >= ?")
+            params.append(int(adc_min))
+        if adc_max is not None:
+            where.append("gfptrackerhit.adcdata <= ?")
+            params.append(int(adc_max))
+        sql = (
+            "select gfptrackerpacket.sysid - 128 as layer, gfptrackerhit.row as row, gfptrackerhit.module as module, "
+            "gfptrackerhit.channel as channel, gfptrackerhit.adcdata as adcdata, gfptrackerhit.asiceventcode as asiceventcode, "
+            "gfptrackerevent.eventid as eventid, gfptrackerpacket.rowid as rowid, gfptrackerpacket.gcutime as gcutime "
+            # cross joins keep gfptrackerpacket the outer table, so the hits are reached through the time
+            # or rowid range of their packets even when the filters on the hit columns look selective
+            "from gfptrackerpacket "
+            "cross join gfptrackerevent on gfptrackerevent.parent = gfptrackerpacket.rowid "
+            "cross join gfptrackerhit on gfptrackerhit.parent = gfptrackerevent.rowid "
+            f"where {' and '.join(where)} order by {order}"
+        )
+        data = self.dbi.query_arrays(sql, params)
+        layer = data["layer"]
+        if len(layer) and (layer.min() < 0 or layer.max() > 255):
+            # a sysid outside 128..383 would wrap around in the uint8 layer column
+            bad = layer[(layer < 0) | (layer > 255)][0] + 128
+            raise ValueError(f"tracker packet with sysid {bad} has no layer in 0..255")
+        res = {name: data[name].astype(dtype) for name, dtype in TRACKER_HIT_DTYPES.items()}
+        if channel_index:
+            res["channel_index"] = tracker_channel_index(res["layer"], res["row"], res["module"], res["channel"])
+        return res
+
+    def subscribe_tracker(self, callback, lastptr=None, sysid=None, row=None, module=None, channel=None):
+        """
+        push based replacement of polling tracker_query2/tracker_query3: callback(res) is called
+        from a background thread with every batch of new tracker hits, res has the rows of
+        tracker_query2 (the packet rowid and gcutime are the last two columns, so
+        (res[-1][-2], res[-1][-1]) is the new lastptr). restrict to one channel with sysid, row,
+        module and channel. lastptr is a pointer from tracker_query2, the hits after it are sent
+        first. the server reads the new hits once for all the clients following the same channels.
+
+        example usage:
+
+        sub = gsequery.subscribe_tracker(lambda res: queue.put(res))
+        ...
+        gsequery.unsubscribe(sub)
+        """
+        where = [
+            f"{column} = {int(value)}"
+            for column, value in (
+                ("gfptrackerpacket.sysid", sysid),
+                ("gfptrackerhit.row", row),
+                ("gfptrackerhit.module", module),
+                ("gfptrackerhit.channel", channel),
+            )
+            if value is not None
+        ]
+        return self.dbi.subscribe("gfptrackerhit", callback, " and ".join(where) or None, lastptr)
+
     def time_query1(self, name, ti, tf):
 
         try:
@@ -345,10 +2081,10 @@ class GSEQuery:
             ti = float(ti)
             tf = float(tf)
             if par.where:
-                sql = f"select {par.column} from {par.table} where (gcutime >= {ti}) and (gcutime <= {tf}) and {par.where}"
+                sql = f"select {par.column} from {par.table} where (gcutime >= ?) and (gcutime <= ?) and {par.where}"
             else:
-                sql = f"select gcutime,{par.column} from {par.table} where (gcutime >= {ti}) and (gcutime <= {tf})"
-            data = self.dbi.query(sql)
+                sql = f"select gcutime,{par.column} from {par.table} where (gcutime >= ?) and (gcutime <= ?)"
+            data = self.dbi.query(sql, (ti, tf))
             data = np.array(data)
             times = data[:, 0]
             y = data[:, 1]
@@ -358,61 +2094,43 @@ class GSEQuery:
             print("exception while querying DB: ", e)
             return None
 
-    def time_query2(self, names, ti, tf):
+    def time_query2(self, parameters, ti, tf):
         """
-        names is an iterable of parameter names.  i.e. ['@labjack_temp_c','pdu0:vbus1']
-        ti and tf are the times to search for.  ti < tf.
-        Returns a dict where the keys are the names (from the input iterable), and the values are tuples (time,values,units)
-        where t is the timestamps, Y is the numpy array of the converted values, and units is a units string
-
-        queries are organized by table, so if user asks for multiple columns, then the table is only queried once
+        grouped version of time_query3 for many parameters: parameters is a ParameterGroups
+        (see make_parameter_groups) or an iterable of parameter names, i.e. ['@labjack_temp_c','pdu0:vbus1'].
+        ti and tf define the time window to search.
+        one query is made per (table, where) group, so the parameters of a table are fetched together.
+        returns a dict where the keys are the parameter names and the values are the time_query3
+        results: (time vector, converted Y vector, parameter instance), or None if no data was found
         """
+        if not isinstance(parameters, ParameterGroups):
+            parameters = self.make_parameter_groups(parameters)
         ti = float(ti)
         tf = float(tf)
 
-        # organize queries by table
-        table_map = {}
-        for name in names:
-            if name[0] == "@":
-                table, column = self.alias_map[name].split(":")
-            else:
-                sp = name.split(":")
-                if len(sp) == 2:
-                    table, column = sp
-                    where = None
-                elif len(sp) == 3:
-                    table, column, where = sp
-                else:
-                    print(f"skipping incorrectly formatted name {name}")
-                    continue
-            tup = (column, name, where)
-            if table in table_map:
-                table_map[table].append(tup)
-            else:
-                table_map[table] = [tup]
+        results = {}
+        for (table, where), group in parameters.groups.items():
+            columns = list(dict.fromkeys(par.column for par in group))
+            sql = f"select gcutime,{','.join(columns)} from {table} where (gcutime >= ?) and (gcutime <= ?)"
+            if where:
+                sql += f" and ({where})"
+            data = list(self.dbi.query_arrays(sql + " order by gcutime", (ti, tf)).values())
+            if len(data[0]) == 0:
+                for par in group:
+                    results[par.name] = None
+                continue
+            times = data[0]
+            for par in group:
+                y = data[1 + columns.index(par.column)]
+                results[par.name] = (times, par.convert(y), par)
 
-        res_map = {}
-        for table in table_map:
-            cols = f"gcutime," + ",".join([col for col, name in table_map[table]])
-            sql = (
-                f"select {cols} from {table} where gcutime >= {ti} and gcutime <= {tf}"
-            )
-            data = self.dbi.query(sql)
-            data = np.array(data)
-            times = data[:, 0]
-            i = 1
-            for col, name in table_map[table]:
-                # look up and apply converter
-                # return units too
-                y = data[:, i]
-                i += 1
-                if name in self.converter_map:
-                    Y, units = self.converter_map[name](y)
-                else:
-                    Y, units = y, "raw"
-                res_map[name] = (times, Y, units)
+        return results
 
-        return res_map
+    def live_window(self, parameters, dt):
+        """
+        LiveWindow over the last dt seconds of parameters (a ParameterGroups or parameter names)
+        """
+        return LiveWindow(self, parameters, dt)
 
     def get_column_names(self, table):
         sql = f"pragma table_info({table})"
@@ -432,8 +2150,10 @@ class GSEQuery:
         """
 
         if lastptr is not None:
-            sql = f"select *,rowid,gcutime from {table} where rowid > {lastptr[0]} and gcutime >= {lastptr[1]} order by rowid desc limit {limit}"
-            res = self.dbi.query(sql)
+            if isinstance(lastptr, list):
+                lastptr = lastptr[0]  # the first call returns the pointer as a result set
+            sql = f"select *,rowid,gcutime from {table} where rowid > ? and gcutime >= ? order by rowid desc limit ?"
+            res = self.dbi.query(sql, (int(lastptr[0]), float(lastptr[1]), int(limit)))
             if res:
                 return res, (
                     res[0][-2],
@@ -449,10 +2169,25 @@ class GSEQuery:
             else:
                 return None, None  # db is empty
 
+    def subscribe_rows(self, table, callback, where=None, lastptr=None):
+        """
+        push based replacement of polling get_latest_rows: callback(rows) is called from a
+        background thread with every batch of new rows of table (optionally only those matching
+        where), in ascending rowid order and with the rowid and gcutime as the last two columns.
+        lastptr is a pointer from get_latest_rows, the rows after it are sent first.
+        returns a subscription id for unsubscribe
+        """
+        if lastptr is not None and isinstance(lastptr, list):
+            lastptr = lastptr[0]  # get_latest_rows returns the first pointer as a result set
+        return self.dbi.subscribe(table, callback, where, lastptr)
+
+    def unsubscribe(self, subscription_id):
+        self.dbi.unsubscribe(subscription_id)
+
     def get_latest_n_rows(self, table, n):
 
-        sql = f"select *,rowid,gcutime from {table} where rowid > (select max(rowid)-{n} from {table})"
-        res = self.dbi.query(sql)
+        sql = f"select *,rowid,gcutime from {table} where rowid > (select max(rowid)-? from {table})"
+        res = self.dbi.query(sql, (int(n),))
         if res:
             return res
         else:
@@ -466,8 +2201,8 @@ class GSEQuery:
 
         t1 = float(t1)
         t2 = float(t2)
-        sql = f"select * from {table} where gcutime >= {t1} and gcutime <= {t2}"
-        res = self.dbi.query(sql)
+        sql = f"select * from {table} where gcutime >= ? and gcutime <= ?"
+        res = self.dbi.query(sql, (t1, t2))
         if res:
             return res
         else:
@@ -38,7 +38,7 @@ class PduHousekeepingWindow(QWidget):
         self.init_ui()  # set up the gui layout
 
         # set up the gse query for use in "update"
-        self.q = GSEQuery(project="gaps",path=path)
+        self.q = GSEQuery(project="gaps",path=path,priority="live")
         self.pg = {}
         for pdu in pdu_list:
             self.pg[pdu] = self.q.make_parameter_groups(self.parameters[pdu])
@@ -0,0 +1,92 @@
+from pybfsw.gse.gsequery import DBInterface
+from argparse import ArgumentParser
+from math import isnan
+
+# print the query metrics of a running rpc server (see QueryMetrics in rpc_tools.py)
+
+p = ArgumentParser()
+p.add_argument(
+    "--server",
+    default="127.0.0.1:44555",
+    help="host:port (or aio://host:port) of the rpc server, default is 127.0.0.1:44555",
+)
+p.add_argument("--top", type=int, default=10, help="number of queries to list, default is 10")
+p.add_argument(
+    "--by",
+    default="sqlite_time",
+    choices=["calls", "rows", "bytes", "sqlite_time", "serialize_time", "transfer_time"],
+    help="total to sort the queries by, default is sqlite_time",
+)
+p.add_argument("--recent", action="store_true", help="also list the most recent calls")
+args = p.parse_args()
+
+dbi = DBInterface(args.server, client_name="rpc_stats")
+stats = dbi.stats(args.top, args.by)
+
+
+def ms(seconds):
+    return "-" if isnan(seconds) else f"{seconds * 1e3:.1f}"
+
+
+print(f"uptime {stats['uptime'] / 3600:.2f} h\n")
+print("clients:")
+print(f"  {'client':<32} {'calls':>8} {'rows':>12} {'MB':>10} {'sqlite ms':>12} {'ser. ms':>10} {'xfer ms':>10}")
+for client, t in stats["clients"].items():
+    print(
+        f"  {client:<32} {t['calls']:>8} {t['rows']:>12} {t['bytes'] / 2**20:>10.1f} "
+        f"{ms(t['sqlite_time']):>12} {ms(t['serialize_time']):>10} {ms(t['transfer_time']):>10}"
+    )
+
+print(f"\ntop {args.top} by {args.by}:")
+for t in stats["top"]:
+    print(
+        f"  {t['client']}: {t['calls']} calls ({t['cached']} cached), {t['rows']} rows, "
+        f"{t['bytes'] / 2**20:.1f} MB, sqlite {ms(t['sqlite_time'])} ms, "
+        f"serialize {ms(t['serialize_time'])} ms, transfer {ms(t['transfer_time'])} ms"
+    )
+    print(f"    {t['fingerprint'][:200]}")
+
+print("\nlatency (sqlite + serialization, transfer):")
+for kind, h in stats["histograms"].items():
+    print(f"  {kind:<12} {sum(h['counts']):>8} calls, p50 < {ms(h['p50'])} ms, p99 < {ms(h['p99'])} ms")
+
+for codec, c in stats.get("compression", {}).items():
+    print(
+        f"\ncompression {codec}: {c['batches']} batches, {c['raw_bytes'] / 2**20:.1f} MB -> "
+        f"{c['bytes'] / 2**20:.1f} MB (ratio {c['ratio']:.2f}), {c['time']:.2f} s compressing"
+    )
+
+if "coalescing" in stats:
+    c = stats["coalescing"]
+    print(
+        f"\ncoalescing: {c['executions']} executions, {c['coalesced']} calls served by an identical "
+        f"call in flight, {c['saved_time']:.2f} s saved, at most {c['max_waiters']} waiters"
+    )
+
+if "statements" in stats:
+    st = stats["statements"]
+    print(
+        f"\nstatements: {st['compiles']} compiled, {st['reuses']} served by a cached plan "
+        "(pooled connections)"
+    )
+
+if "scheduling" in stats:
+    sched = stats["scheduling"]
+    print(
+        f"\nscheduling: {sched['slots']} slots, {sched['reserved']} reserved for live, "
+        f"{sched['bulk_slots']} for bulk"
+    )
+    print(f"  {'class':<10} {'running':>8} {'waiting':>8} {'admitted':>10} {'mean wait ms':>13} {'p99 wait ms':>12} {'max wait ms':>12}")
+    for name, c in sched["classes"].items():
+        print(
+            f"  {name:<10} {c['running']:>8} {c['waiting']:>8} {c['admitted']:>10} "
+            f"{ms(c['mean_wait']):>13} {ms(c['wait_p99']):>12} {ms(c['max_wait']):>12}"
+        )
+
+if args.recent:
+    print("\nrecent calls:")
+    for r in stats["recent"]:
+        print(
+            f"  {r['client']} {r['kind']} {r['rows']} rows {r['bytes']} bytes "
+            f"sqlite {ms(r['sqlite_time'])} ms transfer {ms(r['transfer_time'])} ms: {r['fingerprint'][:100]}"
+        )
@@ -0,0 +1,1058 @@
+from sqlite3 import connect, Connection, OperationalError
+from threading import Lock, RLock, Thread, Event, Condition, get_ident
+from quickle import dumps
+from time import perf_counter, time, monotonic, sleep
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from bisect import insort
+from weakref import WeakSet
+import secrets
+import math
+import re
+
+# shared state for the sessions of gsequery.rpc_server.
+# rpc_server builds one instance of each of these and hands it to every
+# DBInterfaceRemote session it creates.
+
+# size of the prepared statement cache of the connections (the sqlite3 default is 128)
+CACHED_STATEMENTS = 512
+
+
+class StatementCache:
+    """
+    mirror of the prepared statement cache of a sqlite3 connection, an LRU of size statements
+    keyed by their sql text, counting the statements that had to be compiled and those that
+    reused a cached plan. statements with bound parameters keep the same text from call to call,
+    statements with embedded values compile every time
+    """
+
+    def __init__(self, size=CACHED_STATEMENTS):
+        self.size = size
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.counters = {"compiles": 0, "reuses": 0}
+
+    def note(self, sql):
+        with self.lock:
+            if sql in self.entries:
+                self.entries.move_to_end(sql)
+                self.counters["reuses"] += 1
+                return
+            self.counters["compiles"] += 1
+            self.entries[sql] = None
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["cached"] = len(self.entries)
+        stats["size"] = self.size
+        return stats
+
+
+class CountingConnection(Connection):
+    """
+    sqlite3 connection counting the statements it compiles in self.statements (a StatementCache),
+    for the connections made with connect(..., factory=CountingConnection)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = StatementCache(kwargs.get("cached_statements", 128))
+
+    def execute(self, sql, parameters=()):
+        self.statements.note(sql)
+        return super().execute(sql, parameters)
+
+
+def statement_stats(connection):
+    """
+    statement cache counters of a connection, empty for connections that do not count them
+    """
+    statements = getattr(connection, "statements", None)
+    return statements.stats() if statements is not None else {}
+
+
+def open_readonly(path, mmap_size=0, cache_size_kib=None):
+    """
+    open a read-only connection to a sqlite file, configured for read heavy use.
+    the connection may be used from threads other than the one that opened it, and counts
+    its statement compilations (see CountingConnection)
+    """
+    connection = connect(
+        f"file:{path}?mode=ro",
+        uri=True,
+        timeout=2,
+        check_same_thread=False,
+        factory=CountingConnection,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    connection.execute("pragma query_only = 1")
+    if mmap_size:
+        connection.execute(f"pragma mmap_size = {int(mmap_size)}")
+    if cache_size_kib:
+        # negative cache_size is in KiB rather than pages
+        connection.execute(f"pragma cache_size = {-int(cache_size_kib)}")
+    return connection
+
+
+def normalize_sql(sql):
+    """
+    collapse whitespace so that statements that differ only in formatting compare equal
+    """
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+def sql_tables(sql):
+    """
+    names of the tables in the from/join clauses of sql
+    """
+    return re.findall(
+        r"\b(?:from|join)\s+([A-Za-z_][A-Za-z0-9_]*)", sql, flags=re.IGNORECASE
+    )
+
+
+def sql_fingerprint(sql):
+    """
+    sql with its literals replaced by ?, so that the queries a client repeats with different
+    time windows or ids are counted together
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", "?", normalize_sql(sql).lower())
+    sql = re.sub(r"(?<![A-Za-z_0-9])[-+]?[0-9]*\.?[0-9]+(?:e[-+]?[0-9]+)?", "?", sql)
+    return re.sub(r"\?(?:\s*,\s*\?)+", "?", sql)
+
+
+def plain_params(params):
+    """
+    local copy of the statement parameters sent by a client (rpyc passes lists and dicts by
+    reference): a tuple of values, or a dict for named parameters, which clients send as
+    (name, value) pairs (a value bound to a ? is never a tuple)
+    """
+    if params is None:
+        return ()
+    params = tuple(params)
+    if params and all(isinstance(p, tuple) and len(p) == 2 for p in params):
+        return dict(params)
+    return params
+
+
+def params_key(params):
+    """
+    hashable form of statement parameters, for cache keys
+    """
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    return tuple(params)
+
+
+def inline_params(sql, params):
+    """
+    sql with the ? and :name placeholders of numeric params replaced by their values, for the
+    analysis of gcutime bounds only (placeholders inside string literals are not recognized)
+    """
+    if not params:
+        return sql
+
+    def literal(value):
+        return repr(float(value)) if isinstance(value, (int, float)) else None
+
+    if isinstance(params, dict):
+        return re.sub(
+            r":([A-Za-z_][A-Za-z0-9_]*)",
+            lambda m: literal(params.get(m.group(1))) or m.group(0),
+            sql,
+        )
+    values = iter(params)
+    return re.sub(r"\?", lambda m: literal(next(values, None)) or "?", sql)
+
+
+def gcutime_upper_bound(sql, params=()):
+    """
+    the largest explicit gcutime upper bound (gcutime < x or gcutime <= x) in sql, None if there is none.
+    statements with an or are considered unbounded, as in gcutime_bounds. bounds given as parameters count
+    """
+    sql = inline_params(sql, params)
+    if re.search(r"\bor\b", sql, flags=re.IGNORECASE):
+        return None
+    bounds = re.findall(
+        r"gcutime\s*\)?\s*<=?\s*\(?\s*([-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)",
+        sql,
+        flags=re.IGNORECASE,
+    )
+    if not bounds:
+        return None
+    return max(float(b) for b in bounds)
+
+
+def gcutime_bounds(sql, params=()):
+    """
+    (lower, upper) explicit gcutime bounds of sql, None where there is none. the widest bounds are
+    taken, and statements with an or are considered unbounded, so the range is never too narrow.
+    bounds given as parameters count
+    """
+    sql = inline_params(sql, params)
+    if re.search(r"\bor\b", sql, flags=re.IGNORECASE):
+        return None, None
+    lower = re.findall(
+        r"gcutime\s*\)?\s*>=?\s*\(?\s*([-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)",
+        sql,
+        flags=re.IGNORECASE,
+    )
+    return (min(float(b) for b in lower) if lower else None), gcutime_upper_bound(sql)
+
+
+class ConnectionPool:
+    """
+    a pool of read-only connections to one sqlite file, shared by all the client sessions of
+    the rpc server. connections are opened with mmap_size, a large page cache and query_only,
+    warmed up (schema and table b-tree roots read) when they are opened, and leased to sessions
+    for the lifetime of the session. when all size connections are leased, extra connections are
+    opened and closed again on release, so sessions never wait.
+
+    stats() reports the number of connections opened and the time spent opening and warming them,
+    and how many leases were served by an already warm connection.
+    """
+
+    def __init__(self, path, size=4, mmap_size=2**30, cache_size_kib=256 * 1024, warm=True):
+        self.path = path
+        self.size = size
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.warm = warm
+        self.lock = Lock()
+        self.idle = []
+        self.leased = 0
+        self.opened = WeakSet()
+        self.counters = {
+            "opened": 0,
+            "open_time": 0.0,
+            "leases": 0,
+            "warm_leases": 0,
+            "overflow": 0,
+        }
+        for _ in range(size):
+            self.idle.append(self.open())
+
+    def open(self):
+        t0 = perf_counter()
+        connection = open_readonly(self.path, self.mmap_size, self.cache_size_kib)
+        if self.warm:
+            self.warm_up(connection)
+        dt = perf_counter() - t0
+        with self.lock:
+            self.counters["opened"] += 1
+            self.counters["open_time"] += dt
+            self.opened.add(connection)
+        return connection
+
+    def warm_up(self, connection):
+        tables = connection.execute(
+            "select name from sqlite_master where type='table' and name not like 'sqlite_%'"
+        ).fetchall()
+        for (table,) in tables:
+            try:
+                connection.execute(f"select max(rowid) from {table}").fetchall()
+            except Exception:
+                pass  # without rowid tables
+
+    def lease(self):
+        with self.lock:
+            self.counters["leases"] += 1
+            self.leased += 1
+            if self.idle:
+                self.counters["warm_leases"] += 1
+                return self.idle.pop()
+            self.counters["overflow"] += 1
+        return self.open()
+
+    def release(self, connection):
+        connection.set_progress_handler(None, 0)
+        if connection.in_transaction:
+            connection.rollback()
+        with self.lock:
+            self.leased -= 1
+            if len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["idle"] = len(self.idle)
+            stats["leased"] = self.leased
+        stats["mean_open_time"] = stats["open_time"] / max(1, stats["opened"])
+        stats["statements"] = self.statement_stats()
+        return stats
+
+    def statement_stats(self):
+        """
+        statement cache counters summed over the open connections of the pool
+        """
+        totals = {"compiles": 0, "reuses": 0}
+        with self.lock:
+            connections = list(self.opened)
+        for connection in connections:
+            counts = statement_stats(connection)
+            for key in totals:
+                totals[key] += counts.get(key, 0)
+        return totals
+
+
+class ResultCache:
+    """
+    LRU cache of serialized query results shared by all sessions, keyed by tuples starting with
+    the normalized sql (followed by anything else the result depends on, e.g. its parameters) and
+    bounded by the total size of the cached results.
+
+    results of queries on a closed time window (an explicit gcutime upper bound more than
+    settle_time seconds in the past) are kept until evicted. results that may still change are
+    stored with a watermark, the max(rowid) of every table they read, and are invalidated as
+    soon as one of those tables has grown. queries that cannot be watermarked (e.g. on tables
+    without rowid) are only cached when their window is closed.
+
+    stats() reports hits, misses, invalidations and evictions.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, settle_time=60.0):
+        self.max_bytes = max_bytes
+        self.settle_time = settle_time
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "evictions": 0,
+            "uncacheable": 0,
+        }
+
+    def watermark(self, connection, sql):
+        try:
+            return tuple(
+                connection.execute(f"select max(rowid) from {table}").fetchall()[0][0]
+                for table in sorted(set(sql_tables(sql)))
+            )
+        except Exception:
+            return None
+
+    def get(self, connection, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[1] is not None:
+            if self.watermark(connection, key[0]) != entry[1]:
+                with self.lock:
+                    if self.entries.get(key) is entry:
+                        self.drop(key)
+                        self.counters["invalidations"] += 1
+                entry = None
+        with self.lock:
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, data, watermark=None, params=()):
+        """
+        watermark is the table watermark taken before the query was run, params the statement parameters
+        """
+        upper = gcutime_upper_bound(key[0], params)
+        closed = upper is not None and upper < time() - self.settle_time
+        if closed:
+            watermark = None
+        if (watermark is None and not closed) or len(data) > self.max_bytes // 4:
+            with self.lock:
+                self.counters["uncacheable"] += 1
+            return
+        with self.lock:
+            if key in self.entries:
+                self.drop(key)
+            self.entries[key] = (data, watermark)
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                self.drop(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+
+    def drop(self, key):
+        data, _ = self.entries.pop(key)
+        self.nbytes -= len(data)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.entries)
+            stats["bytes"] = self.nbytes
+        return stats
+
+
+class QueryRejected(ValueError):
+    pass
+
+
+class QueryAborted(RuntimeError):
+    pass
+
+
+class QueryCancelled(QueryAborted):
+    pass
+
+
+class QueryGuard:
+    """
+    admission control for the statements clients send to the rpc server.
+
+    check(connection, sql) runs EXPLAIN QUERY PLAN and rejects statements whose plan does a full
+    scan of one of scan_tables (the hit table has no index usable by a time cut, a scan of it
+    reads the whole db). max_seconds is the wall clock limit of every sqlite call a session makes,
+    max_rows the largest result a single query call may return (None disables either limit)
+    """
+
+    def __init__(self, scan_tables=("gfptrackerhit",), max_seconds=60.0, max_rows=1000000):
+        self.scan_tables = set(scan_tables)
+        self.max_seconds = max_seconds
+        self.max_rows = max_rows
+        self.lock = Lock()
+        self.counters = {"rejected": 0, "timeouts": 0, "cancelled": 0, "row_limit": 0}
+
+    def names(self, sql):
+        """
+        the guarded tables and the aliases they are given in sql
+        """
+        names = set()
+        for table, alias in re.findall(
+            r"\b(?:from|join)\s+([A-Za-z_][A-Za-z0-9_]*)(?:\s+(?:as\s+)?([A-Za-z_][A-Za-z0-9_]*))?",
+            sql,
+            flags=re.IGNORECASE,
+        ):
+            if table.lower() in self.scan_tables:
+                names.add(table.lower())
+                if alias and alias.lower() not in SQL_KEYWORDS:
+                    names.add(alias.lower())
+        return names
+
+    def check(self, connection, sql, params=()):
+        names = self.names(sql)
+        if not names:
+            return
+        for row in connection.execute("explain query plan " + sql, params).fetchall():
+            m = re.match(r"SCAN (?:TABLE )?([A-Za-z_][A-Za-z0-9_]*)", row[-1])
+            if m and m.group(1).lower() in names:
+                self.count("rejected")
+                raise QueryRejected(
+                    f"query rejected, its plan does a full scan of {m.group(1)}: "
+                    "restrict it with a gcutime cut joined through gfptrackerpacket/gfptrackerevent"
+                )
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["max_seconds"] = self.max_seconds
+        stats["max_rows"] = self.max_rows
+        return stats
+
+
+SQL_KEYWORDS = {"where", "join", "on", "inner", "left", "cross", "natural", "group", "order", "limit", "using", "union"}
+
+
+class StatementControl:
+    """
+    wall clock limit and cancellation of the statements of one session, enforced by a sqlite
+    progress handler installed on the session's connection.
+    sqlite calls are made inside limit(), which works from any thread (e.g. a prefetch thread):
+    the handler interrupts the statement when its deadline has passed or the session was
+    cancelled, and limit() turns the interruption into a QueryAborted
+    """
+
+    def __init__(self, guard, scheduler=None):
+        self.guard = guard
+        self.scheduler = scheduler
+        self.priority = "analysis"
+        self.deadlines = {}
+        self.cancelled = False
+
+    def install(self, connection):
+        connection.set_progress_handler(self.check, 10000)
+
+    def check(self):
+        deadline = self.deadlines.get(get_ident())
+        if deadline is None:
+            return 0
+        if self.priority == "bulk" and self.scheduler is not None:
+            self.scheduler.throttle()
+        return self.cancelled or monotonic() > deadline
+
+    @contextmanager
+    def limit(self):
+        ident = get_ident()
+        if not self.deadlines:
+            self.cancelled = False
+        max_seconds = self.guard.max_seconds
+        self.deadlines[ident] = monotonic() + max_seconds if max_seconds else float("inf")
+        try:
+            yield
+        except OperationalError as e:
+            if str(e) != "interrupted":
+                raise
+            if self.cancelled:
+                self.guard.count("cancelled")
+                raise QueryCancelled("query cancelled by the client") from None
+            self.guard.count("timeouts")
+            raise QueryAborted(f"query exceeded the time limit of {max_seconds} s") from None
+        finally:
+            del self.deadlines[ident]
+
+    @contextmanager
+    def scheduled(self):
+        """
+        limit() entered once the scheduler admitted the session's priority class, the time
+        limit does not include the wait
+        """
+        admit = self.scheduler.admit(self.priority) if self.scheduler is not None else nullcontext()
+        with admit, self.limit():
+            yield
+
+    def cancel(self):
+        """
+        interrupt the running statements of the session, returns whether there were any
+        """
+        self.cancelled = True
+        return bool(self.deadlines)
+
+
+class SingleFlight:
+    """
+    shares one execution of identical calls that are in flight at the same time: the first caller
+    of do(key, func) runs func, callers arriving with the same key before it returns wait for it
+    and get the same result (or exception). when the leading call was cancelled by its own client
+    the waiting callers run it again.
+
+    stats() reports executions, coalesced calls and the execution time they saved
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = {}
+        self.counters = {"executions": 0, "coalesced": 0, "saved_time": 0.0, "max_waiters": 0}
+
+    def do(self, key, func):
+        """
+        returns (result, shared), shared is False for the caller that ran func
+        """
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self.calls[key] = {"done": Event(), "waiters": 0}
+                else:
+                    call["waiters"] += 1
+            if leader:
+                return self.lead(key, call, func), False
+            call["done"].wait()
+            error = call.get("error")
+            if error is None:
+                with self.lock:
+                    self.counters["coalesced"] += 1
+                    self.counters["saved_time"] += call["elapsed"]
+                return call["result"], True
+            if not isinstance(error, QueryCancelled):
+                raise error
+
+    def lead(self, key, call, func):
+        t0 = perf_counter()
+        try:
+            call["result"] = func()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            call["elapsed"] = perf_counter() - t0
+            with self.lock:
+                del self.calls[key]
+                self.counters["executions"] += 1
+                self.counters["max_waiters"] = max(self.counters["max_waiters"], call["waiters"])
+            call["done"].set()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self.calls)
+        return stats
+
+
+class SessionRegistry:
+    """
+    the StatementControl of every open session, by session id, so that a client can cancel
+    its running statement from a second connection
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.sessions = {}
+
+    def add(self, control):
+        session_id = secrets.token_hex(8)
+        with self.lock:
+            self.sessions[session_id] = control
+        return session_id
+
+    def remove(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def cancel(self, session_id):
+        with self.lock:
+            control = self.sessions.get(session_id)
+        if control is None:
+            return False
+        return control.cancel()
+
+
+def add_time(total, value):
+    """
+    sum of two times where nan means not measured, the sum is nan only if both are
+    """
+    if math.isnan(total):
+        return value
+    if math.isnan(value):
+        return total
+    return total + value
+
+
+class LogHistogram:
+    """
+    histogram of positive values (latencies in seconds) in logarithmic bins, bins_per_decade
+    bins per decade from lo to hi, plus an underflow and an overflow bin
+    """
+
+    def __init__(self, lo=1e-5, hi=1e3, bins_per_decade=4):
+        self.lo = lo
+        self.bins_per_decade = bins_per_decade
+        self.nbins = int(round(math.log10(hi / lo) * bins_per_decade))
+        self.counts = [0] * (self.nbins + 2)
+
+    def add(self, value):
+        if value <= self.lo:
+            i = 0
+        else:
+            i = min(self.nbins + 1, 1 + int(math.log10(value / self.lo) * self.bins_per_decade))
+        self.counts[i] += 1
+
+    def edges(self):
+        return [self.lo * 10 ** (i / self.bins_per_decade) for i in range(self.nbins + 1)]
+
+    def quantile(self, q):
+        """
+        upper edge of the bin holding the q quantile
+        """
+        total = sum(self.counts)
+        if total == 0:
+            return math.nan
+        edges = self.edges()
+        acc = 0
+        for i, n in enumerate(self.counts):
+            acc += n
+            if acc >= q * total:
+                return edges[min(i, self.nbins)]
+
+
+PRIORITIES = ("live", "analysis", "bulk")
+
+
+class QueryScheduler:
+    """
+    admission of the sqlite work of all the sessions by priority class: live (panels and
+    safety checks), analysis (the default) and bulk (downloads).
+    at most slots calls run at the same time, reserved of them only for live calls, and bulk calls
+    take at most bulk_slots, so a live call does not queue behind bulk or analysis work.
+    waiting calls are admitted in class order, first come first served within a class.
+    bulk streams give up their slot between batches, and a bulk statement sleeps bulk_yield
+    seconds at every progress handler call while live calls are running.
+
+    stats() reports the queue depth, running calls and wait times of every class
+    """
+
+    def __init__(self, slots=4, reserved=1, bulk_slots=1, bulk_yield=0.001):
+        if reserved >= slots:
+            raise ValueError("reserved must leave at least one slot to analysis and bulk calls")
+        self.slots = slots
+        self.reserved = reserved
+        self.bulk_slots = bulk_slots
+        self.bulk_yield = bulk_yield
+        self.cond = Condition()
+        self.waiting = []
+        self.seq = 0
+        self.running = dict.fromkeys(PRIORITIES, 0)
+        self.totals = {
+            p: {"admitted": 0, "wait_time": 0.0, "max_wait": 0.0, "yields": 0} for p in PRIORITIES
+        }
+        self.histograms = {p: LogHistogram() for p in PRIORITIES}
+
+    def allowed(self, priority):
+        active = sum(self.running.values())
+        if priority == "live":
+            return active < self.slots
+        if active >= self.slots - self.reserved:
+            return False
+        return priority != "bulk" or self.running["bulk"] < self.bulk_slots
+
+    def next_ticket(self):
+        for ticket in self.waiting:
+            if self.allowed(ticket[2]):
+                return ticket
+        return None
+
+    @contextmanager
+    def admit(self, priority="analysis"):
+        if priority not in PRIORITIES:
+            raise ValueError(f"unknown priority {priority}, choose from {PRIORITIES}")
+        t0 = perf_counter()
+        with self.cond:
+            self.seq += 1
+            ticket = (PRIORITIES.index(priority), self.seq, priority)
+            insort(self.waiting, ticket)
+            while self.next_ticket() is not ticket:
+                self.cond.wait()
+            self.waiting.remove(ticket)
+            self.running[priority] += 1
+            wait = perf_counter() - t0
+            totals = self.totals[priority]
+            totals["admitted"] += 1
+            totals["wait_time"] += wait
+            totals["max_wait"] = max(totals["max_wait"], wait)
+            self.histograms[priority].add(wait)
+            # the next waiter may be admissible too
+            self.cond.notify_all()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.running[priority] -= 1
+                self.cond.notify_all()
+
+    def throttle(self):
+        if self.running["live"]:
+            self.totals["bulk"]["yields"] += 1
+            sleep(self.bulk_yield)
+
+    def stats(self):
+        with self.cond:
+            stats = {}
+            for p in PRIORITIES:
+                totals = self.totals[p]
+                h = self.histograms[p]
+                stats[p] = dict(
+                    totals,
+                    waiting=sum(1 for t in self.waiting if t[2] == p),
+                    running=self.running[p],
+                    mean_wait=totals["wait_time"] / totals["admitted"] if totals["admitted"] else math.nan,
+                    wait_p50=h.quantile(0.5),
+                    wait_p99=h.quantile(0.99),
+                )
+        return {
+            "slots": self.slots,
+            "reserved": self.reserved,
+            "bulk_slots": self.bulk_slots,
+            "classes": stats,
+        }
+
+
+class QueryMetrics:
+    """
+    per call metrics of all the sessions of the rpc server.
+
+    record() is called once per query (and once per streamed batch) with the client, the sql,
+    the number of rows and bytes returned and the time spent in sqlite and serializing the result.
+    calls answered without running sqlite (result cache hits, calls coalesced with an identical
+    call in flight) are counted as cached.
+    the transfer time is only known to the asyncio server, which adds it with add_transfer;
+    it stays nan for rpyc sessions.
+
+    the last history records are kept in a ring buffer, totals are kept per (client, fingerprint)
+    for the max_keys most recently seen keys, and latency histograms per kind of call.
+    add_compression totals the compressed result batches per codec.
+    stats(top, by) reports the top offenders sorted by one of the totals
+    """
+
+    FIELDS = ("rows", "bytes", "sqlite_time", "serialize_time", "transfer_time")
+
+    def __init__(self, history=10000, max_keys=1000):
+        self.lock = Lock()
+        self.records = deque(maxlen=history)
+        self.max_keys = max_keys
+        self.totals = OrderedDict()
+        self.histograms = {}
+        self.compression = {}
+        self.started = time()
+
+    def record(self, client, sql, kind, rows, nbytes, sqlite_time, serialize_time, cached=False):
+        record = {
+            "time": time(),
+            "client": client,
+            "fingerprint": sql_fingerprint(sql),
+            "kind": kind,
+            "cached": cached,
+            "rows": rows,
+            "bytes": nbytes,
+            "sqlite_time": sqlite_time,
+            "serialize_time": serialize_time,
+            "transfer_time": math.nan,
+        }
+        key = (client, record["fingerprint"])
+        with self.lock:
+            self.records.append(record)
+            totals = self.totals.get(key)
+            if totals is None:
+                totals = dict.fromkeys(self.FIELDS, 0)
+                totals.update(calls=0, cached=0, transfer_time=math.nan)
+                self.totals[key] = totals
+                while len(self.totals) > self.max_keys:
+                    self.totals.popitem(last=False)
+            else:
+                self.totals.move_to_end(key)
+            totals["calls"] += 1
+            totals["cached"] += cached
+            for field in self.FIELDS[:-1]:
+                totals[field] += record[field]
+            hist = self.histograms.get(kind)
+            if hist is None:
+                hist = self.histograms[kind] = LogHistogram()
+            hist.add(sqlite_time + serialize_time)
+        return record
+
+    def add_transfer(self, record, transfer_time):
+        key = (record["client"], record["fingerprint"])
+        with self.lock:
+            record["transfer_time"] = transfer_time
+            totals = self.totals.get(key)
+            if totals is not None:
+                totals["transfer_time"] = add_time(totals["transfer_time"], transfer_time)
+            hist = self.histograms.get("transfer")
+            if hist is None:
+                hist = self.histograms["transfer"] = LogHistogram()
+            hist.add(transfer_time)
+
+    def add_compression(self, codec, raw_bytes, compressed_bytes, seconds):
+        with self.lock:
+            c = self.compression.get(codec)
+            if c is None:
+                c = self.compression[codec] = {"batches": 0, "raw_bytes": 0, "bytes": 0, "time": 0.0}
+            c["batches"] += 1
+            c["raw_bytes"] += raw_bytes
+            c["bytes"] += compressed_bytes
+            c["time"] += seconds
+
+    def stats(self, top=10, by="sqlite_time", recent=20):
+        with self.lock:
+            compression = {
+                codec: dict(c, ratio=c["raw_bytes"] / max(1, c["bytes"])) for codec, c in self.compression.items()
+            }
+            totals = [
+                dict(client=client, fingerprint=fingerprint, **t)
+                for (client, fingerprint), t in self.totals.items()
+            ]
+            records = list(self.records)[-recent:] if recent else []
+            histograms = {
+                kind: {
+                    "edges": h.edges(),
+                    "counts": list(h.counts),
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                }
+                for kind, h in self.histograms.items()
+            }
+        clients = {}
+        for t in totals:
+            c = clients.get(t["client"])
+            if c is None:
+                c = clients[t["client"]] = dict.fromkeys(("calls",) + self.FIELDS, 0)
+                c["transfer_time"] = math.nan
+            for field in c:
+                c[field] = add_time(c[field], t[field])
+        totals.sort(key=lambda t: -math.inf if math.isnan(t[by]) else t[by], reverse=True)
+        return {
+            "uptime": time() - self.started,
+            "top": totals[:top],
+            "clients": clients,
+            "histograms": histograms,
+            "compression": compression,
+            "recent": records,
+        }
+
+
+class RowTailer:
+    """
+    push delivery of new rows to subscribers, shared by all the sessions of the rpc server.
+
+    a tail is a statement selecting the rows of a table (or join) whose key table rowid is in
+    (?, ?], with the key rowid and the gcutime as the last two columns, ordered by key rowid.
+    every interval seconds one thread reads max(rowid) of each key table once, runs each tail
+    whose key table has grown once, and pushes the serialized batch to all its subscribers, so
+    that n clients following the same rows cost one query instead of n polls.
+
+    subscribe() starts a subscriber at a (rowid, gcutime) watermark as returned by
+    GSEQuery.tracker_query2/get_latest_rows: it is first sent the rows it missed, then follows
+    the tail. rows with a gcutime below the watermark gcutime are not sent to it. a subscriber
+    more than max_backlog key rows behind is refused. push(data) must not block, a subscriber
+    whose push raises is dropped.
+
+    pushes happen outside of lock (which guards the tails and subscriptions), so a push may
+    unsubscribe, and a slow push does not hold up subscribe/unsubscribe calls of other sessions.
+    they are serialized by the reentrant delivery lock, taken before lock, so that every
+    subscriber receives its batches in rowid order
+    """
+
+    def __init__(self, connection, interval=0.5, max_backlog=100000):
+        self.connection = connection
+        self.interval = interval
+        self.max_backlog = max_backlog
+        self.lock = Lock()
+        self.delivery = RLock()
+        self.tails = {}
+        self.subscriptions = {}
+        self.next_id = 0
+        self.thread = None
+        self.stopped = Event()
+        self.counters = {"polls": 0, "tail_queries": 0, "rows": 0, "pushes": 0, "dropped": 0}
+
+    def max_rowid(self, table):
+        return self.connection.execute(f"select max(rowid) from {table}").fetchall()[0][0] or 0
+
+    def subscribe(self, sql, key_table, watermark, push):
+        key = (sql, key_table)
+        backlog = None
+        with self.delivery:
+            with self.lock:
+                tail = self.tails.get(key)
+                if tail is None:
+                    pos = self.max_rowid(key_table)
+                    # fail here rather than in the tail thread if sql is not valid
+                    self.connection.execute(sql, (pos, pos)).fetchall()
+                    tail = self.tails[key] = {"pos": pos, "subscribers": {}}
+                subscriber = {"push": push, "after": tail["pos"], "floor": None}
+                if watermark is not None:
+                    subscriber["after"], subscriber["floor"] = watermark
+                    if tail["pos"] - subscriber["after"] > self.max_backlog:
+                        raise ValueError(
+                            f"watermark is more than {self.max_backlog} rows behind, read the backlog with a query first"
+                        )
+                    if subscriber["after"] < tail["pos"]:
+                        rows = self.connection.execute(sql, (subscriber["after"], tail["pos"])).fetchall()
+                        backlog = self.select(rows, subscriber)
+                self.next_id += 1
+                subscription_id = self.next_id
+                tail["subscribers"][subscription_id] = subscriber
+                self.subscriptions[subscription_id] = key
+                if self.thread is None:
+                    self.thread = Thread(target=self.run, daemon=True)
+                    self.thread.start()
+            if backlog:
+                self.push([(subscription_id, push, dumps(backlog))])
+        return subscription_id
+
+    def unsubscribe(self, subscription_id):
+        with self.lock:
+            key = self.subscriptions.pop(subscription_id, None)
+            if key is None:
+                return
+            tail = self.tails[key]
+            del tail["subscribers"][subscription_id]
+            if not tail["subscribers"]:
+                del self.tails[key]
+
+    def select(self, rows, subscriber):
+        """
+        the rows of a batch this subscriber has not seen yet
+        """
+        after, floor = subscriber["after"], subscriber["floor"]
+        return [r for r in rows if r[-2] > after and (floor is None or r[-1] >= floor)]
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"row tailer: {e}")
+
+    def poll(self):
+        with self.delivery:
+            pushes = []
+            with self.lock:
+                self.counters["polls"] += 1
+                heads = {}
+                for tail_key, tail in list(self.tails.items()):
+                    if not tail["subscribers"]:
+                        del self.tails[tail_key]
+                        continue
+                    sql, key_table = tail_key
+                    if key_table not in heads:
+                        heads[key_table] = self.max_rowid(key_table)
+                    upto = min(heads[key_table], tail["pos"] + self.max_backlog)
+                    if upto <= tail["pos"]:
+                        continue
+                    rows = self.connection.execute(sql, (tail["pos"], upto)).fetchall()
+                    tail["pos"] = upto
+                    self.counters["tail_queries"] += 1
+                    self.counters["rows"] += len(rows)
+                    if rows:
+                        pushes += self.batches(tail, rows)
+            self.push(pushes)
+
+    def batches(self, tail, rows):
+        """
+        the (subscription id, push, data) deliveries of a batch of new rows of tail
+        """
+        batches = []
+        shared = None
+        for subscription_id, subscriber in tail["subscribers"].items():
+            if rows[0][-2] > subscriber["after"] and subscriber["floor"] is None:
+                if shared is None:
+                    shared = dumps(rows)
+                data = shared
+            else:
+                selected = self.select(rows, subscriber)
+                if not selected:
+                    continue
+                data = dumps(selected)
+            batches.append((subscription_id, subscriber["push"], data))
+        return batches
+
+    def push(self, batches):
+        """
+        call the pushes without holding lock, dropping the subscribers whose push raises
+        """
+        for subscription_id, push, data in batches:
+            if subscription_id not in self.subscriptions:
+                continue  # unsubscribed by an earlier push
+            try:
+                push(data)
+            except Exception:
+                self.unsubscribe(subscription_id)
+                with self.lock:
+                    self.counters["dropped"] += 1
+                continue
+            with self.lock:
+                self.counters["pushes"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["tails"] = len(self.tails)
+            stats["subscribers"] = len(self.subscriptions)
+        return stats
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.connection.close()
@@ -1,4 +1,5 @@
 from pybfsw.gse.gsequery import rpc_server
+from pybfsw.gse.aio_server import aio_server
 from argparse import ArgumentParser
 
 p = ArgumentParser()
@@ -14,6 +15,111 @@ p.add_argument(
     "--db_file_path",
     help="path to sqlite db file to serve. if none specified, $GSE_DB_PATH is used",
 )
+p.add_argument(
+    "--db_dir",
+    help="serve all the *.sqlite files of this directory (live and archived dbs) as one db, instead of --db_file_path",
+)
+p.add_argument(
+    "--max_cursors",
+    type=int,
+    default=16,
+    help="maximum number of open streaming cursors per client connection, default is 16",
+)
+p.add_argument(
+    "--cursor_idle_timeout",
+    type=float,
+    default=600,
+    help="seconds after which an unused streaming cursor is closed, default is 600",
+)
+p.add_argument(
+    "--pool_size",
+    type=int,
+    default=4,
+    help="number of pre-warmed read-only sqlite connections shared by the clients, 0 disables the pool, default is 4",
+)
+p.add_argument(
+    "--mmap_size",
+    type=int,
+    default=2**30,
+    help="sqlite mmap_size of the pooled connections in bytes, default is 1 GiB",
+)
+p.add_argument(
+    "--cache_size_kib",
+    type=int,
+    default=256 * 1024,
+    help="sqlite page cache size of the pooled connections in KiB, default is 256 MiB",
+)
+p.add_argument(
+    "--result_cache_bytes",
+    type=int,
+    default=256 * 2**20,
+    help="size of the shared query result cache in bytes, 0 disables it, default is 256 MiB",
+)
+p.add_argument(
+    "--max_query_seconds",
+    type=float,
+    default=60,
+    help="wall clock limit of every sqlite call made for a client, 0 disables it, default is 60",
+)
+p.add_argument(
+    "--max_query_rows",
+    type=int,
+    default=1000000,
+    help="maximum number of rows a query call may return (streams are not limited), default is 1000000",
+)
+p.add_argument(
+    "--allow_scans",
+    action="store_true",
+    help="accept queries whose plan does a full scan of gfptrackerhit",
+)
+p.add_argument(
+    "--tail_interval",
+    type=float,
+    default=0.5,
+    help="seconds between two reads of the new rows pushed to subscribers, default is 0.5",
+)
+p.add_argument(
+    "--query_slots",
+    type=int,
+    default=4,
+    help="number of client calls running sqlite work at the same time, one is reserved for live clients, default is 4",
+)
+p.add_argument(
+    "--bulk_slots",
+    type=int,
+    default=1,
+    help="number of those calls that bulk (download) clients may use, default is 1",
+)
+p.add_argument(
+    "--asyncio",
+    action="store_true",
+    help="serve with the asyncio server (clients connect with aio://host:port) instead of rpyc",
+)
+p.add_argument(
+    "--workers",
+    type=int,
+    default=8,
+    help="with --asyncio, number of threads running sqlite work for all clients, default is 8",
+)
 args = p.parse_args()
 
-rpc_server(args.bind_addr, args.port, db_file_path=args.db_file_path)
+options = dict(
+    db_file_path=args.db_file_path,
+    db_dir=args.db_dir,
+    max_cursors=args.max_cursors,
+    cursor_idle_timeout=args.cursor_idle_timeout,
+    pool_size=args.pool_size,
+    mmap_size=args.mmap_size,
+    cache_size_kib=args.cache_size_kib,
+    result_cache_bytes=args.result_cache_bytes,
+    max_query_seconds=args.max_query_seconds,
+    max_query_rows=args.max_query_rows,
+    scan_guard_tables=() if args.allow_scans else ("gfptrackerhit",),
+    tail_interval=args.tail_interval,
+    query_slots=args.query_slots,
+    bulk_slots=args.bulk_slots,
+)
+if args.asyncio:
+    aio_server(args.bind_addr, args.port, max_workers=args.workers, **options)
+else:
+    rpc_server(args.bind_addr, args.port, **options)
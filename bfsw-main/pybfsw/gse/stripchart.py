@@ -84,6 +84,8 @@ class StripchartWidget(QWidget):
         if json != None:
             self.load_json(json)
         self.data = {}
+        self.live_window = None
+        self.live_key = None
         # self.log(f"info: db path: {self.gsequery.full_path}") #doesn't work with RPC
         self.timer_callback()
         self.show_project_and_path()
@@ -97,6 +99,8 @@ class StripchartWidget(QWidget):
         f["showquery"] = StringSet("t", "f")
         f["symbolsize"] = int
         f["dt"] = float
+        f["bins"] = int
+        f["decimate"] = float
         f["t1"] = float
         f["t2"] = float
         f["width"] = int
@@ -113,6 +117,8 @@ class StripchartWidget(QWidget):
         self.parameter("showquery", "f")
         self.parameter("symbolsize", 8)
         self.parameter("dt", 1200)
+        self.parameter("bins", 2000)
+        self.parameter("decimate", 3600)
         self.parameter("t2", time.time())
         self.parameter("t1", time.time() - 1200)
         self.parameter("width", 900)
@@ -579,14 +585,40 @@ class StripchartWidget(QWidget):
         else:
             t1 = self.parameter("t1")
             t2 = self.parameter("t2")
+        # windows longer than "decimate" seconds are reduced to "bins" min/max bins on the server
+        decimate = self.parameter("bins") > 0 and t2 - t1 > self.parameter("decimate")
         data = {}
+        names = [tr["name"] for tr in self.parameter("traces")]
+        if decimate:
+            self.live_window = None
+        elif self.parameter("mode") == "live":
+            # only the rows added since the last refresh are fetched
+            key = (names, self.parameter("dt"))
+            if self.live_window is None or self.live_key != key:
+                self.live_window = self.gsequery.live_window(names, self.parameter("dt"))
+                self.live_key = key
+            grouped = self.live_window.update(t2)
+        else:
+            self.live_window = None
+            # one query per table (and where clause) for all the traces
+            grouped = self.gsequery.time_query2(names, t1, t2)
         for tr in self.parameter("traces"):
             name = tr["name"]
-            ret = self.gsequery.time_query3(name, t1, t2)
+            if decimate:
+                ret = self.gsequery.time_query_binned(name, t1, t2, self.parameter("bins"))
+                if ret is not None:
+                    # draw the min/max envelope of each bin
+                    ret = (
+                        np.repeat(ret["time"], 2),
+                        np.stack((ret["min"], ret["max"]), axis=1).ravel(),
+                        ret["parameter"],
+                    )
+            else:
+                ret = grouped[name]
             if ret is None:
                 self.log(f"warning: no data found for {name} in range [{t1},{t2}]")
             else:
-                data[name] = self.gsequery.time_query3(name, t1, t2)
+                data[name] = ret
         if data.keys() != self.data.keys():
             self.regenerate_layout = True
         else:
@@ -757,7 +789,7 @@ if __name__ == "__main__":
     parser.add_argument("--collapse", action="store_true")
     parser.add_argument("traces", nargs="*")
     args = parser.parse_args()
-    gsequery = GSEQuery(path=args.path, project=args.project)
+    gsequery = GSEQuery(path=args.path, project=args.project, priority="live")
     app = QApplication([])
     sc = StripchartWidget(gsequery, json=args.json)
     for trace in args.traces:
@@ -63,7 +63,7 @@ class TermGseApp(App):
     def __init__(self, yaml, path=None, project=None):
         with open(yaml) as fp:
             self.cfg = safe_load(fp)
-        self.gsequery = GSEQuery(path=path, project=project)
+        self.gsequery = GSEQuery(path=path, project=project, priority="live")
         self.parameter_groups = None
         super().__init__()
 
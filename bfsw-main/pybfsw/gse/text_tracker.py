@@ -10,7 +10,7 @@ from pybfsw.gse.gsequery import GSEQuery
 import time
 import numpy as np
 
-q = GSEQuery()
+q = GSEQuery(priority="live")
 
 
 def make_table():
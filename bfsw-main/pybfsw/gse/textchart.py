@@ -10,7 +10,7 @@ from rich.table import Table
 from pybfsw.gse.gsequery import GSEQuery
 import time
 
-q = GSEQuery()
+q = GSEQuery(priority="live")
 
 names = q.get_column_names(args.table)
 
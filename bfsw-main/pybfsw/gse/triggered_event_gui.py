@@ -38,7 +38,7 @@ class MergedEventWindow(QWidget):
         self.init_ui()  # set up the gui layout
 
         # set up the gse query for use in "update" # NOTE keep for future use
-        self.q = GSEQuery(project="gaps",path=path)
+        self.q = GSEQuery(project="gaps",path=path,priority="live")
         #self.pg = {}
         #self.conn = connect("gsedb_merged_events_only.sqlite") #NOTE should go to zmq in the future
 
@@ -170,8 +170,9 @@ class MergedEventWindow(QWidget):
             sql = "select * from mergedevent where (rowid = " + str(row_id) + ")"
 
         #row = self.conn.execute(sql).fetchone() 
-        self.q.dbi.query_start(sql)
-        row = self.q.dbi.query_fetch(1)
+        cursor_id = self.q.dbi.query_start(sql)
+        row = self.q.dbi.query_fetch(1, cursor_id)
+        self.q.dbi.query_close(cursor_id)
 
         # check that we are looking at a valid event, and retrieve the binary blob if so
         blob = 0
@@ -0,0 +1,134 @@
+import gc
+import sqlite3
+import sys
+import threading
+import time
+from os.path import abspath, dirname
+
+import pytest
+
+# the tests import pybfsw from this checkout
+sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
+
+# the *_test.py files next to the test_*.py ones are manual scripts run against a live db
+collect_ignore_glob = ["*_test.py", "*_test[0-9].py"]
+
+SCHEMA = [
+    "create table gfptrackerpacket (rowid INTEGER NOT NULL PRIMARY KEY,gsemode INTEGER NOT NULL,"
+    "gcutime REAL NOT NULL,counter INTEGER NOT NULL,length INTEGER NOT NULL,sysid INTEGER NOT NULL,"
+    "row INTEGER NOT NULL,systime INTEGER NOT NULL,daqcounter INTEGER NOT NULL,numevents INTEGER NOT NULL)",
+    "create unique index gfptrackerpacket_idx0 on gfptrackerpacket (gcutime,counter)",
+    "create table gfptrackerevent (rowid INTEGER NOT NULL PRIMARY KEY,parent INTEGER NOT NULL,"
+    "numhits INTEGER NOT NULL,eventidvalid INTEGER NOT NULL,eventid INTEGER NOT NULL,eventtime INTEGER NOT NULL)",
+    "create index gfptrackerevent_parent on gfptrackerevent (parent)",
+    "create table gfptrackerhit (parent INTEGER NOT NULL,row INTEGER NOT NULL,module INTEGER NOT NULL,"
+    "channel INTEGER NOT NULL,adcdata INTEGER NOT NULL,asiceventcode INTEGER NOT NULL,"
+    "primary key (parent,row,module,channel)) without rowid",
+    "create table pdu_hkp (rowid INTEGER NOT NULL PRIMARY KEY,gcutime REAL NOT NULL,counter INTEGER NOT NULL,"
+    "pduid INTEGER NOT NULL,vbus1 INTEGER NOT NULL,ibus1 INTEGER NOT NULL,temp0 INTEGER NOT NULL)",
+    "create index pdu_hkp_gcutime on pdu_hkp (gcutime)",
+]
+
+
+def fill_db(path, t0=1000.0, npackets=100, dt=1.0):
+    """
+    write npackets tracker packets (2 events of 3 hits each) and as many pdu_hkp rows, every dt
+    seconds from t0, into the sqlite file path (created with the gse schema if needed)
+    """
+    connection = sqlite3.connect(path)
+    for statement in SCHEMA:
+        connection.execute(statement.replace("create table", "create table if not exists").replace(
+            "create unique index", "create unique index if not exists").replace(
+            "create index", "create index if not exists"))
+    packet = connection.execute("select coalesce(max(rowid), 0) from gfptrackerpacket").fetchone()[0]
+    event = connection.execute("select coalesce(max(rowid), 0) from gfptrackerevent").fetchone()[0]
+    for i in range(npackets):
+        packet += 1
+        t = t0 + i * dt
+        connection.execute(
+            "insert into gfptrackerpacket values (?,0,?,?,0,?,?,0,0,2)", (packet, t, packet, 128 + i % 7, i % 3)
+        )
+        for k in range(2):
+            event += 1
+            connection.execute("insert into gfptrackerevent values (?,?,3,1,?,0)", (event, packet, event))
+            for h in range(3):
+                connection.execute(
+                    "insert into gfptrackerhit values (?,?,?,?,?,?)",
+                    (event, i % 3, (k * 3 + h) % 6, (event + h) % 32, (event * 37 + h * 101) % 4096, 1),
+                )
+        connection.execute("insert into pdu_hkp (gcutime,counter,pduid,vbus1,ibus1,temp0) values (?,?,?,?,?,?)",
+                           (t, packet, i % 2, 1000 + i, 10 * i, 20))
+    connection.commit()
+    connection.close()
+    return path
+
+
+@pytest.fixture
+def gse_db(tmp_path):
+    return fill_db(str(tmp_path / "gse.sqlite"))
+
+
+@pytest.fixture
+def rpc_server():
+    """
+    start(**make_service options) serves a db with a threaded rpyc server on a free port and
+    returns its host:port
+    """
+    from rpyc.utils.server import ThreadedServer
+    from pybfsw.gse.gsequery import make_service
+
+    servers = []
+
+    def start(**kwargs):
+        kwargs.setdefault("pool_size", 0)
+        server = ThreadedServer(
+            make_service(**kwargs), port=0, hostname="127.0.0.1", protocol_config={"allow_public_attrs": True}
+        )
+        threading.Thread(target=server.start, daemon=True).start()
+        servers.append(server)
+        while not server.active:
+            time.sleep(0.01)
+        return f"127.0.0.1:{server.port}"
+
+    yield start
+    # disconnect the clients still referenced by tracebacks before the sockets are closed under them
+    gc.collect()
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def aio_server():
+    """
+    start(**options) serves a db with an AioServer on a free port, in an event loop thread, and
+    returns its aio://host:port. options are those of AioServer (max_workers, bulk_workers,
+    live_workers) and of make_service
+    """
+    import asyncio
+    from pybfsw.gse.aio_server import AioServer
+    from pybfsw.gse.gsequery import make_service
+
+    servers = []
+
+    def start(max_workers=8, bulk_workers=2, live_workers=2, **kwargs):
+        kwargs.setdefault("pool_size", 0)
+        server = AioServer(make_service(**kwargs), max_workers, bulk_workers, live_workers)
+        loop = asyncio.new_event_loop()
+        listening = loop.run_until_complete(asyncio.start_server(server.handle_client, "127.0.0.1", 0))
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        servers.append((loop, listening))
+        return f"aio://127.0.0.1:{listening.sockets[0].getsockname()[1]}"
+
+    yield start
+    gc.collect()
+
+    async def stop(listening):
+        listening.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for loop, listening in servers:
+        asyncio.run_coroutine_threadsafe(stop(listening), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
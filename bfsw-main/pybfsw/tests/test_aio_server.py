@@ -0,0 +1,136 @@
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from quickle import dumps, loads
+from pybfsw.gse.aio_server import HEADER, RemoteError, frame
+from pybfsw.gse.gsequery import DBInterface
+
+# a statement running until the server interrupts it after max_query_seconds
+SLOW_SQL = "with recursive c(x) as (select 1 union all select x + 1 from c) select count(*) + {} from c"
+
+# a result of several MB, read by the client in many socket reads
+BIG_SQL = (
+    "with recursive c(x) as (select 1 union all select x + 1 from c limit 20000) "
+    "select x, x * 0.5, printf('%0100d', x) from c"
+)
+
+
+def read_reply(sock):
+    file = sock.makefile("rb")
+    (n,) = HEADER.unpack(file.read(HEADER.size))
+    return loads(file.read(n))
+
+
+def test_frames(gse_db, aio_server):
+    host, port = aio_server(db_file_path=gse_db)[len("aio://"):].split(":")
+    with socket.create_connection((host, int(port))) as sock:
+        # a request split across several writes is read as one frame
+        data = frame(dumps(("query", ("select count(*) from pdu_hkp",), {})))
+        for i in range(0, len(data), 5):
+            sock.sendall(data[i:i + 5])
+            time.sleep(0.01)
+        status, result = read_reply(sock)
+        assert status == "ok" and loads(result) == [(100,)]
+        sock.sendall(frame(dumps(("nope", (), {}))))
+        status, etype, message = read_reply(sock)
+        assert (status, etype) == ("error", "AttributeError") and "nope" in message
+
+
+def test_round_trip(gse_db, aio_server):
+    dbi = DBInterface(aio_server(db_file_path=gse_db))
+    local = DBInterface(gse_db)
+    assert dbi.query("select * from pdu_hkp where gcutime >= ?", (1090.0,)) == local.query(
+        "select * from pdu_hkp where gcutime >= ?", (1090.0,))
+    rows = dbi.query(BIG_SQL)
+    assert rows == local.query(BIG_SQL)
+    arrays = dbi.query_arrays(BIG_SQL)
+    assert np.array_equal(arrays["x * 0.5"], [r[1] for r in rows])
+    # several requests in flight on one connection, the replies come back in order
+    pending = [dbi.connection.root.query.async_(f"select {i}") for i in range(20)]
+    assert [loads(dbi.decode(p.value)) for p in pending] == [[(i,)] for i in range(20)]
+
+
+def test_streaming(gse_db, aio_server):
+    dbi = DBInterface(aio_server(db_file_path=gse_db))
+    local = DBInterface(gse_db)
+    batches = list(dbi.query_stream("select * from pdu_hkp", 7, arrays=False))
+    assert [len(b) for b in batches] == [7] * 14 + [2]
+    assert [r for b in batches for r in b] == local.query("select * from pdu_hkp")
+    pages = list(dbi.query_pages(None, "gfptrackerpacket", 1010.0, 1040.0, 4, arrays=False))
+    assert pages == list(local.query_pages(None, "gfptrackerpacket", 1010.0, 1040.0, 4, arrays=False))
+    assert pages[-1][1] is None
+
+
+def test_compression(gse_db, aio_server):
+    dbi = DBInterface(aio_server(db_file_path=gse_db), compression="zlib")
+    assert dbi.compression == "zlib"
+    assert dbi.query(BIG_SQL) == DBInterface(gse_db).query(BIG_SQL)
+    assert dbi.compression_stats[-1]["raw_bytes"] > dbi.compression_stats[-1]["wire_bytes"]
+
+
+def test_errors(gse_db, aio_server):
+    dbi = DBInterface(aio_server(db_file_path=gse_db))
+    with pytest.raises(RemoteError, match="OperationalError: no such table"):
+        dbi.query("select * from missing")
+    with pytest.raises(AttributeError, match="no such method"):
+        dbi.connection.root.missing()
+    # the connection is still in sync after the errors
+    assert dbi.query("select count(*) from pdu_hkp") == [(100,)]
+
+
+def test_cancel(gse_db, aio_server):
+    # the cancel is answered on the event loop, not queued behind the statement
+    path = aio_server(db_file_path=gse_db, max_query_seconds=60.0)
+    dbi = DBInterface(path)
+    errors = []
+
+    def run():
+        try:
+            dbi.query(SLOW_SQL.format(0))
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.3)
+    t0 = time.perf_counter()
+    assert dbi.cancel()
+    thread.join(10)
+    assert not thread.is_alive() and time.perf_counter() - t0 < 5
+    assert len(errors) == 1 and "cancelled" in str(errors[0])
+    assert dbi.guard_stats()["cancelled"] == 1
+    assert dbi.query("select count(*) from pdu_hkp") == [(100,)]
+
+
+def test_live_call_while_analysis_is_saturated(gse_db, aio_server):
+    # 2 analysis slots (one of the 3 is reserved for live calls), taken by 2 slow calls, the other
+    # analysis calls wait for them in the 4 workers or in the executor queue
+    path = aio_server(db_file_path=gse_db, max_workers=4, query_slots=3, max_query_seconds=2.0)
+    live = DBInterface(path, priority="live")
+    errors = []
+
+    def analysis(i):
+        dbi = DBInterface(path)
+        try:
+            # distinct statements, identical ones would share one execution
+            dbi.query(SLOW_SQL.format(i))
+        except Exception as e:
+            errors.append(e)
+        dbi.connection.close()
+
+    threads = [threading.Thread(target=analysis, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.3)
+    t0 = time.perf_counter()
+    assert live.query("select count(*) from pdu_hkp") == [(100,)]
+    assert time.perf_counter() - t0 < 1.0
+    live.connection.close()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 6
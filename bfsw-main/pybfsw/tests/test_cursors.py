@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from pybfsw.gse.gsequery import DBInterface
+
+
+def test_unnamed_streams_replace_each_other(rpc_server, gse_db):
+    dbi = DBInterface(rpc_server(db_file_path=gse_db, max_cursors=2))
+    for i in range(10):
+        # a panel refreshing with query_start and never closing
+        dbi.query_start("select rowid from pdu_hkp where rowid = ?", params=(i + 1,))
+        assert dbi.query_fetch(1) == [(i + 1,)]
+
+
+def test_named_streams_are_limited(rpc_server, gse_db):
+    dbi = DBInterface(rpc_server(db_file_path=gse_db, max_cursors=2))
+    a = dbi.query_start("select rowid from pdu_hkp order by rowid", named=True)
+    b = dbi.query_start("select rowid from pdu_hkp order by rowid desc", named=True)
+    with pytest.raises(Exception, match="too many open cursors"):
+        dbi.query_start("select 1", named=True)
+    assert dbi.query_fetch(2, a) == [(1,), (2,)]
+    assert dbi.query_fetch(1, b) == [(100,)]
+    dbi.query_close(a)
+    c = dbi.query_start("select rowid from pdu_hkp where rowid > ?", params=(98,), named=True)
+    assert dbi.query_fetch(5, c) == [(99,), (100,)]
+    assert dbi.query_fetch(1, b) == [(99,)]
+
+
+def test_unnamed_stream_keeps_named_ones(rpc_server, gse_db):
+    dbi = DBInterface(rpc_server(db_file_path=gse_db, max_cursors=2))
+    a = dbi.query_start("select rowid from pdu_hkp order by rowid", named=True)
+    for _ in range(5):
+        dbi.query_start("select count(*) from pdu_hkp")
+        assert dbi.query_fetch(1) == [(100,)]
+    assert dbi.query_fetch(1, a) == [(1,)]
+
+
+def test_query_stream_next_to_default_stream(rpc_server, gse_db):
+    dbi = DBInterface(rpc_server(db_file_path=gse_db))
+    dbi.query_start("select rowid from pdu_hkp order by rowid")
+    total = sum(len(batch) for batch in dbi.query_stream("select * from pdu_hkp", 30))
+    assert total == 100
+    assert dbi.query_fetch(2) == [(1,), (2,)]
+
+
+def test_local_cursors(gse_db):
+    dbi = DBInterface(gse_db)
+    for _ in range(50):
+        dbi.query_start("select count(*) from pdu_hkp")
+    assert len(dbi.cursors.cursors) == 1
+    a = dbi.query_start("select rowid from pdu_hkp order by rowid", named=True)
+    dbi.query_start("select 1")
+    assert dbi.query_fetch(1, a) == [(1,)]
+    assert len(dbi.cursors.cursors) == 2
@@ -0,0 +1,75 @@
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from conftest import fill_db
+from pybfsw.gse.gsequery import GSEQuery
+
+
+@pytest.fixture
+def fed_dir(tmp_path):
+    # an archive and the live db written after it, rowids start again from 1 in the live db
+    fill_db(str(tmp_path / "archive.sqlite"), t0=1000.0, npackets=100)
+    fill_db(str(tmp_path / "live.sqlite"), t0=1100.0, npackets=50)
+    return str(tmp_path)
+
+
+@pytest.fixture(params=["local", "remote"])
+def fed_path(request, fed_dir, rpc_server):
+    if request.param == "local":
+        return fed_dir
+    return rpc_server(db_dir=fed_dir)
+
+
+def test_latest_time(fed_path):
+    q = GSEQuery(path=fed_path)
+    assert q.get_latest_time("pdu_hkp") == 1149.0
+    sql = "select gcutime from pdu_hkp where gcutime >= (select max(gcutime) from pdu_hkp) limit 1"
+    assert q.dbi.query(sql) == [(1149.0,)]
+
+
+def test_descending_merge(fed_path):
+    q = GSEQuery(path=fed_path)
+    sql = "select gcutime from pdu_hkp where gcutime >= ? and gcutime < ? order by gcutime desc"
+    rows = q.dbi.query(sql, (1090.0, 1110.0))
+    assert [r[0] for r in rows] == [1109.0 - i for i in range(20)]
+
+
+def test_rowid_pointers_read_the_live_file(fed_path):
+    q = GSEQuery(path=fed_path)
+    assert q.tracker_query2() == (None, (50, 1149.0))
+    rows, lastptr = q.get_latest_rows("pdu_hkp", limit=2, lastptr=(45, 1140.0))
+    assert [r[1] for r in rows] == [1149.0, 1148.0] and lastptr == (50, 1149.0)
+    assert [r[1] for r in q.get_latest_n_rows("pdu_hkp", 3)] == [1147.0, 1148.0, 1149.0]
+
+
+def test_aggregates(fed_path):
+    q = GSEQuery(path=fed_path)
+    with pytest.raises(ValueError, match="binned"):
+        q.dbi.query("select count(*) from pdu_hkp")
+    assert q.dbi.query("select count(*) from pdu_hkp where gcutime >= ? and gcutime < ?", (1000.0, 1050.0)) == [(50,)]
+    assert q.get_table_names().count("pdu_hkp") == 1
+
+
+def test_rowid_tie_break_allowed(fed_path):
+    q = GSEQuery(path=fed_path)
+    sql = (
+        "select gcutime from pdu_hkp where gcutime >= ? and gcutime <= ? and (gcutime > ? or rowid > ?) "
+        "order by gcutime, rowid"
+    )
+    rows = q.dbi.query(sql, (1095.0, 1105.0, 1095.0, 0))
+    assert [r[0] for r in rows] == [1095.0 + i for i in range(11)]
+
+
+def test_limit_after_merge(fed_path):
+    q = GSEQuery(path=fed_path)
+    sql = "select gcutime from pdu_hkp where gcutime >= ? and gcutime < ? order by gcutime desc limit ?"
+    assert q.dbi.query(sql, (1090.0, 1110.0, 3)) == [(1109.0,), (1108.0,), (1107.0,)]
+
+
+def test_keyset_pages(fed_path):
+    q = GSEQuery(path=fed_path)
+    pages = list(q.dbi.query_pages(None, "gfptrackerpacket", 1050.0, 1130.0, 7, arrays=False))
+    times = [row[2] for batch, _ in pages for row in batch]
+    assert times == [1050.0 + i for i in range(80)]
+    assert all(len(batch) == 7 for batch, _ in pages[:-1])
+    assert pages[-1][1] is None
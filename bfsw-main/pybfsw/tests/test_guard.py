@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from pybfsw.gse.gsequery import DBInterface
+
+SLOW_SQL = "with recursive c(x) as (select 1 union all select x + 1 from c) select count(*) from c"
+
+HITS_SQL = (
+    "select gfptrackerhit.adcdata from gfptrackerpacket "
+    "join gfptrackerevent on gfptrackerevent.parent = gfptrackerpacket.rowid "
+    "join gfptrackerhit on gfptrackerhit.parent = gfptrackerevent.rowid "
+    "where gfptrackerpacket.gcutime >= ? and gfptrackerpacket.gcutime < ?"
+)
+
+
+def test_scan_of_the_hit_table_is_rejected(gse_db, rpc_server):
+    dbi = DBInterface(rpc_server(db_file_path=gse_db))
+    with pytest.raises(Exception, match="full scan of gfptrackerhit"):
+        dbi.query("select * from gfptrackerhit where adcdata > 10")
+    assert len(dbi.query(HITS_SQL, (1000.0, 1002.0))) == 12
+    assert dbi.guard_stats()["rejected"] == 1
+
+
+def test_row_limit(gse_db, rpc_server):
+    dbi = DBInterface(rpc_server(db_file_path=gse_db, max_query_rows=10, result_cache_bytes=0))
+    with pytest.raises(Exception, match="more than 10 rows"):
+        dbi.query("select * from pdu_hkp")
+    with pytest.raises(Exception, match="more than 10 rows"):
+        dbi.query_arrays("select * from pdu_hkp")
+    assert len(dbi.query("select * from pdu_hkp limit 10")) == 10
+    # streaming is not limited
+    assert sum(len(b) for b in dbi.query_stream("select * from pdu_hkp", 7)) == 100
+    assert dbi.guard_stats()["row_limit"] == 2
+
+
+def test_time_limit(gse_db, rpc_server):
+    dbi = DBInterface(rpc_server(db_file_path=gse_db, max_query_seconds=0.5))
+    t0 = time.perf_counter()
+    with pytest.raises(Exception, match="time limit of 0.5 s"):
+        dbi.query(SLOW_SQL)
+    assert time.perf_counter() - t0 < 5
+    assert dbi.guard_stats()["timeouts"] == 1
+    # the session is usable after the interruption
+    assert dbi.query("select count(*) from pdu_hkp") == [(100,)]
+
+
+def test_cancel(gse_db, rpc_server):
+    dbi = DBInterface(rpc_server(db_file_path=gse_db, max_query_seconds=60.0))
+    errors = []
+
+    def run():
+        try:
+            dbi.query(SLOW_SQL)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.3)
+    t0 = time.perf_counter()
+    assert dbi.cancel()
+    thread.join(10)
+    assert not thread.is_alive() and time.perf_counter() - t0 < 5
+    assert len(errors) == 1 and "cancelled" in str(errors[0])
+    assert dbi.guard_stats()["cancelled"] == 1
+    assert dbi.query("select count(*) from pdu_hkp") == [(100,)]
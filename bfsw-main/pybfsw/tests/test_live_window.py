@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from pybfsw.gse.gsequery import GSEQuery
+
+NAMES = ["pdu_hkp:vbus1:pduid=0", "pdu_hkp:temp0:pduid=1", "gfptrackerpacket:counter"]
+
+
+def test_matches_time_query2(gse_db):
+    q = GSEQuery(path=gse_db)
+    window = q.live_window(NAMES, 20)
+    for t2 in np.arange(990.0, 1120.0, 7.5):
+        live = window.update(t2)
+        full = q.time_query2(NAMES, t2 - 20, t2)
+        for name in NAMES:
+            assert (live[name] is None) == (full[name] is None)
+            if full[name] is not None:
+                assert np.array_equal(live[name][0], full[name][0])
+                assert np.array_equal(live[name][1], full[name][1])
+                assert live[name][1].dtype == full[name][1].dtype
+
+
+def test_integer_columns_stay_integer(gse_db):
+    times, counter, _ = GSEQuery(path=gse_db).live_window(NAMES, 20).update(1050.0)["gfptrackerpacket:counter"]
+    assert counter.dtype == np.int64
+    assert times.dtype == np.float64
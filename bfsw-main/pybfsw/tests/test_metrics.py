@@ -0,0 +1,14 @@
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from pybfsw.gse.gsequery import DBInterface
+
+
+def test_query_is_recorded_not_printed(gse_db, rpc_server, capsys):
+    dbi = DBInterface(rpc_server(db_file_path=gse_db), compression="zlib")
+    assert len(dbi.query("select * from pdu_hkp")) == 100
+    assert capsys.readouterr().out == ""
+    record = dbi.stats()["recent"][-1]
+    assert record["kind"] == "query" and record["rows"] == 100
+    # the bytes sent, after compression
+    assert record["bytes"] == dbi.compression_stats[-1]["wire_bytes"]
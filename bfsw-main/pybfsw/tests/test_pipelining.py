@@ -0,0 +1,68 @@
+from collections import deque
+
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from quickle import dumps
+from pybfsw.gse.gsequery import DBInterface
+
+
+class Reply:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeRoot:
+    """
+    stands in for the connection of a framed (aio) DBInterface, recording the requests sent
+    """
+
+    def __init__(self, npages):
+        self.npages = npages
+        self.requests = []
+
+    def __getattr__(self, name):
+        return self
+
+    def async_(self, *args):
+        self.requests.append(args)
+        page = len(self.requests)
+        key = None if page == self.npages else (float(page), page)
+        return Reply((dumps([(page,)]), key))
+
+
+def fake_dbi(root):
+    dbi = DBInterface.__new__(DBInterface)
+    dbi.remote = True
+    dbi.framed = True
+    dbi.connection = root
+    root.root = root
+    dbi.fetch_stats = deque()
+    return dbi
+
+
+def test_next_page_is_requested_before_the_page_is_handed_over():
+    root = FakeRoot(3)
+    pages = fake_dbi(root).query_pages("select", "t", 0.0, 10.0, 5, arrays=False)
+    assert next(pages) == ([(1,)], (1.0, 1))
+    assert len(root.requests) == 2
+    # the second request resumes after the key of the first page
+    assert root.requests[1][5] == (1.0, 1)
+    assert [batch for batch, _ in pages] == [[(2,)], [(3,)]]
+    assert len(root.requests) == 3
+
+
+def test_slow_consumer_does_not_shrink_batches(tmp_path, rpc_server):
+    import time
+
+    from conftest import fill_db
+    from pybfsw.gse.gsequery import AdaptiveBatchSize
+
+    path = fill_db(str(tmp_path / "gse.sqlite"), npackets=3000)
+    dbi = DBInterface(rpc_server(db_file_path=path))
+    sizer = AdaptiveBatchSize(n=200, target_time=0.02, n_min=50)
+    for batch in dbi.query_stream("select * from pdu_hkp", sizer):
+        time.sleep(0.1)
+    # every batch took far less than target_time to fetch, however long it took to consume
+    assert all(b >= a for a, b in zip(sizer.history, sizer.history[1:]))
+    assert sizer.n > 200
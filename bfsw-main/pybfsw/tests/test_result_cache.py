@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from conftest import fill_db
+from pybfsw.gse.gsequery import DBInterface
+from pybfsw.gse.rpc_tools import ResultCache, gcutime_bounds, gcutime_upper_bound
+
+
+def test_upper_bound():
+    assert gcutime_upper_bound("select * from t where gcutime < 10 and gcutime <= 20") == 20.0
+    assert gcutime_upper_bound("select * from t where gcutime >= ? and gcutime < ?", (1, 2)) == 2.0
+    assert gcutime_upper_bound("select * from t where rowid > 5") is None
+    assert gcutime_upper_bound("select * from t where gcutime < 10 order by gcutime") == 10.0
+
+
+def test_or_is_unbounded():
+    sql = "select * from t where gcutime < ? or rowid > ?"
+    assert gcutime_upper_bound(sql, (10, 5)) is None
+    assert gcutime_bounds(sql, (10, 5)) == (None, None)
+    assert gcutime_bounds("select * from t where gcutime >= 1 and gcutime < 2") == (1.0, 2.0)
+
+
+def test_closed_window_needs_no_watermark(tmp_path):
+    cache = ResultCache()
+    key = ("select * from pdu_hkp where gcutime < ?", "query", (10.0,))
+    cache.put(key, b"data", None, (10.0,))
+    connection = sqlite3.connect(fill_db(str(tmp_path / "a.sqlite"), npackets=3))
+    assert cache.get(connection, key) == b"data"
+
+
+def test_or_query_is_invalidated(tmp_path):
+    path = fill_db(str(tmp_path / "a.sqlite"), npackets=3)
+    connection = sqlite3.connect(path)
+    cache = ResultCache()
+    sql = "select count(*) from pdu_hkp where gcutime < ? or rowid > ?"
+    key = (sql, "query", (10.0, 0))
+    # without a watermark an unbounded query is not cached
+    cache.put(key, b"3", None, (10.0, 0))
+    assert cache.get(connection, key) is None
+    cache.put(key, b"3", cache.watermark(connection, sql), (10.0, 0))
+    assert cache.get(connection, key) == b"3"
+    fill_db(path, t0=2000.0, npackets=1)
+    assert cache.get(connection, key) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_server_cache_follows_inserts(rpc_server, tmp_path):
+    path = fill_db(str(tmp_path / "a.sqlite"), npackets=10)
+    dbi = DBInterface(rpc_server(db_file_path=path))
+    closed = "select count(*) from pdu_hkp where gcutime < ?"
+    unbounded = "select count(*) from pdu_hkp where gcutime < ? or rowid > ?"
+    assert dbi.query(closed, (1005.0,)) == [(5,)]
+    assert dbi.query(unbounded, (1005.0, 8)) == [(7,)]
+    fill_db(path, t0=3000.0, npackets=4)
+    # the closed window is served from the cache, the other one sees the new rows
+    assert dbi.query(closed, (1005.0,)) == [(5,)]
+    assert dbi.query(unbounded, (1005.0, 8)) == [(11,)]
+    stats = dbi.cache_stats()
+    assert stats["hits"] == 1 and stats["invalidations"] == 1
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from quickle import loads
+
+from conftest import fill_db
+from pybfsw.gse.gsequery import tail_sql
+from pybfsw.gse.rpc_tools import RowTailer, open_readonly
+
+
+@pytest.fixture
+def tailer(gse_db):
+    tailer = RowTailer(open_readonly(gse_db), interval=0.02)
+    yield tailer
+    tailer.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_push_can_unsubscribe(tailer, gse_db):
+    sql, key_table = tail_sql("pdu_hkp")
+    received = []
+
+    def push(data):
+        received.append(loads(data))
+        tailer.unsubscribe(subscription_id)
+
+    subscription_id = tailer.subscribe(sql, key_table, None, push)
+    fill_db(gse_db, t0=5000.0, npackets=3)
+    wait_for(lambda: tailer.stats()["tails"] == 0)
+    fill_db(gse_db, t0=6000.0, npackets=3)
+    time.sleep(0.1)
+    assert len(received) == 1 and len(received[0]) == 3
+    assert tailer.stats()["subscribers"] == 0
+
+
+def test_slow_push_does_not_block_other_sessions(tailer, gse_db):
+    sql, key_table = tail_sql("pdu_hkp")
+    entered, release = threading.Event(), threading.Event()
+
+    def slow(data):
+        entered.set()
+        release.wait(5)
+
+    tailer.subscribe(sql, key_table, None, slow)
+    other = tailer.subscribe(sql, key_table, None, lambda data: None)
+    fill_db(gse_db, t0=5000.0, npackets=2)
+    assert entered.wait(5)
+    # the tail thread is inside a push, the state is still available
+    t0 = time.monotonic()
+    tailer.unsubscribe(other)
+    assert tailer.stats()["subscribers"] == 1
+    assert time.monotonic() - t0 < 1
+    release.set()
+
+
+def test_backlog_then_new_rows_in_order(tailer, gse_db):
+    sql, key_table = tail_sql("pdu_hkp")
+    rowids = []
+    tailer.subscribe(sql, key_table, (90, 0.0), lambda data: rowids.extend(r[-2] for r in loads(data)))
+    fill_db(gse_db, t0=5000.0, npackets=5)
+    wait_for(lambda: len(rowids) == 15)
+    assert rowids == list(range(91, 106))
+
+
+def test_failing_push_is_dropped(tailer, gse_db):
+    sql, key_table = tail_sql("pdu_hkp")
+
+    def broken(data):
+        raise ConnectionError("client gone")
+
+    tailer.subscribe(sql, key_table, None, broken)
+    fill_db(gse_db, t0=5000.0, npackets=1)
+    wait_for(lambda: tailer.stats()["dropped"] == 1)
+    assert tailer.stats()["subscribers"] == 0
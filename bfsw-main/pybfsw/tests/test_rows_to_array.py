@@ -0,0 +1,134 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from pybfsw.gse.gsequery import DBInterface, cursor_to_columns, declared_types, rows_to_array
+
+DESCRIPTION = [("i",), ("r",), ("t",), ("b",)]
+TYPES = ["INTEGER", "REAL", "TEXT", "BLOB"]
+
+
+def test_declared_types_are_kept():
+    a = rows_to_array([(1, 1.5, "ab", b"x"), (2, 2.5, "c", b"yz")], DESCRIPTION, TYPES)
+    assert a.dtype["i"] == np.int64 and a.dtype["r"] == np.float64
+    assert list(a["t"]) == ["ab", "c"] and list(a["b"]) == [b"x", b"yz"]
+
+
+def test_null_text_is_empty_string():
+    a = rows_to_array([(1, 1.0, None, None), (2, 2.0, "abc", b"x")], DESCRIPTION, TYPES)
+    assert list(a["t"]) == ["", "abc"]
+    assert list(a["b"]) == [b"", b"x"]
+    assert a.dtype["i"] == np.int64
+
+
+def test_null_text_of_untyped_column():
+    a = rows_to_array([(None,), ("long text",)], [("x",)], [])
+    assert list(a["x"]) == ["", "long text"]
+
+
+def test_null_int_is_nan():
+    a = rows_to_array([(1, None, "a", b""), (None, 2.0, "b", b"")], DESCRIPTION, TYPES)
+    assert a.dtype["i"] == np.float64
+    assert a["i"][0] == 1 and np.isnan(a["i"][1])
+    assert np.isnan(a["r"][0]) and a["r"][1] == 2.0
+    assert list(a["t"]) == ["a", "b"]
+
+
+def test_other_int_columns_stay_exact():
+    big = 2**62 + 1
+    a = rows_to_array([(None, big), (1, 2)], [("a",), ("b",)], ["INTEGER", "INTEGER"])
+    assert a.dtype["b"] == np.int64 and a["b"][0] == big
+
+
+def test_real_in_integer_column_is_not_truncated():
+    a = rows_to_array([(500, 1), (500.5, 2)], [("a",), ("b",)], ["INTEGER", "INTEGER"])
+    assert a.dtype["a"] == np.float64 and list(a["a"]) == [500.0, 500.5]
+    assert a.dtype["b"] == np.int64
+
+
+def test_empty_result():
+    a = rows_to_array([], DESCRIPTION, TYPES)
+    assert len(a) == 0 and a.dtype["i"] == np.int64
+
+
+def make_db(path):
+    connection = sqlite3.connect(path)
+    connection.execute("create table t (gcutime REAL, n INTEGER, name TEXT)")
+    rows = [(float(i), i, f"r{i}") for i in range(10)] + [(10.0, None, None)]
+    connection.executemany("insert into t values (?,?,?)", rows)
+    connection.commit()
+    connection.close()
+
+
+def test_cursor_to_columns_promotes_batches(tmp_path):
+    path = str(tmp_path / "t.sqlite")
+    make_db(path)
+    connection = sqlite3.connect(path)
+    sql = "select gcutime, n, name from t order by gcutime"
+    columns = cursor_to_columns(connection.execute(sql), declared_types(connection, sql), batch_size=4)
+    assert columns["n"].dtype == np.float64 and np.isnan(columns["n"][-1])
+    assert list(columns["n"][:10]) == list(range(10))
+    assert columns["name"][-1] == "" and columns["name"][3] == "r3"
+
+
+def test_query_arrays_nulls(tmp_path):
+    path = str(tmp_path / "t.sqlite")
+    make_db(path)
+    dbi = DBInterface(path)
+    columns = dbi.query_arrays("select n, name from t where gcutime >= ?", (9,))
+    assert columns["n"][0] == 9 and np.isnan(columns["n"][1])
+    assert list(columns["name"]) == ["r9", ""]
+    columns = dbi.query_arrays("select n, name from t where gcutime < ?", (5,))
+    assert columns["n"].dtype == np.int64
+
+
+@pytest.mark.parametrize(
+    "sql,types",
+    [
+        ("select gcutime, n, name from t", ["REAL", "INTEGER", "TEXT"]),
+        ("select t.n as x, u.n from t join t as u on t.gcutime = u.gcutime", ["INTEGER", "INTEGER"]),
+        ("select n * 0.5 as n, avg(n) as gcutime, count(*) from t", [None, None, None]),
+        ("select * from (select n, rowid from t where gcutime > ?) order by n", ["INTEGER", "INTEGER"]),
+        ("select ':n' as s, n from t where n > :n", [None, "INTEGER"]),
+    ],
+)
+def test_declared_types_of_result_columns(tmp_path, sql, types):
+    path = str(tmp_path / "t.sqlite")
+    make_db(path)
+    assert declared_types(sqlite3.connect(path), sql) == types
+
+
+def test_aliases_expressions_and_aggregates(tmp_path):
+    path = str(tmp_path / "t.sqlite")
+    make_db(path)
+    dbi = DBInterface(path)
+    columns = dbi.query_arrays("select n * 0.5 as n, gcutime as name from t where n < 3")
+    assert columns["n"].dtype == np.float64 and list(columns["n"]) == [0.0, 0.5, 1.0]
+    assert columns["name"].dtype == np.float64
+    columns = dbi.query_arrays("select avg(n) as n, max(n) as name from t")
+    assert columns["n"][0] == 4.5 and columns["name"][0] == 9
+    cursor_id = dbi.query_start("select n / 2.0 as n from t where n in (1, 2)")
+    assert list(dbi.query_fetch_array(10, cursor_id)["n"]) == [0.5, 1.0]
+
+
+@pytest.fixture(params=["local", "remote"])
+def db_path(request, gse_db, rpc_server):
+    if request.param == "local":
+        return gse_db
+    return rpc_server(db_file_path=gse_db)
+
+
+def test_expression_columns_keep_their_values(db_path):
+    from pybfsw.gse.gsequery import GSEQuery
+
+    q = GSEQuery(path=db_path)
+    sql = "select vbus1 * 0.5 as ibus1, avg(vbus1) over () as vbus1 from pdu_hkp where gcutime < ?"
+    columns = q.dbi.query_arrays(sql, (1003.0,))
+    assert list(columns["ibus1"]) == [500.0, 500.5, 501.0]
+    assert list(columns["vbus1"]) == [1001.0] * 3
+    times, y, _ = q.time_query3("pdu_hkp:vbus1*0.5", 1000.0, 1002.0)
+    assert y.dtype == np.float64 and list(y) == [500.0, 500.5, 501.0]
+    cursor_id = q.dbi.query_start(sql, params=(1003.0,))
+    assert list(q.dbi.query_fetch_array(10, cursor_id)["ibus1"]) == [500.0, 500.5, 501.0]
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from pybfsw.gse.gsequery import DBInterface
+from pybfsw.gse.rpc_tools import QueryCancelled, SingleFlight
+
+N = 5
+
+
+def run_together(flight, func, key="k"):
+    """
+    N threads calling flight.do(key, func), func only returns once all of them wait for it
+    """
+    results = [None] * N
+
+    def call(i):
+        try:
+            results[i] = flight.do(key, func)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(N)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def leader(flight, result, calls):
+    def func():
+        calls.append(1)
+        # wait for the other callers to join the flight
+        while flight.calls["k"]["waiters"] < N - 1:
+            time.sleep(0.001)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return func
+
+
+def test_one_execution():
+    flight = SingleFlight()
+    calls = []
+    results = run_together(flight, leader(flight, [1, 2], calls))
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * (N - 1)
+    assert all(result == [1, 2] for result, _ in results)
+    assert flight.stats()["executions"] == 1 and flight.stats()["coalesced"] == N - 1
+
+
+def test_leader_error_is_shared():
+    flight = SingleFlight()
+    calls = []
+    results = run_together(flight, leader(flight, ValueError("bad"), calls))
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) and str(r) == "bad" for r in results)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cancelled_leader_is_run_again():
+    flight = SingleFlight()
+    calls = []
+
+    def func():
+        calls.append(1)
+        # the waiters of the cancelled execution join the next one
+        waiters = N - 1 if len(calls) == 1 else N - 2
+        while flight.calls["k"]["waiters"] < waiters:
+            time.sleep(0.001)
+        if len(calls) == 1:
+            raise QueryCancelled("cancelled by its client")
+        return "again"
+
+    results = run_together(flight, func)
+    assert len(calls) == 2
+    assert sum(isinstance(r, QueryCancelled) for r in results) == 1
+    assert [r[0] for r in results if not isinstance(r, Exception)] == ["again"] * (N - 1)
+
+
+def test_identical_queries_share_one_execution(gse_db, rpc_server):
+    path = rpc_server(db_file_path=gse_db, result_cache_bytes=0)
+    sql = "with recursive c(x) as (select 1 union all select x + 1 from c where x < 3000000) select count(*) from c"
+    clients = [DBInterface(path) for _ in range(N)]
+    barrier = threading.Barrier(N)
+    results = [None] * N
+
+    def query(i):
+        barrier.wait()
+        results[i] = clients[i].query(sql)
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in range(N)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert results == [[(3000000,)]] * N
+    coalescing = clients[0].stats()["coalescing"]
+    assert coalescing["executions"] == 1 and coalescing["coalesced"] == N - 1
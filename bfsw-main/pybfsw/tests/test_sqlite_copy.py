@@ -0,0 +1,28 @@
+import os
+import sqlite3
+import subprocess
+import sys
+from os.path import abspath, dirname, join
+
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+
+BFSW = dirname(dirname(dirname(abspath(__file__))))
+
+
+def test_copy_above_the_row_limit(rpc_server, gse_db, tmp_path):
+    address = rpc_server(db_file_path=gse_db, max_query_rows=10)
+    out = str(tmp_path / "copy.sqlite")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([BFSW, os.environ.get("PYTHONPATH", "")]))
+    script = join(BFSW, "pybfsw", "common", "sqlite_copy.py")
+    result = subprocess.run(
+        [sys.executable, script, address, out, "1010", "1049", "--batch_size", "7"],
+        env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    connection = sqlite3.connect(out)
+    assert connection.execute("select count(*), min(gcutime), max(gcutime) from pdu_hkp").fetchone() == (40, 1010.0, 1049.0)
+    assert connection.execute("select count(*) from gfptrackerpacket").fetchone() == (40,)
+    # tables without a gcutime column are not copied by this script
+    assert "failed on table gfptrackerhit" in result.stdout
@@ -0,0 +1,45 @@
+from sqlite3 import connect
+
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from pybfsw.gse.gsequery import DBInterface
+from pybfsw.gse.rpc_tools import CountingConnection, StatementCache, statement_stats
+
+
+def test_lru_counts():
+    cache = StatementCache(size=2)
+    for sql in ["a", "b", "a", "c", "b", "a"]:
+        cache.note(sql)
+    # b was evicted by c, then a by b
+    assert cache.stats() == {"compiles": 5, "reuses": 1, "cached": 2, "size": 2}
+
+
+def test_bound_parameters_reuse_the_statement(gse_db):
+    connection = connect(gse_db, factory=CountingConnection, cached_statements=16)
+    for t in range(10):
+        connection.execute("select * from pdu_hkp where gcutime > ?", (1000.0 + t,)).fetchall()
+    assert statement_stats(connection) == {"compiles": 1, "reuses": 9, "cached": 1, "size": 16}
+    for t in range(10):
+        connection.execute(f"select * from pdu_hkp where gcutime > {1000.0 + t}").fetchall()
+    assert statement_stats(connection)["compiles"] == 11
+    assert statement_stats(object()) == {}
+
+
+@pytest.fixture(params=["local", "remote"])
+def db_path(request, gse_db, rpc_server):
+    if request.param == "local":
+        return gse_db
+    return rpc_server(db_file_path=gse_db, result_cache_bytes=0)
+
+
+def test_polling_compiles_once(db_path):
+    dbi = DBInterface(db_path)
+    sql = "select *, rowid from pdu_hkp where rowid > ? and gcutime >= ?"
+    dbi.query(sql, (10, 1000.0))
+    before = dbi.statement_stats()
+    for rowid in range(20, 70, 10):
+        assert len(dbi.query(sql, (rowid, 1000.0))) == 100 - rowid
+    after = dbi.statement_stats()
+    assert after["compiles"] == before["compiles"]
+    assert after["reuses"] >= before["reuses"] + 5
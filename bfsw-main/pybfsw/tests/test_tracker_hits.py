@@ -0,0 +1,56 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+from pybfsw.gse.gsequery import GSEQuery, tracker_channel_index, tracker_channel_unpack
+
+
+def columns(rows):
+    # the tracker_query2 rows as the tracker_hits columns, without eventid
+    names = ("layer", "row", "module", "channel", "adcdata", "asiceventcode", "rowid", "gcutime")
+    res = {name: np.array([r[i] for r in rows]) for i, name in enumerate(names)}
+    res["layer"] = res["layer"] - 128
+    return res
+
+
+@pytest.mark.parametrize("lastptr", [(0, 0.0), (40, 1039.0)])
+def test_same_hits_as_tracker_query2(gse_db, lastptr):
+    q = GSEQuery(path=gse_db)
+    rows, nextptr = q.tracker_query2(lastptr=lastptr)
+    res = q.tracker_hits(lastptr=lastptr)
+    expected = columns(rows)
+    # tracker_query2 has no order within a packet, compare the hits sorted by (rowid, row, module, channel)
+    order = np.lexsort((res["channel"], res["module"], res["row"], res["rowid"]))
+    order2 = np.lexsort((expected["channel"], expected["module"], expected["row"], expected["rowid"]))
+    for name, values in expected.items():
+        assert np.array_equal(res[name][order], values[order2]), name
+    assert (res["rowid"][-1], res["gcutime"][-1]) == nextptr
+
+
+def test_time_range_and_selection(gse_db):
+    q = GSEQuery(path=gse_db)
+    rows, _ = q.tracker_query2(lastptr=(0, 0.0))
+    keep = [r for r in rows if 1010.0 < r[7] <= 1030.0 and r[0] - 128 in (1, 2) and r[4] >= 1000]
+    res = q.tracker_hits(1010.0, 1030.0, layers=[1, 2], adc_min=1000, channel_index=True)
+    assert len(res["layer"]) == len(keep) > 0
+    assert sorted(res["adcdata"].tolist()) == sorted(r[4] for r in keep)
+    assert res["layer"].dtype == np.uint8 and set(res["layer"].tolist()) <= {1, 2}
+    layer, row, module, channel = tracker_channel_unpack(res["channel_index"])
+    assert np.array_equal(layer, res["layer"]) and np.array_equal(channel, res["channel"])
+    assert np.array_equal(tracker_channel_index(layer, row, module, channel), res["channel_index"])
+
+
+def test_sysid_below_128(gse_db):
+    q = GSEQuery(path=gse_db)
+    with pytest.raises(ValueError, match="layers"):
+        q.tracker_hits(1000.0, 1010.0, layers=[-1])
+    connection = sqlite3.connect(gse_db)
+    connection.execute("update gfptrackerpacket set sysid = 5 where rowid = 3")
+    connection.commit()
+    connection.close()
+    # the hits of the other packets are still read
+    assert len(q.tracker_hits(1002.0, 1010.0)["layer"]) == 8 * 6
+    with pytest.raises(ValueError, match="sysid 5"):
+        q.tracker_hits(1000.0, 1010.0)
@@ -4,7 +4,15 @@ from datetime import datetime
 from progress.bar import IncrementalBar
 import pytz
 import sys
-from os.path import join
+from os import remove, replace, makedirs
+from os.path import join, exists
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import mkdtemp
+from threading import Lock
+import shutil
+import time
+import json
 
 import matplotlib.pyplot as plt
 
@@ -12,7 +20,7 @@ sys.path.append(
     "/home/lucaghislotti/Documents/GitHub/GAPS_remote_data_downloader/bfsw-main"
 )
 
-from pybfsw.gse.gsequery import GSEQuery
+from pybfsw.gse.gsequery import DBInterface
 
 
 # SSH port forwarding to GSE machine
@@ -23,22 +31,340 @@ from pybfsw.gse.gsequery import GSEQuery
 # pip install quickle
 # pit install rpyc
 
+# Address of the forwarded RPC server
+SERVER_PATH = "127.0.0.1:44555"
 
-def pd_to_csv(pd, filepath, datetime_start, datetime_stop):
-    filename = "data_" + str(datetime_start.day) + "_" + str(datetime_start.month) + "_" + str(datetime_start.year) + "_" + str(datetime_start.hour) + "_" + str(datetime_start.minute) + "_" + str(datetime_start.second) + "_to_" + str(datetime_stop.day) + "_" + str(datetime_stop.month) + "_" + str(datetime_stop.year) + "_" + str(datetime_stop.hour) + "_" + str(datetime_stop.minute) + "_" + str(datetime_stop.second) +".csv"
+# Number of rows requested from the server for each fetched batch, "adaptive"
+# lets DBInterface tune it from the measured batch time and size
+FETCH_SIZE = "adaptive"
+
+# Number of times a shard reconnects and resumes after losing the server
+MAX_RETRIES = 5
+
+# Length in seconds of the shards of a resumable download when their number
+# is not given, so that an interrupted download only fetches again the few
+# minutes of its unfinished shards
+RESUME_SHARD_SECONDS = 300
+
+
+def make_filename(datetime_start, datetime_stop, ext="csv"):
+    return "data_" + str(datetime_start.day) + "_" + str(datetime_start.month) + "_" + str(datetime_start.year) + "_" + str(datetime_start.hour) + "_" + str(datetime_start.minute) + "_" + str(datetime_start.second) + "_to_" + str(datetime_stop.day) + "_" + str(datetime_stop.month) + "_" + str(datetime_stop.year) + "_" + str(datetime_stop.hour) + "_" + str(datetime_stop.minute) + "_" + str(datetime_stop.second) + "." + ext
+
+
+# Output columns and their types. The narrow integer types match the
+# fields of the tracker hit packets and are what the columnar formats store.
+HIT_DTYPES = {
+    "layer": np.uint8,
+    "row": np.uint8,
+    "module": np.uint8,
+    "channel": np.uint8,
+    "adcdata": np.uint16,
+    "asiceventcode": np.uint8,
+    "eventid": np.uint32,
+    "gcutime": np.float64,
+}
+
+
+# Streaming CSV writer: every fetched batch is appended to the output file
+# as soon as it arrives, so memory stays bounded by the fetch size and the
+# cost of a batch does not depend on how much was downloaded before it.
+# The header is written when the file is opened, so an empty window still
+# gives a CSV with the output columns.
+class CSVWriter:
+    ext = "csv"
+
+    def __init__(self, out_filepath):
+        self.out_filepath = out_filepath
+        self.file = open(out_filepath, "w", newline="")
+        pd.DataFrame(columns=list(HIT_DTYPES)).to_csv(self.file)
+        self.nrows = 0
+
+    def write(self, df):
+        df.to_csv(self.file, header=False)
+        self.nrows += len(df)
+
+    def close(self):
+        self.file.close()
+
+    # Concatenates the CSV files of the time shards, in shard order, into the
+    # final output file. The header is written once and the header line of
+    # every part is skipped, parts of empty shards only have their header.
+    @staticmethod
+    def merge(part_paths, out_filepath):
+        with open(out_filepath, "w", newline="") as fout:
+            pd.DataFrame(columns=list(HIT_DTYPES)).to_csv(fout)
+            for part_path in part_paths:
+                with open(part_path, "r", newline="") as fin:
+                    fin.readline()
+                    shutil.copyfileobj(fin, fout)
+
+
+# Streaming Parquet writer (needs pyarrow): each fetched batch becomes one
+# row group of the output file, with the column types of HIT_DTYPES.
+class ParquetWriter:
+    ext = "parquet"
+
+    def __init__(self, out_filepath):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.out_filepath = out_filepath
+        schema = pa.schema([(name, pa.from_numpy_dtype(dtype)) for name, dtype in HIT_DTYPES.items()])
+        self.writer = pq.ParquetWriter(out_filepath, schema)
+        self.nrows = 0
+
+    def write(self, df):
+        self.writer.write_table(self.pa.Table.from_pandas(df, schema=self.writer.schema, preserve_index=False))
+        self.nrows += len(df)
+
+    def close(self):
+        self.writer.close()
+
+    # Copies the row groups of the shard files, in shard order, into the
+    # final output file
+    @staticmethod
+    def merge(part_paths, out_filepath):
+        import pyarrow.parquet as pq
+
+        writer = None
+        for part_path in part_paths:
+            part = pq.ParquetFile(part_path)
+            if writer is None:
+                writer = pq.ParquetWriter(out_filepath, part.schema_arrow)
+            for i in range(part.num_row_groups):
+                writer.write_table(part.read_row_group(i))
+        writer.close()
+
+
+# Streaming writer for a directory of .npy files, one per column. The
+# columns can be reloaded without parsing with load_columns, which memory
+# maps them. Batches are appended to raw files and the .npy headers are
+# written when the number of rows is known.
+class NpyWriter:
+    ext = "columns"
+
+    def __init__(self, out_filepath):
+        self.out_filepath = out_filepath
+        makedirs(out_filepath, exist_ok=True)
+        self.files = {name: open(join(out_filepath, name + ".raw"), "wb") for name in HIT_DTYPES}
+        self.nrows = 0
+
+    def write(self, df):
+        for name, dtype in HIT_DTYPES.items():
+            self.files[name].write(np.ascontiguousarray(df[name].to_numpy(dtype=dtype)).tobytes())
+        self.nrows += len(df)
+
+    def close(self):
+        for name, f in self.files.items():
+            f.close()
+            raw_path = join(self.out_filepath, name + ".raw")
+            write_npy(join(self.out_filepath, name + ".npy"), HIT_DTYPES[name], self.nrows, [(raw_path, 0)])
+            remove(raw_path)
+
+    # Concatenates the columns of the shard directories, in shard order,
+    # into the final output directory
+    @staticmethod
+    def merge(part_paths, out_filepath):
+        makedirs(out_filepath, exist_ok=True)
+        for name, dtype in HIT_DTYPES.items():
+            sources = []
+            nrows = 0
+            for part_path in part_paths:
+                npy_path = join(part_path, name + ".npy")
+                with open(npy_path, "rb") as f:
+                    np.lib.format.read_magic(f)
+                    shape, _, _ = np.lib.format.read_array_header_1_0(f)
+                    sources.append((npy_path, f.tell()))
+                nrows += shape[0]
+            write_npy(join(out_filepath, name + ".npy"), dtype, nrows, sources)
+
+
+# Writes a 1-D .npy file of nrows elements whose data is the concatenation
+# of the given (path, offset) sources, copied in chunks
+def write_npy(npy_path, dtype, nrows, sources):
+    header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": (nrows,)}
+    with open(npy_path, "wb") as fout:
+        np.lib.format.write_array_header_1_0(fout, header)
+        for path, offset in sources:
+            with open(path, "rb") as fin:
+                fin.seek(offset)
+                shutil.copyfileobj(fin, fout)
+
+
+# Loads a directory written by NpyWriter as a dict of memory mapped columns
+def load_columns(path):
+    return {name: np.load(join(path, name + ".npy"), mmap_mode="r") for name in HIT_DTYPES}
+
+
+WRITERS = {"csv": CSVWriter, "parquet": ParquetWriter, "npy": NpyWriter}
+
+
+# Converts one query_fetch_array batch (a numpy structured array with the
+# columns of make_sql) into a dataframe with the output columns
+def batch_to_df(res):
+    col = [res[name] for name in res.dtype.names]
+    return pd.DataFrame(
+        {
+            "layer": col[8],
+            "row": col[0],
+            "module": col[1],
+            "channel": col[2],
+            "adcdata": col[3],
+            "asiceventcode": col[4],
+            "eventid": col[5],
+            "gcutime": col[7],
+        }
+    ).astype(HIT_DTYPES)
 
-    out_filepath = join(filepath, filename)
-    print("\nSAVED: " + filename)
-    pd.to_csv(out_filepath)
 
-# It downloads data from the database, and returns it as a pandas dataframe
+# Aggregates the progress of all the shards into a single progress bar.
+# Each shard reports how many seconds of its own interval are done.
+class ShardProgress:
+    def __init__(self, bar, nshards):
+        self.bar = bar
+        self.done = [0] * nshards
+        self.lock = Lock()
+
+    def update(self, index, seconds):
+        with self.lock:
+            self.done[index] = seconds
+            self.bar.goto(sum(self.done))
+
+
+# Number of shards when it is not given: one per worker, and for a resumable
+# download at least one per RESUME_SHARD_SECONDS of the window
+def default_nshards(tstart, tstop, workers, resume):
+    if not resume:
+        return workers
+    return max(workers, -(-(tstop - tstart) // RESUME_SHARD_SECONDS))
+
+
+# Splits [tstart, tstop) into nshards contiguous gcutime intervals
+def split_shards(tstart, tstop, nshards):
+    edges = [tstart + ((tstop - tstart) * i) // nshards for i in range(nshards + 1)]
+    return [(edges[i], edges[i + 1]) for i in range(nshards) if edges[i] < edges[i + 1]]
+
+
+# Hits of one page of tracker packets, {page} stands for the packets of the
+# page (see DBInterface.query_page)
+PAGE_SQL = (
+    "select gfptrackerpacket.row, module, channel, adcdata, asiceventcode, gfptrackerevent.eventid, gfptrackerevent.eventtime, gfptrackerpacket.gcutime, gfptrackerpacket.sysid - 128 "
+    "from {page} as gfptrackerpacket "
+    "join gfptrackerevent on gfptrackerevent.parent = gfptrackerpacket.rowid "
+    "join gfptrackerhit on gfptrackerhit.parent = gfptrackerevent.rowid "
+    "order by gfptrackerpacket.gcutime, gfptrackerpacket.rowid, gfptrackerevent.rowid, "
+    "gfptrackerhit.row, gfptrackerhit.module, gfptrackerhit.channel"
+)
+
+
+# Downloads the interval [tstart, tstop) on its own DB connection and
+# streams it to out_filepath with the given writer class. The shard is
+# fetched in pages of packets, each page starting after the (gcutime, rowid)
+# key of the last written packet, so after a lost connection the shard
+# reconnects and carries on where it stopped
+def download_shard(tstart, tstop, out_filepath, progress, index, writer_class=CSVWriter):
+    writer = writer_class(out_filepath)
+    after = None
+    retries = 0
+
+    while True:
+        try:
+            dbi = DBInterface(path=SERVER_PATH, priority="bulk")
+            # the next page is fetched while this one is being written
+            for res, key in dbi.query_pages(PAGE_SQL, "gfptrackerpacket", tstart, tstop, FETCH_SIZE, after=after):
+                if len(res):
+                    progress.update(index, res[-1][7] - tstart)
+                    writer.write(batch_to_df(res))
+                after = key
+            break
+        except (EOFError, ConnectionError) as e:
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise
+            print(f"\nshard {index}: lost the server ({e}), resuming after {after}")
+            time.sleep(min(2**retries, 30))
+
+    writer.close()
+    progress.update(index, tstop - tstart)
+    return writer.nrows
+
+
+# Checkpoint manifest of a resumable download. It lives in the parts
+# directory next to the output file and records the shard boundaries and
+# which shards have been completely downloaded, so that a restarted
+# download only fetches the missing gcutime intervals.
+class ShardManifest:
+    def __init__(self, parts_dir, tstart, tstop, nshards, fmt="csv"):
+        self.parts_dir = parts_dir
+        self.writer_class = WRITERS[fmt]
+        self.path = join(parts_dir, "manifest.json")
+        self.lock = Lock()
+        if exists(self.path):
+            with open(self.path, "r") as f:
+                self.data = json.load(f)
+            if (
+                self.data["tstart"] != tstart
+                or self.data["tstop"] != tstop
+                or self.data.get("format", "csv") != fmt
+            ):
+                raise ValueError(
+                    f"manifest {self.path} belongs to a different time window or format, delete {parts_dir} to start over"
+                )
+        else:
+            makedirs(parts_dir, exist_ok=True)
+            self.data = {
+                "tstart": tstart,
+                "tstop": tstop,
+                "format": fmt,
+                "shards": split_shards(tstart, tstop, nshards),
+                "done": {},
+            }
+            self.save()
+        self.shards = [tuple(shard) for shard in self.data["shards"]]
+
+    def part_path(self, index):
+        return join(self.parts_dir, f"part_{index}.{self.writer_class.ext}")
+
+    def is_done(self, index):
+        return str(index) in self.data["done"] and exists(self.part_path(index))
+
+    def mark_done(self, index, nrows):
+        with self.lock:
+            self.data["done"][str(index)] = {"rows": nrows}
+            self.save()
+
+    def save(self):
+        # write to a temporary file first so that an interruption never
+        # leaves a truncated manifest behind
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=1)
+        replace(tmp_path, self.path)
+
+
+# Downloads one shard of a resumable download. The shard is written to a
+# temporary file which is only renamed to its final name, and recorded in
+# the manifest, once the whole interval has been fetched.
+def download_checkpointed_shard(manifest, index, progress):
+    tstart, tstop = manifest.shards[index]
+    part_path = manifest.part_path(index)
+    nrows = download_shard(tstart, tstop, part_path + ".tmp", progress, index, manifest.writer_class)
+    replace(part_path + ".tmp", part_path)
+    manifest.mark_done(index, nrows)
+
+
+# It downloads data from the database, and streams it batch by batch to a CSV file
 # :param tstart: The start time of the data you want to download
 # :param tstop: the end time of the data you want to download
-# :return: A dataframe with the columns: row, module, channel, adcdata, asiceventcode
+# :param workers: number of parallel connections to the server
+# :param nshards: number of gcutime shards the window is split into, see default_nshards
+# :param resume: keep completed shards next to the output and skip them when restarting
+# :param fmt: output format, one of the keys of WRITERS
 # row, module, channel, adcdata, asiceventcode = DownloadData(1676468100, 1676471700)
 
 
-def download_data(datetime_start, datetime_stop, fp):
+def download_data(datetime_start, datetime_stop, fp, workers=1, nshards=None, resume=False, fmt="csv"):
 
     # Datetime to timestamp conversion
     tstart = datetime_to_timestamp(datetime_start.day, datetime_start.month,
@@ -46,64 +372,60 @@ def download_data(datetime_start, datetime_stop, fp):
     tstop = datetime_to_timestamp(datetime_stop.day, datetime_stop.month,
                                          datetime_stop.year, datetime_stop.hour, datetime_stop.minute, datetime_stop.second)
 
-    sql = (
-        "select gfptrackerpacket.row, module, channel, adcdata, asiceventcode, gfptrackerevent.eventid, gfptrackerevent.eventtime, gfptrackerpacket.gcutime, gfptrackerpacket.sysid - 128 from gfptrackerhit "
-        "join gfptrackerevent on gfptrackerevent.rowid = gfptrackerhit.parent "
-        "join gfptrackerpacket on gfptrackerpacket.rowid = gfptrackerevent.parent "
-    )
-    sql += f"where gcutime >= {tstart} and gcutime < {tstop}"
+    if nshards is None:
+        nshards = default_nshards(tstart, tstop, workers, resume)
 
-    q = GSEQuery(path="127.0.0.1:44555")
-    q.dbi.query_start(sql)
+    writer_class = WRITERS[fmt]
+    filename = make_filename(datetime_start, datetime_stop, ext=writer_class.ext)
+    out_filepath = join(fp, filename)
 
     print("REQUESTED: " + str(tstop-tstart) + " seconds of data")
     bar = IncrementalBar(max=tstop - tstart)
 
-    downloaded_data_df = pd.DataFrame(
-        columns=[
-            "layer",
-            "row",
-            "module",
-            "channel",
-            "adcdata",
-            "asiceventcode",
-            "eventid",
-            "gcutime",
-        ]
-    )
-
-    res = np.array(q.dbi.query_fetch(100000))
-
-    while len(res) > 0:
-        bar.goto(res[-1, 7] - tstart)
-
-        # Append data
-        row = res[:, 0]
-        module = res[:, 1]
-        channel = res[:, 2]
-        adcdata = res[:, 3]
-        asiceventcode = res[:, 4]
-        eventid = res[:, 5]
-        gcutime = res[:, 7]
-        layer = res[:, 8]
-
-        row_to_append = pd.DataFrame(
-            {
-                "layer": layer,
-                "row": row,
-                "module": module,
-                "channel": channel,
-                "adcdata": adcdata,
-                "asiceventcode": asiceventcode,
-                "eventid": eventid,
-                "gcutime": gcutime,
-            }
-        )
-        downloaded_data_df = pd.concat([downloaded_data_df, row_to_append])
-        res = np.array(q.dbi.query_fetch(100000))
+    if resume:
+        manifest = ShardManifest(out_filepath + ".parts", tstart, tstop, nshards, fmt=fmt)
+        shards = manifest.shards
+        progress = ShardProgress(bar, len(shards))
+        todo = []
+        for i, (t1, t2) in enumerate(shards):
+            if manifest.is_done(i):
+                progress.update(i, t2 - t1)
+            else:
+                todo.append(i)
+        if len(todo) < len(shards):
+            print(f"RESUMING: {len(shards) - len(todo)} of {len(shards)} shards already downloaded")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(download_checkpointed_shard, manifest, i, progress)
+                for i in todo
+            ]
+            for future in futures:
+                future.result()
+        part_paths = [manifest.part_path(i) for i in range(len(shards))]
+        writer_class.merge(part_paths, out_filepath)
+        shutil.rmtree(manifest.parts_dir)
+    else:
+        shards = split_shards(tstart, tstop, nshards)
+        progress = ShardProgress(bar, len(shards))
+        if len(shards) == 1:
+            download_shard(tstart, tstop, out_filepath, progress, 0, writer_class)
+        else:
+            # every shard is streamed to its own part file, the parts are
+            # merged in time order once all of them are complete
+            parts_dir = mkdtemp(prefix=".parts_", dir=fp)
+            part_paths = [join(parts_dir, f"part_{i}.{writer_class.ext}") for i in range(len(shards))]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(download_shard, t1, t2, part_paths[i], progress, i, writer_class)
+                    for i, (t1, t2) in enumerate(shards)
+                ]
+                for future in futures:
+                    future.result()
+            writer_class.merge(part_paths, out_filepath)
+            shutil.rmtree(parts_dir)
 
     bar.finish()
-    pd_to_csv(downloaded_data_df, fp, datetime_start, datetime_stop)
+    print("\nSAVED: " + filename)
 
 
 # Datetime to timestamp converter function
@@ -116,21 +438,48 @@ def datetime_to_timestamp(day, month, year, hour, minutes, seconds=0):
     return dtimestamp
 
 
-# Ask user input for data taking
-datetime_str_start = input("Start datetime [dd/mm/yyyy, hh:mm:ss]: ")
-datetime_str_stop = input(" Stop datetime [dd/mm/yyyy, hh:mm:ss]: ")
-filepath_folder = input("                 Download folder path: ")
+if __name__ == "__main__":
+    p = ArgumentParser()
+    p.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of parallel connections to the server, default is 1",
+    )
+    p.add_argument(
+        "--shards",
+        type=int,
+        help="number of gcutime shards the window is split into, default is the number of workers "
+        f"(with --resume, at least one shard per {RESUME_SHARD_SECONDS} seconds)",
+    )
+    p.add_argument(
+        "--resume",
+        action="store_true",
+        help="checkpoint completed shards next to the output file and resume an interrupted download",
+    )
+    p.add_argument(
+        "--format",
+        choices=list(WRITERS),
+        default="csv",
+        help="output format: csv, parquet (needs pyarrow) or npy (directory of memory mappable .npy columns), default is csv",
+    )
+    args = p.parse_args()
+
+    # Ask user input for data taking
+    datetime_str_start = input("Start datetime [dd/mm/yyyy, hh:mm:ss]: ")
+    datetime_str_stop = input(" Stop datetime [dd/mm/yyyy, hh:mm:ss]: ")
+    filepath_folder = input("                 Download folder path: ")
 
-datetime_start = datetime.strptime(datetime_str_start, r"%d/%m/%Y, %H:%M:%S")
-datetime_stop = datetime.strptime(datetime_str_stop, r"%d/%m/%Y, %H:%M:%S")
+    datetime_start = datetime.strptime(datetime_str_start, r"%d/%m/%Y, %H:%M:%S")
+    datetime_stop = datetime.strptime(datetime_str_stop, r"%d/%m/%Y, %H:%M:%S")
 
-datetime_start_ts = datetime_to_timestamp(datetime_start.day, datetime_start.month,
-                                          datetime_start.year, datetime_start.hour, datetime_start.minute, datetime_start.second)
-datetime_stop_ts = datetime_to_timestamp(datetime_stop.day, datetime_stop.month,
-                                         datetime_stop.year, datetime_stop.hour, datetime_stop.minute, datetime_stop.second)
+    datetime_start_ts = datetime_to_timestamp(datetime_start.day, datetime_start.month,
+                                              datetime_start.year, datetime_start.hour, datetime_start.minute, datetime_start.second)
+    datetime_stop_ts = datetime_to_timestamp(datetime_stop.day, datetime_stop.month,
+                                             datetime_stop.year, datetime_stop.hour, datetime_stop.minute, datetime_stop.second)
 
-print("\n*** DOWNLOADING DATA ***")
-print("START: " + str(datetime_start) + " [" + str(datetime_start_ts) + "]")
-print(" STOP: " + str(datetime_stop) + " [" + str(datetime_stop_ts) + "]\n")
+    print("\n*** DOWNLOADING DATA ***")
+    print("START: " + str(datetime_start) + " [" + str(datetime_start_ts) + "]")
+    print(" STOP: " + str(datetime_stop) + " [" + str(datetime_stop_ts) + "]\n")
 
-download_data(datetime_start, datetime_stop, filepath_folder)
+    download_data(datetime_start, datetime_stop, filepath_folder, workers=args.workers, nshards=args.shards, resume=args.resume, fmt=args.format)
@@ -0,0 +1,6 @@
+import sys
+from os.path import abspath, dirname, join
+
+# download_data_GAPS_db.py lives at the top of the repository and imports pybfsw from bfsw-main
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path[:0] = [ROOT, join(ROOT, "bfsw-main")]
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("quickle", exc_type=ImportError)
+dl = pytest.importorskip("download_data_GAPS_db")
+
+
+def hits(n, t0):
+    return pd.DataFrame({name: np.arange(n) for name in dl.HIT_DTYPES}).assign(gcutime=t0 + np.arange(n)).astype(
+        dl.HIT_DTYPES
+    )
+
+
+def write_part(path, batches):
+    writer = dl.CSVWriter(str(path))
+    for batch in batches:
+        writer.write(batch)
+    writer.close()
+    return writer.nrows
+
+
+def test_empty_window_has_header(tmp_path):
+    path = tmp_path / "empty.csv"
+    assert write_part(path, []) == 0
+    df = pd.read_csv(path, index_col=0)
+    assert list(df.columns) == list(dl.HIT_DTYPES)
+    assert len(df) == 0
+
+
+def test_batches_are_appended(tmp_path):
+    path = tmp_path / "part.csv"
+    assert write_part(path, [hits(3, 0), hits(2, 10)]) == 5
+    df = pd.read_csv(path, index_col=0)
+    assert list(df["gcutime"]) == [0, 1, 2, 10, 11]
+
+
+@pytest.mark.parametrize("sizes", [(0, 5, 7), (4, 0, 6), (3, 4, 0), (0, 0, 0)])
+def test_merge_keeps_one_header(tmp_path, sizes):
+    parts = []
+    for i, n in enumerate(sizes):
+        parts.append(str(tmp_path / f"part_{i}.csv"))
+        write_part(parts[-1], [hits(n, 100 * i)] if n else [])
+    out = tmp_path / "merged.csv"
+    dl.CSVWriter.merge(parts, str(out))
+    df = pd.read_csv(out, index_col=0)
+    assert list(df.columns) == list(dl.HIT_DTYPES)
+    assert len(df) == sum(sizes)
+    expected = np.concatenate([100 * i + np.arange(n) for i, n in enumerate(sizes)])
+    assert np.array_equal(df["gcutime"].to_numpy(), expected)
+
+
+def test_split_shards_covers_window():
+    shards = dl.split_shards(1000, 1010, 4)
+    assert shards[0][0] == 1000 and shards[-1][1] == 1010
+    assert all(a[1] == b[0] for a, b in zip(shards, shards[1:]))
+
+
+def test_resume_splits_the_window_by_time():
+    hour = 3600
+    assert dl.default_nshards(0, hour, 1, resume=False) == 1
+    assert dl.default_nshards(0, hour, 1, resume=True) == hour // dl.RESUME_SHARD_SECONDS
+    assert dl.default_nshards(0, hour + 1, 1, resume=True) == hour // dl.RESUME_SHARD_SECONDS + 1
+    assert dl.default_nshards(0, 60, 4, resume=True) == 4